@@ -0,0 +1,85 @@
+"""Helpers to run the benchmarks against a local ipcluster."""
+
+import os
+import subprocess
+import time
+from contextlib import contextmanager, suppress
+
+PROFILE = "hpc05-bench"
+
+
+def ipcluster(*args, profile=PROFILE):
+    subprocess.run(
+        ["ipcluster", *args, f"--profile={profile}"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def connect(profile=PROFILE, timeout=60):
+    """Connect to the controller of `profile`, as soon as it's up."""
+    import ipyparallel
+
+    t_start = time.time()
+    while True:
+        try:
+            return ipyparallel.Client(profile=profile, timeout=timeout)
+        except OSError:  # the connection file doesn't exist yet
+            if time.time() - t_start > timeout:
+                raise
+            time.sleep(0.1)
+
+
+@contextmanager
+def local_cluster(n, profile=PROFILE):
+    """Start an ipcluster with `n` engines, yield a connected client, and stop it.
+
+    The engines inherit the environment, so run the benchmarks with hpc05
+    installed (``pip install -e .``) or on the ``PYTHONPATH``.
+    """
+    ipcluster("stop", profile=profile)  # a leftover of an interrupted benchmark
+    ipcluster("start", f"--n={n}", "--daemonize", profile=profile)
+    client = None
+    try:
+        client = connect(profile)
+        client.wait_for_engines(n, timeout=120)
+        yield client
+    finally:
+        if client is not None:
+            with suppress(Exception):
+                client.shutdown(hub=True)
+        ipcluster("stop", profile=profile)
+
+
+def start_engine(profile=PROFILE):
+    """Start one engine in the background, returns its `subprocess.Popen`."""
+    return subprocess.Popen(
+        ["ipengine", f"--profile={profile}"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def rss(process=None):
+    """The resident memory (in MB) of `process` (by default this one)."""
+    import psutil
+
+    return (process or psutil.Process()).memory_info().rss / 1024**2
+
+
+def controller_rss(profile=PROFILE):
+    """The resident memory (in MB) of the controller and its schedulers."""
+    import glob
+    import json
+
+    import psutil
+    from IPython.paths import get_ipython_dir
+
+    pattern = os.path.join(
+        get_ipython_dir(), f"profile_{profile}", "security", "cluster-*.json"
+    )
+    (fname,) = glob.glob(pattern)
+    with open(fname) as f:
+        pid = json.load(f)["controller"]["state"]["pid"]
+    controller = psutil.Process(pid)
+    return sum(rss(p) for p in [controller, *controller.children(recursive=True)])
@@ -0,0 +1,72 @@
+"""Throughput of ``lview.map`` versus chunk size, and of `hpc05.chunked_map`.
+
+Maps a function that takes about 10 ms over the items on a local
+ipcluster, with fixed chunk sizes (``chunksize`` of ``lview.map``) and
+with the adaptive chunks of `hpc05.chunked_map`. The ideal throughput is
+``n_engines / duration``.
+
+    python benchmarks/bench_chunking.py --engines 4 --items 2000
+"""
+
+import argparse
+import time
+
+from _cluster import local_cluster
+
+from hpc05.chunking import chunked_map
+
+
+def work(x, duration):
+    import time
+
+    time.sleep(duration)
+    return x
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--engines", type=int, default=4)
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--duration", type=float, default=0.01)
+    parser.add_argument(
+        "--chunksizes", type=int, nargs="+", default=[1, 2, 5, 10, 20, 50, 100, 500]
+    )
+    parser.add_argument("--overheads", type=float, nargs="+", default=[0.1, 0.02])
+    args = parser.parse_args()
+
+    with local_cluster(args.engines) as client:
+        # Import hpc05 on the engines before, the first chunks would include it.
+        client[:].execute("import hpc05.chunking", block=True)
+        lview = client.load_balanced_view()
+        xs = list(range(args.items))
+        durations = [args.duration] * args.items
+        ideal = args.engines / args.duration
+        print(f"ideal: {ideal:.0f} items/s")
+
+        def report(name, run):
+            t_start = time.time()
+            results = run()
+            throughput = args.items / (time.time() - t_start)
+            assert sorted(results) == xs
+            print(
+                f"{name:>28}: {throughput:6.0f} items/s"
+                f" ({100 * throughput / ideal:3.0f}% of ideal)"
+            )
+
+        for chunksize in args.chunksizes:
+            report(
+                f"lview.map chunksize={chunksize}",
+                lambda: lview.map_sync(work, xs, durations, chunksize=chunksize),
+            )
+        for overhead in args.overheads:
+            chunks = chunked_map(lview, work, xs, durations, overhead=overhead)
+            report(f"chunked_map overhead={overhead}", lambda: list(chunks))
+            sizes = sorted(chunk["size"] for chunk in chunks.chunks)
+            print(
+                f"{'':>30}{len(sizes)} chunks of {sizes[0]} to {sizes[-1]} items,"
+                f" RTT {1000 * chunks.rtt:.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
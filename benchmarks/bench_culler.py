@@ -0,0 +1,130 @@
+"""Hub load of the engine culler with 1000 simulated engines.
+
+The old culler asked the hub for the ``queue_status`` of all engines every
+`interval` seconds. This times the hub's own handler (`Hub.queue_status`,
+which builds, serializes, and sends the reply) on a stand-in hub with
+``--engines`` engines.
+
+The event-driven culler sends no requests to the hub, it follows the status
+messages that the engines publish on the iopub channel anyway. This times how
+fast `EngineCuller` handles those, a busy and an idle status per task.
+
+    python benchmarks/bench_culler.py --engines 1000
+"""
+
+import argparse
+import asyncio
+import time
+from types import SimpleNamespace
+
+INTERVAL = 60  # the default interval of the culler
+
+
+class FakeStream:
+    def on_recv(self, callback):
+        pass
+
+
+def time_queue_status(n_engines, n_completed, repeat):
+    """Hub CPU time (in seconds) and size (in bytes) of a ``queue_status`` reply."""
+    import zmq
+    from ipyparallel.controller.hub import Hub
+    from jupyter_client.session import Session
+
+    context = zmq.Context.instance()
+    query, receiver = context.socket(zmq.PAIR), context.socket(zmq.PAIR)
+    for socket in (query, receiver):
+        socket.sndhwm = socket.rcvhwm = 0
+    receiver.bind("inproc://queue_status")
+    query.connect("inproc://queue_status")
+    ids = list(range(n_engines))
+    hub = SimpleNamespace(
+        session=Session(),
+        query=query,
+        queues={i: [] for i in ids},
+        tasks={i: [] for i in ids},
+        completed={i: [f"msg-{i}-{j}" for j in range(n_completed)] for i in ids},
+        unassigned=set(),
+        _validate_targets=lambda targets: ids,
+    )
+    request = hub.session.msg(
+        "queue_request", content={"targets": None, "verbose": False}
+    )
+    t_start = time.process_time()
+    for _ in range(repeat):
+        Hub.queue_status(hub, b"culler", request)
+    duration = (time.process_time() - t_start) / repeat
+    size = sum(len(frame) for frame in receiver.recv_multipart())
+    for _ in range(repeat - 1):
+        receiver.recv_multipart()
+    query.close()
+    receiver.close()
+    return duration, size
+
+
+async def time_status_messages(n_engines, n_tasks):
+    """Culler CPU time (in seconds) per status message."""
+    from jupyter_client.session import Session
+
+    from hpc05_culler import EngineCuller
+
+    session = Session()
+    client = SimpleNamespace(
+        ids=list(range(n_engines)),
+        session=session,
+        _iopub_stream=FakeStream(),
+        _notification_handlers={
+            "registration_notification": lambda msg: None,
+            "unregistration_notification": lambda msg: None,
+        },
+    )
+    culler = EngineCuller(
+        client, timeout=INTERVAL, interval=INTERVAL, mode="engine", cancel_jobs=False
+    )
+    messages = [
+        session.serialize(
+            session.msg("status", content={"execution_state": state}),
+            ident=f"engine.{eid}.status".encode(),
+        )
+        for _ in range(n_tasks)
+        for eid in range(n_engines)
+        for state in ("busy", "idle")
+    ]
+    t_start = time.process_time()
+    for msg_frames in messages:
+        culler._on_iopub(msg_frames)
+    await asyncio.sleep(0)  # run the callbacks of `_on_iopub`
+    duration = time.process_time() - t_start
+    assert culler.activity.n_busy == 0
+    return duration / len(messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--engines", type=int, default=1000)
+    parser.add_argument("--completed", type=int, default=1000, help="tasks per engine")
+    parser.add_argument("--repeat", type=int, default=100)
+    args = parser.parse_args()
+
+    duration, size = time_queue_status(args.engines, args.completed, args.repeat)
+    print(
+        f"queue_status polling: {1000 * duration:.2f} ms hub CPU and"
+        f" {size / 1024:.0f} kB per request, an engine is culled up to"
+        " `interval` seconds late"
+    )
+    for interval in (INTERVAL, 1):
+        print(
+            f"  every {interval:>2} s: {3600 / interval * duration:6.2f} s hub CPU"
+            f" and {3600 / interval * size / 1024**2:6.1f} MB per hour"
+        )
+    per_message = asyncio.run(time_status_messages(args.engines, 1))
+    print(
+        "event-driven: 0 requests to the hub,"
+        f" {1e6 * per_message:.1f} µs culler CPU per status message"
+        " (a busy and an idle status per task),"
+        " an engine is culled when its timeout passes"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Messages per second and client CPU of `hpc05_monitor` at 1000 engines.
+
+The old transport published a pickled dict (with a `datetime`, the
+hostname, and the pid) every `interval` seconds on every engine, and the
+client deserialized every message with ``session.deserialize`` and
+``serialize.deserialize_object``. The new one publishes a binary record,
+only when the usage changed by more than `threshold` percent (or as a
+heartbeat), and the client decodes the records in batches.
+
+The engines are simulated: half of them are idle (a steady CPU and memory
+usage) and half of them run tasks (a noisy CPU usage and a growing memory
+usage), the number of records follows from the rule in
+`hpc05_monitor.publish_data_forever`. The client CPU is measured on the
+serialized messages of these engines.
+
+    python benchmarks/bench_monitor.py --engines 1000
+"""
+
+import argparse
+import socket
+import time
+from datetime import datetime
+
+import numpy as np
+
+
+def traces(n_engines, n_ticks, seed=0):
+    """The simulated cpu, mem, and rss (engines x ticks) of the engines."""
+    rng = np.random.default_rng(seed)
+    busy = np.arange(n_engines) % 2 == 1
+    cpu = np.where(busy, 90, 1)[:, None] + rng.normal(0, 1, (n_engines, n_ticks)) * (
+        np.where(busy, 5, 0.2)[:, None]
+    )
+    growth = np.where(busy, 0.05, 0.0)[:, None]
+    mem = 30 + np.cumsum(growth + rng.normal(0, 0.02, (n_engines, n_ticks)), axis=1)
+    rss = 1e9 * mem / 30
+    return np.clip(cpu, 0, 100), mem, rss
+
+
+def n_published(cpu, mem, rss, interval, threshold, heartbeat):
+    """The number of records per engine, see `hpc05_monitor.publish_data_forever`."""
+    n_engines, n_ticks = cpu.shape
+    n = np.zeros(n_engines, dtype=int)
+    last = np.zeros(n_engines, dtype=int)
+    n_heartbeats = 0
+    for tick in range(n_ticks):
+        is_heartbeat = tick * interval % heartbeat == 0
+        n_heartbeats += is_heartbeat
+        changed = (
+            (tick == 0)
+            | (np.abs(cpu[:, tick] - cpu[np.arange(n_engines), last]) >= threshold)
+            | (np.abs(mem[:, tick] - mem[np.arange(n_engines), last]) >= threshold)
+            | (
+                np.abs(rss[:, tick] - rss[np.arange(n_engines), last])
+                >= threshold / 100 * rss[np.arange(n_engines), last]
+            )
+        )
+        publish = changed | is_heartbeat
+        n += publish
+        last = np.where(publish, tick, last)
+    return n.sum(), n_heartbeats * n_engines
+
+
+def old_messages(session, n_engines):
+    from ipyparallel.serialize import serialize_object
+
+    messages = []
+    for eid in range(n_engines):
+        data = {
+            "engine_id": eid,
+            "date": datetime.utcnow(),
+            "cpu": 90.0,
+            "mem": 30.0,
+            "hostname": socket.gethostname(),
+            "pid": 1000 + eid,
+        }
+        msg = session.msg("data_message", content=dict(keys=list(data)))
+        messages.append(
+            session.serialize(msg, ident=b"datapub") + serialize_object(data)
+        )
+    return messages
+
+
+def old_collect_data(session, msg_frames, latest_data):
+    """`collect_data` of the old transport."""
+    from ipyparallel import serialize
+
+    idents, msg = session.feed_identities(msg_frames)
+    msg = session.deserialize(msg, content=True)
+    if msg["header"]["msg_type"] != "data_message":
+        return
+    data, remainder = serialize.deserialize_object(msg["buffers"])
+    latest_data[data["engine_id"]] = data
+
+
+def new_messages(session, n_engines, heartbeat):
+    import zmq
+
+    import hpc05_monitor
+
+    messages = []
+    for eid in range(n_engines):
+        usage = {name: 1.0 for name, _ in hpc05_monitor.RECORD_FIELDS}
+        usage.update(engine_id=eid, pid=1000 + eid, hostname=socket.gethostname())
+        record = hpc05_monitor.RECORD.pack(
+            *[usage[name] for name, _ in hpc05_monitor.RECORD_FIELDS]
+        )
+        content = {"hostname": usage["hostname"]} if heartbeat else {}
+        msg = session.msg("data_message", content=content)
+        frames = session.serialize(msg, ident=hpc05_monitor.TOPIC) + [record]
+        messages.append([zmq.Frame(frame) for frame in frames])
+    return messages
+
+
+def cpu_per_message(f, make_messages, repeat):
+    # New messages every time, the session rejects a signature it has seen.
+    batches = [make_messages() for _ in range(repeat + 1)]
+    f(batches.pop())  # e.g. allocate the buffers of `HISTORY` for all engines
+    t_start = time.process_time()
+    for messages in batches:
+        f(messages)
+    return (time.process_time() - t_start) / sum(map(len, batches))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--engines", type=int, default=1000)
+    parser.add_argument("--interval", type=float, default=5)
+    parser.add_argument("--threshold", type=float, default=1)
+    parser.add_argument("--heartbeat", type=float, default=60)
+    parser.add_argument("--duration", type=float, default=3600)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    from jupyter_client.session import Session
+
+    import hpc05_monitor
+
+    n_ticks = int(args.duration / args.interval)
+    n_old = args.engines * n_ticks
+    n_new, n_heartbeats = n_published(
+        *traces(args.engines, n_ticks), args.interval, args.threshold, args.heartbeat
+    )
+    session = Session()
+
+    latest_data = {}
+    old_cpu = cpu_per_message(
+        lambda msgs: [old_collect_data(session, m, latest_data) for m in msgs],
+        lambda: old_messages(session, args.engines),
+        args.repeat,
+    )
+
+    # The records that arrive within `BATCH_DELAY` are decoded at once.
+    batch_size = max(round(n_new / args.duration * hpc05_monitor.BATCH_DELAY), 1)
+
+    def collect_and_decode(msgs):
+        for i, m in enumerate(msgs, 1):
+            hpc05_monitor.collect_data(session, m)
+            if i % batch_size == 0:
+                hpc05_monitor.decode_records()
+        hpc05_monitor.decode_records()
+
+    hpc05_monitor.HISTORY = hpc05_monitor.UsageHistory(1000)
+    new_cpu, beat_cpu = (
+        cpu_per_message(
+            collect_and_decode,
+            lambda: new_messages(session, args.engines, heartbeat),
+            args.repeat,
+        )
+        for heartbeat in (False, True)
+    )
+    new_cpu = (n_heartbeats * beat_cpu + (n_new - n_heartbeats) * new_cpu) / n_new
+
+    for name, n, cpu, messages in [
+        ("dict every interval", n_old, old_cpu, old_messages(session, 1)),
+        ("binary, delta-only", n_new, new_cpu, new_messages(session, 1, False)),
+    ]:
+        rate = n / args.duration
+        size = np.mean([sum(len(frame) for frame in m) for m in messages])
+        print(
+            f"{name:>19}: {rate:6.1f} msgs/s ({size:4.0f} bytes each),"
+            f" {1e6 * cpu:5.1f} µs client CPU per message,"
+            f" {100 * rate * cpu:5.2f}% client CPU"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Latency of `hpc05.wait_for_engines` versus the old 1 second polling loop.
+
+Starts a controller without engines and then one engine at a time, and
+measures how long after the registration notification of the engine
+arrived at the client each wait function returns. The wait starts at a
+random moment after starting the engine, like in a real cluster where
+the engines register at random times.
+
+    python benchmarks/bench_registration.py --trials 10
+"""
+
+import argparse
+import io
+import random
+import statistics
+import time
+from contextlib import redirect_stdout
+
+from _cluster import local_cluster, start_engine
+
+from hpc05.connect import _poll_for_engines, wait_for_engines
+from hpc05.registration import get_watcher
+
+
+def measure(client, wait, registered, trials):
+    latencies = []
+    for _ in range(trials):
+        n = len(client) + 1
+        start_engine()
+        time.sleep(random.random())  # don't start polling in the same phase
+        with redirect_stdout(io.StringIO()):
+            wait(client, n, timeout=60)
+        t_return = time.time()
+        while len(registered) < n:  # the notification can arrive just after
+            time.sleep(0.001)
+        latencies.append(t_return - registered[n - 1])
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trials", type=int, default=10)
+    args = parser.parse_args()
+
+    with local_cluster(0) as client:
+        registered = []  # the arrival times of the registrations
+        get_watcher(client).callbacks.append(lambda _: registered.append(time.time()))
+        for name, wait in [
+            ("polling", _poll_for_engines),
+            ("notification", wait_for_engines),
+        ]:
+            latencies = measure(client, wait, registered, args.trials)
+            print(
+                f"{name:>12}: latency after registration"
+                f" mean {1000 * statistics.mean(latencies):7.1f} ms,"
+                f" max {1000 * max(latencies):7.1f} ms ({args.trials} engines)"
+            )
+
+
+if __name__ == "__main__":
+    main()
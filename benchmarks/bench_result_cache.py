@@ -0,0 +1,101 @@
+"""The hit path of `hpc05.cached_map` and the integrity check of `hpc05.ResultCache`.
+
+Fills a cache in a temporary folder with the results of ``--items`` points
+(a numpy array of ``--size`` bytes each), then times `cached_map` when all
+results are cached, split into hashing the function, computing the keys,
+and reading the results. Then it corrupts ``--corrupt`` random results,
+times `ResultCache.verify`, and checks that exactly those are computed again.
+
+The hit path doesn't use the engines, so the cache is filled with an
+in-process view.
+
+    python benchmarks/bench_result_cache.py --items 10000
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from hpc05.result_cache import ResultCache, cached_map, function_hash
+
+
+def f(x, size):
+    import numpy as np
+
+    return np.full(size // 8, x, dtype=float)
+
+
+class InProcessView:
+    """Runs ``map_async`` right away, in this process."""
+
+    def map_async(self, f, *sequences, ordered=True):
+        return list(map(f, *sequences))
+
+
+def timed(f, *args, **kwargs):
+    t_start = time.perf_counter()
+    result = f(*args, **kwargs)
+    return result, time.perf_counter() - t_start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--size", type=int, default=1024, help="bytes per result")
+    parser.add_argument("--corrupt", type=int, default=100)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    try:
+        cache = ResultCache(folder)
+        view = InProcessView()
+        xs = list(range(args.items))
+        sizes = [args.size] * args.items
+        _, t_fill = timed(cached_map, view, f, xs, sizes, cache=cache)
+        n = args.items
+        print(
+            f"fill: {1e6 * t_fill / n:6.1f} µs per result"
+            f" ({n} results, {cache.size / 1024**2:.1f} MB)"
+        )
+
+        cache.misses = 0
+        _, t_hit = timed(cached_map, view, f, xs, sizes, cache=cache)
+        assert cache.misses == 0
+        f_hash, t_hash = timed(function_hash, f)
+        keys, t_keys = timed(
+            lambda: [cache.key(f_hash, args) for args in zip(xs, sizes)]
+        )
+        _, t_read = timed(lambda: [cache[key] for key in keys])
+        print(
+            f"hit:  {1e6 * t_hit / n:6.1f} µs per result, of which hashing f"
+            f" {1e3 * t_hash:.1f} ms in total, keys {1e6 * t_keys / n:.1f} µs,"
+            f" and reading {1e6 * t_read / n:.1f} µs per result"
+        )
+
+        corrupted = set(random.Random(0).sample(keys, args.corrupt))
+        for key in corrupted:
+            with open(cache.path(key), "r+b") as fh:
+                fh.seek(-1, os.SEEK_END)
+                last = fh.read(1)
+                fh.seek(-1, os.SEEK_END)
+                fh.write(bytes([last[0] ^ 0xFF]))
+        removed, t_verify = timed(cache.verify)
+        assert set(removed) == corrupted
+        print(
+            f"verify: {1e6 * t_verify / n:6.1f} µs per result"
+            f" ({n / t_verify:.0f} results/s), found all {len(removed)} corrupted"
+        )
+        cache.misses = 0
+        results = cached_map(view, f, xs, sizes, cache=cache)
+        assert cache.misses == args.corrupt
+        assert all(r[0] == x for r, x in zip(results, xs))
+        print(f"after verify: computed {cache.misses} results again")
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Simulation of `hpc05.MemoryAwareView` on a cluster with skewed engines.
+
+The cluster has nodes with the same number of engines, but some of them
+have little free memory (other jobs use it) and some of them are busy with
+other jobs, there the tasks run twice as slow. Every task uses a fixed
+amount of memory while it runs, when a node runs out of memory the task
+that started last is killed (OOM), its engine restarts, and the task is
+submitted again.
+
+The tasks are submitted in batches, like a large ``map`` in several calls,
+and a free engine takes the oldest task that may run on it. With the plain
+load-balanced view every task may run anywhere, with the `MemoryAwareView`
+only on the targets it chose (with the real `MemoryAwareView.targets`)
+from the telemetry, which is updated every 5 seconds like `hpc05_monitor`.
+This is done with the nodes that have little free memory near exhaustion
+and with some room for tasks, see ``--tight-mem``.
+
+    python benchmarks/bench_routing.py --seeds 5
+"""
+
+import argparse
+from collections import deque
+from types import SimpleNamespace
+
+import numpy as np
+
+DT = 0.1  # time step in seconds
+
+
+def cluster(n_nodes, tight_mem, rng):
+    """The background memory (in %) and CPU (in %) of the nodes."""
+    n_tight = n_nodes // 4  # nodes with little free memory
+    n_busy = n_nodes // 4  # nodes that are busy with other jobs
+    kind = rng.permutation(
+        ["tight"] * n_tight
+        + ["busy"] * n_busy
+        + ["free"] * (n_nodes - n_tight - n_busy)
+    )
+    bg_mem = np.where(kind == "tight", tight_mem, 20.0)
+    bg_cpu = np.where(kind == "busy", 95.0, 5.0)
+    return bg_mem, bg_cpu
+
+
+def simulate(aware, tight_mem, args, seed):
+    from hpc05.routing import MemoryAwareView
+
+    rng = np.random.default_rng(seed)
+    n_engines = args.nodes * args.engines_per_node
+    node = np.arange(n_engines) // args.engines_per_node
+    bg_mem, bg_cpu = cluster(args.nodes, tight_mem, rng)
+    durations = rng.lognormal(np.log(args.duration), 0.5, args.tasks)
+
+    data = {}  # the telemetry, like `hpc05_monitor.LATEST_DATA`
+    view = SimpleNamespace(
+        targets=None, client=SimpleNamespace(ids=list(range(n_engines)))
+    )
+    router = MemoryAwareView(view, data=data)
+
+    running = {}  # engine -> [task, remaining work, start time]
+    down_until = np.zeros(n_engines)
+    pending = deque()  # (task, targets)
+    submitted = {}  # task -> first submission time
+    finished = {}
+    next_task, n_oom, t = 0, 0, 0.0
+
+    def submit(tasks):
+        targets = set(router.targets()) if aware else None
+        for task in tasks:
+            submitted.setdefault(task, t)
+            pending.append((task, targets))
+
+    while len(finished) < args.tasks:
+        # Keep a backlog, like submitting a large map in several calls.
+        if len(pending) < n_engines and next_task < args.tasks:
+            batch = range(next_task, min(next_task + args.batch, args.tasks))
+            submit(batch)
+            next_task = batch.stop
+
+        # Free engines take the oldest task that may run on them.
+        for eid in range(n_engines):
+            if eid in running or down_until[eid] > t:
+                continue
+            for i, (task, targets) in enumerate(pending):
+                if targets is None or eid in targets:
+                    del pending[i]
+                    running[eid] = [task, durations[task], t]
+                    break
+
+        # Run the tasks, twice as slow on busy nodes.
+        n_running = np.bincount([node[e] for e in running], minlength=args.nodes)
+        for eid, task in list(running.items()):
+            task[1] -= DT * (0.5 if bg_cpu[node[eid]] > 50 else 1.0)
+            if task[1] <= 0:
+                finished[task[0]] = t
+                del running[eid]
+
+        # Nodes without free memory kill the task that started last.
+        mem = bg_mem + args.task_mem * n_running
+        for n in np.flatnonzero(mem > 100):
+            eids = [e for e in running if node[e] == n]
+            eid = max(eids, key=lambda e: running[e][2])
+            task = running.pop(eid)[0]
+            down_until[eid] = t + args.restart
+            n_oom += 1
+            submit([task])
+
+        # The telemetry of every engine, updated every 5 seconds.
+        if round(t / DT) % round(args.interval / DT) == 0:
+            cpu = np.minimum(bg_cpu + 100 * n_running / args.engines_per_node, 100)
+            for eid in range(n_engines):
+                data[eid] = {"cpu": cpu[node[eid]], "mem": mem[node[eid]]}
+        t += DT
+
+    latency = np.array([finished[i] - submitted[i] for i in range(args.tasks)])
+    return t, np.percentile(latency, 50), np.percentile(latency, 99), n_oom
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=16)
+    parser.add_argument("--engines-per-node", type=int, default=8)
+    parser.add_argument("--tasks", type=int, default=2000)
+    parser.add_argument("--duration", type=float, default=20, help="median, seconds")
+    parser.add_argument("--task-mem", type=float, default=5, help="% of a node")
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--interval", type=float, default=5)
+    parser.add_argument("--restart", type=float, default=30)
+    parser.add_argument("--seeds", type=int, default=5)
+    parser.add_argument(
+        "--tight-mem",
+        type=float,
+        nargs="+",
+        default=[88, 70],
+        help="background memory (in %%) of the nodes with little free memory",
+    )
+    args = parser.parse_args()
+
+    for tight_mem in args.tight_mem:
+        print(f"Nodes with {tight_mem:.0f}% of their memory in use by other jobs:")
+        for name, aware in [("LoadBalancedView", False), ("MemoryAwareView", True)]:
+            results = np.array(
+                [simulate(aware, tight_mem, args, seed) for seed in range(args.seeds)]
+            )
+            makespan, p50, p99, n_oom = results.mean(axis=0)
+            print(
+                f"{name:>18}: makespan {makespan:6.0f} s, task latency p50"
+                f" {p50:5.0f} s, p99 {p99:5.0f} s, {n_oom:5.1f} OOM kills"
+            )
+
+
+if __name__ == "__main__":
+    main()
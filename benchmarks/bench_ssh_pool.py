@@ -0,0 +1,233 @@
+"""Number of ssh handshakes per workflow, with and without the connection pool.
+
+Runs the ssh calls of `hpc05.start_remote_and_connect` (kill, start, polling
+for the connection file, copying it, the tunnel, and the culler), of
+`hpc05.connect_ipcluster` (reconnecting to a running cluster), and of
+`hpc05.kill_remote_ipcluster` against a local paramiko test server, which
+is reached through a ProxyCommand, like a cluster behind a gateway.
+The server doesn't run the commands, it only answers the start command
+with the line that `start_remote_ipcluster` waits for.
+
+Without the pool every call makes a new connection (like `setup_ssh`),
+which is simulated by closing the pool's connections after every call.
+
+    python benchmarks/bench_ssh_pool.py --repeat 5
+"""
+
+import argparse
+import io
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+
+import paramiko
+
+PROFILE = "bench"
+HOSTNAME = "bench"
+USERNAME = "bench"
+
+
+def relay(port):
+    """The ProxyCommand, forward stdin and stdout to the server at `port`."""
+    sock = socket.create_connection(("127.0.0.1", port))
+
+    def upstream():
+        while True:
+            data = os.read(0, 65536)
+            if not data:
+                sock.shutdown(socket.SHUT_WR)
+                return
+            sock.sendall(data)
+
+    threading.Thread(target=upstream, daemon=True).start()
+    while True:
+        data = sock.recv(65536)
+        if not data:
+            return
+        os.write(1, data)
+
+
+class Server(paramiko.ServerInterface):
+    root = None  # the folder with the remote files
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_pty_request(self, *args):
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        def run():
+            if b"start_ipcluster" in command:
+                # The controller writes a new connection file.
+                with open(os.path.join(self.root, connection_file()), "w") as f:
+                    f.write(f'{{"started": {time.time()}}}')
+                channel.sendall(b"Engines appear to have started successfully\n")
+            channel.send_exit_status(0)
+            channel.close()
+
+        # Answer after paramiko replied to the exec request.
+        threading.Timer(0.01, run).start()
+        return True
+
+
+class Handle(paramiko.SFTPHandle):
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+
+class SFTP(paramiko.SFTPServerInterface):
+    root = None
+
+    def canonicalize(self, path):
+        return path
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(
+                os.stat(os.path.join(self.root, path.lstrip("/")))
+            )
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        try:
+            f = open(os.path.join(self.root, path.lstrip("/")), "rb")
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        handle = Handle(flags)
+        handle.readfile = f
+        return handle
+
+
+def serve(root):
+    """Start an ssh and sftp server (files in `root`), returns its port and
+    a list with the number of handshakes."""
+    Server.root = SFTP.root = root
+    host_key = paramiko.RSAKey.generate(2048)
+    n_handshakes = [0]
+
+    def handle(conn):
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(host_key)
+        transport.set_subsystem_handler("sftp", paramiko.SFTPServer, SFTP)
+        transport.start_server(server=Server())
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(100)
+
+    def accept():
+        while True:
+            conn, _ = sock.accept()
+            n_handshakes[0] += 1
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return sock.getsockname()[1], n_handshakes
+
+
+def connection_file():
+    from hpc05.connection_files import remote_connection_file
+
+    return remote_connection_file(PROFILE)
+
+
+def workflows():
+    """The ssh calls of the workflows, in the order in which hpc05 makes them."""
+    from hpc05.client import get_culler_cmd, start_remote_culler
+    from hpc05.connect import kill_remote_ipcluster, start_remote_ipcluster
+    from hpc05.connection_files import clear_connection_files, get_connection_file
+    from hpc05.ssh_utils import pooled_ssh
+    from hpc05.startup import _remote_stat
+
+    ssh_args = (HOSTNAME, None, "password")
+
+    def kill():
+        kill_remote_ipcluster(*ssh_args, profile=PROFILE)
+
+    def stat():
+        _remote_stat(connection_file(), *ssh_args)
+
+    def start():
+        start_remote_ipcluster(1, PROFILE, *ssh_args, timeout=10)
+
+    def copy():
+        with pooled_ssh(*ssh_args) as ssh, ssh.open_sftp() as sftp:
+            get_connection_file(sftp, connection_file(), HOSTNAME, PROFILE)
+
+    def tunnel():
+        with pooled_ssh(*ssh_args) as ssh:
+            ssh.get_transport()
+
+    def culler():
+        start_remote_culler(get_culler_cmd(PROFILE), *ssh_args)
+
+    poll = [stat] * 3  # `_wait_for_new_connection_file`, every 0.5 s
+    return {
+        "start_remote_and_connect": [kill, stat, start, *poll, copy, tunnel, culler],
+        "connect_ipcluster": [clear_connection_files, copy, tunnel, culler],
+        "kill_remote_ipcluster": [kill],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--relay", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.relay is not None:
+        return relay(args.relay)
+
+    home = tempfile.mkdtemp()
+    os.environ["HOME"] = home  # for ~/.ssh/config and the cached connection files
+    root = os.path.join(home, "remote")
+    os.makedirs(os.path.dirname(os.path.join(root, connection_file())))
+    port, n_handshakes = serve(root)
+    os.makedirs(os.path.join(home, ".ssh"))
+    with open(os.path.join(home, ".ssh", "config"), "w") as f:
+        f.write(
+            f"Host {HOSTNAME}\n"
+            f"    HostName 127.0.0.1\n"
+            f"    User {USERNAME}\n"
+            f"    ProxyCommand {sys.executable} {os.path.abspath(__file__)}"
+            f" --relay {port}\n"
+        )
+
+    from hpc05.ssh_utils import POOL
+
+    for name, steps in workflows().items():
+        for pooled in (False, True):
+            counts, durations = [], []
+            for _ in range(args.repeat):
+                POOL.close()
+                n_start, t_start = n_handshakes[0], time.time()
+                with redirect_stdout(io.StringIO()):
+                    for step in steps:
+                        step()
+                        if not pooled:
+                            POOL.close()
+                durations.append(time.time() - t_start)
+                counts.append(n_handshakes[0] - n_start)
+            mode = "pooled" if pooled else "a connection per call"
+            print(
+                f"{name:>24} ({mode:>20}): {statistics.mean(counts):4.1f} handshakes,"
+                f" {statistics.mean(durations):6.2f} s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Memory of the client and the hub during a long map, `hpc05.imap` versus ``lview.map``.
+
+Maps a function that returns ``--size`` bytes over ``--items`` items on a
+local ipcluster (``--chunksize`` items per task), and prints the resident
+memory (RSS) of the client and of the controller (the hub and the
+schedulers) every 10% of the items. With ``lview.map`` the client keeps
+every task and its result (the hub culls its oldest records), `hpc05.imap`
+purges them in the client and the hub after they are yielded. Run it once per ``--map``, the client doesn't return freed memory
+to the OS, so a second map in the same process would start from its peak.
+
+    python benchmarks/bench_streaming.py --map imap --items 20000
+    python benchmarks/bench_streaming.py --map lview.map --items 20000
+"""
+
+import argparse
+import time
+
+from _cluster import controller_rss, local_cluster, rss
+
+from hpc05.streaming import imap
+
+
+def payload(x, size):
+    return bytes(size)
+
+
+def consume(results, n_items):
+    """Iterate over `results` and sample the memory every 10%."""
+    samples = [(0, rss(), controller_rss())]
+    t_start = time.time()
+    for i, _ in enumerate(results, 1):
+        if i % (n_items // 10) == 0:
+            samples.append((i, rss(), controller_rss()))
+    return samples, time.time() - t_start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--map", choices=["imap", "lview.map"], default="imap")
+    parser.add_argument("--engines", type=int, default=4)
+    parser.add_argument("--items", type=int, default=20000)
+    parser.add_argument("--size", type=int, default=10_000, help="bytes per result")
+    parser.add_argument("--chunksize", type=int, default=10)
+    args = parser.parse_args()
+
+    with local_cluster(args.engines) as client:
+        client[:].execute("import hpc05.streaming", block=True)
+        lview = client.load_balanced_view()
+        xs, sizes, c = range(args.items), [args.size] * args.items, args.chunksize
+        if args.map == "imap":
+            results = imap(lview, payload, xs, sizes, chunksize=c)
+        else:
+            results = lview.map_async(payload, xs, sizes, chunksize=c)
+        samples, duration = consume(results, args.items)
+        print(f"{args.map} ({args.items / duration:.0f} items/s):")
+        print("   items  client MB  controller MB")
+        for i, client_mb, controller_mb in samples:
+            print(f"  {i:6d}  {client_mb:9.0f}  {controller_mb:13.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -21,11 +21,19 @@ available = [
             "start_ipcluster",
             "start_remote_ipcluster",
             "connect_ipcluster",
+            "wait_for_engines",
             "start_and_connect",
             "start_remote_and_connect",
             "kill_remote_ipcluster",
         ],
     ),
+    ("routing", ["MemoryAwareView"]),
+    ("chunking", ["chunked_map"]),
+    ("result_cache", ["ResultCache", "cached_map"]),
+    ("sweep", ["SweepRunner"]),
+    ("streaming", ["imap"]),
+    ("shared_arrays", ["broadcast", "clear_broadcast"]),
+    ("staging", ["stage", "StagedFile"]),
 ]
 
 for module, names in available:
@@ -0,0 +1,241 @@
+import math
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from contextlib import suppress
+
+
+def _run_chunk(f, items):
+    """Run `f` on the engine for every tuple of arguments in `items`."""
+    t_start = time.perf_counter()
+    results = [f(*args) for args in items]
+    return results, time.perf_counter() - t_start
+
+
+class ChunkedMap:
+    """Map `f` over `sequences` in chunks whose size adapts to the task duration.
+
+    The first chunk on every engine contains a single item, these measure
+    the round-trip time (RTT) and the time per item. Subsequent chunks are
+    large enough that the RTT is at most `overhead` times the time the
+    chunk takes to run, but at most ``remaining / (2 * n_engines)`` items
+    (guided self-scheduling), such that all engines finish at about the same time.
+
+    At most `in_flight` chunks per engine are submitted to the load-balanced
+    view, the scheduler hands them to the engines that are free, so idle
+    engines take over the remaining work of slow engines. When all chunks are
+    submitted and an engine is idle, chunks that run longer than
+    `straggler_factor` times their expected duration are submitted again,
+    the result that comes in first is used.
+
+    Iterate over the object to get the results, see `chunked_map`.
+
+    Attributes
+    ----------
+    rtt : float
+        The estimated round-trip time (in seconds), the minimal overhead of a chunk.
+    t_item : float
+        The estimated time (in seconds) per item.
+    chunks : list of dicts
+        For every finished chunk: its ``start``, ``size``, ``wall`` time
+        (from submitting to receiving), ``elapsed`` time on the engine,
+        and whether it was ``speculative``.
+    """
+
+    def __init__(
+        self,
+        view,
+        f,
+        *sequences,
+        ordered=True,
+        overhead=0.1,
+        max_chunk=None,
+        in_flight=2,
+        speculate=True,
+        straggler_factor=3,
+    ):
+        self.view = view
+        self.f = f
+        self.items = list(zip(*sequences))
+        self.ordered = ordered
+        self.overhead = overhead
+        self.max_chunk = max_chunk
+        self.in_flight = in_flight
+        self.speculate = speculate
+        self.straggler_factor = straggler_factor
+        self.rtt = None
+        self.t_item = None
+        self.chunks = []
+        self._n_done = 0
+        self._elapsed = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def n_engines(self):
+        targets = self.view.targets
+        if targets is None:
+            return max(len(self.view.client.ids), 1)
+        return 1 if isinstance(targets, int) else max(len(targets), 1)
+
+    def chunk_size(self, n_remaining):
+        """The size of the next chunk when `n_remaining` items are left."""
+        if self.t_item is None:
+            return 1  # measure first
+        if self.t_item > 0:
+            size = math.ceil(self.rtt / (self.overhead * self.t_item))
+        else:
+            size = n_remaining
+        # Leave enough chunks for the other engines.
+        size = max(min(size, math.ceil(n_remaining / (2 * self.n_engines))), 1)
+        if self.max_chunk is not None:
+            size = min(size, self.max_chunk)
+        return min(size, n_remaining)
+
+    def expected_duration(self, size):
+        return size * self.t_item + self.rtt
+
+    def _submit(self, start, stop):
+        return self.view.apply_async(_run_chunk, self.f, self.items[start:stop])
+
+    def _record(self, chunk, ar, now):
+        start, stop, t_submit, speculative = chunk
+        results, elapsed = ar.get()
+        wall = now - t_submit
+        self.rtt = wall - elapsed if self.rtt is None else min(self.rtt, wall - elapsed)
+        self.rtt = max(self.rtt, 0)
+        self._n_done += stop - start
+        self._elapsed += elapsed
+        self.t_item = self._elapsed / self._n_done
+        self.chunks.append(
+            dict(
+                start=start,
+                size=stop - start,
+                wall=wall,
+                elapsed=elapsed,
+                speculative=speculative,
+            )
+        )
+        return results
+
+    def _stragglers(self, running, duplicated, now):
+        """The running chunks that should be submitted again and the time to wait.
+
+        Chunks that finished while the results were being consumed are
+        still in `running` but are not stragglers.
+        """
+        stragglers, timeout = [], None
+        for ar, (start, stop, t_submit, _) in running.items():
+            if start in duplicated or ar.done():
+                continue
+            deadline = t_submit + self.straggler_factor * self.expected_duration(
+                stop - start
+            )
+            if deadline <= now:
+                stragglers.append((start, stop))
+            else:
+                timeout = min(timeout or math.inf, deadline - now)
+        return stragglers, timeout
+
+    def __iter__(self):
+        n = len(self.items)
+        next_index = 0  # the first item that isn't submitted
+        running = {}  # AsyncResult -> (start, stop, t_submit, speculative)
+        finished = {}  # start -> (stop, results), for ordered results
+        done = set()  # the starts of the finished chunks
+        duplicated = set()
+        next_start = 0  # the start of the next chunk to yield, if ordered
+        try:
+            while next_index < n or running:
+                # Keep the scheduler busy, measure with one item per engine first.
+                n_chunks = self.n_engines * (
+                    self.in_flight if self.t_item is not None else 1
+                )
+                while next_index < n and len(running) < n_chunks:
+                    stop = next_index + self.chunk_size(n - next_index)
+                    chunk = (next_index, stop, time.time(), False)
+                    running[self._submit(next_index, stop)] = chunk
+                    next_index = stop
+
+                timeout = None
+                if self.speculate and next_index == n and self.t_item is not None:
+                    n_pending = sum(not ar.done() for ar in running)
+                    n_idle = self.n_engines - n_pending
+                    stragglers, timeout = self._stragglers(
+                        running, duplicated, time.time()
+                    )
+                    for start, stop in stragglers[: max(n_idle, 0)]:
+                        duplicated.add(start)
+                        chunk = (start, stop, time.time(), True)
+                        running[self._submit(start, stop)] = chunk
+                    if n_idle <= 0:
+                        timeout = None
+
+                completed, _ = wait(list(running), timeout, FIRST_COMPLETED)
+                now = time.time()
+                for ar in completed:
+                    chunk = running.pop(ar)
+                    start, stop = chunk[:2]
+                    if start in done:
+                        continue  # the other copy was faster
+                    results = self._record(chunk, ar, now)
+                    done.add(start)
+                    if not self.ordered:
+                        yield from results
+                    else:
+                        finished[start] = (stop, results)
+                while next_start in finished:
+                    stop, results = finished.pop(next_start)
+                    yield from results
+                    next_start = stop
+                # Forget the copies of chunks that are already done.
+                for ar, (start, *_) in list(running.items()):
+                    if start in done:
+                        running.pop(ar)
+                        with suppress(Exception):
+                            self.view.abort(ar)
+        finally:
+            if running:
+                with suppress(Exception):
+                    self.view.abort(list(running))
+
+
+def chunked_map(view, f, *sequences, ordered=True, **kwargs):
+    """Map `f` over `sequences` on `view` with adaptive chunks, for short tasks.
+
+    With tasks of a few milliseconds, ``lview.map`` spends most time on the
+    round-trips of the individual tasks through the scheduler (and the ssh
+    tunnel), this function sends the items in chunks instead, see `ChunkedMap`.
+
+    Parameters
+    ----------
+    view : ipyparallel.client.view.LoadBalancedView
+        E.g. the `lview` returned by `hpc05.connect_ipcluster`.
+    f : callable
+        The function, called as ``f(*args)`` with an item of every sequence.
+    *sequences : iterables
+        The arguments of `f`.
+    ordered : bool, default: True
+        Return the results in the order of `sequences`, otherwise in the
+        order in which they finish.
+    overhead : float, default: 0.1
+        Maximal fraction of the time of a chunk that is spent on the round-trip.
+    max_chunk : int, optional
+        Maximal number of items per chunk.
+    in_flight : int, default: 2
+        Number of chunks per engine that are submitted at once.
+    speculate : bool, default: True
+        Submit the chunks of slow engines again when other engines are idle.
+    straggler_factor : float, default: 3
+        A chunk is slow when it takes this much longer than expected.
+
+    Returns
+    -------
+    ChunkedMap
+        Iterate over it to get the results while they come in.
+
+    Examples
+    --------
+    >>> results = list(hpc05.chunked_map(lview, f, xs))
+    """
+    return ChunkedMap(view, f, *sequences, ordered=ordered, **kwargs)
@@ -0,0 +1,369 @@
+import getpass
+import glob
+import json
+import os
+import re
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+
+import psutil
+
+# Jobs in these states can still be cancelled.
+PBS_STATES = "HQRTWS"
+SLURM_STATES = "PD,R,S,CF"
+
+PROCESS_PATTERNS = [
+    "hpc05_autoscaler",
+    "hpc05_culler",
+    "ipcluster",
+    "ipengine",
+    "ipyparallel.controller",
+    "ipyparallel.engine",  # also matches "ipyparallel.engines"
+]
+
+FILE_PATTERNS = ["*.hpc05.hpc*", "ipengine*", "ipcontroller*", "pbs_*"]
+
+
+class Registry:
+    """The scheduler jobs and processes that were launched for a profile.
+
+    `hpc05.start_ipcluster` records these from the ``ipcluster`` log-file
+    and cluster file, such that `hpc05.kill_ipcluster` can clean up a
+    single profile.
+    The registry is stored in ``~/.ipython/profile_{profile}/hpc05_registry.json``.
+
+    Parameters
+    ----------
+    profile : str
+        Profile name of IPython profile.
+    new : bool, default: False
+        Start a new registry, for a new cluster. Only the jobs and processes
+        that the last `clean_up_profile` couldn't remove are kept.
+
+    Attributes
+    ----------
+    job_ids : list
+        Ids of the submitted PBS or SLURM jobs.
+    pids : list
+        Process ids of the local processes.
+    """
+
+    _job_id = re.compile(
+        r"Job (?:submitted with job id|started with id): '?([^'\s]+)'?"
+    )
+    # The local launchers report their pid, like "LocalEngineLauncher
+    # /path/to/python started: 123" or "Process '/path/to/python' started: 123"
+    # (ipyparallel<7), the batch launchers their job id in a similar line.
+    _pid = re.compile(r"(?:Local\w*Launcher \S+|Process '[^']*') started: (\d+)$")
+
+    def __init__(self, profile, new=False):
+        self.profile = profile
+        self.fname = os.path.expanduser(
+            f"~/.ipython/profile_{profile}/hpc05_registry.json"
+        )
+        self.job_ids = []
+        self.pids = []
+        with suppress(FileNotFoundError, ValueError):
+            with open(self.fname) as f:
+                data = json.load(f)
+            if new:
+                data = data.get("remaining", {"job_ids": [], "pids": []})
+            self.job_ids, self.pids = data["job_ids"], data["pids"]
+        if new:
+            self.save()
+
+    def record_line(self, line):
+        """Record the job id or pid in a line of the ``ipcluster`` log-file."""
+        job_id = self._job_id.search(line)
+        if job_id is not None:
+            self.add_job_id(job_id.group(1))
+        pid = self._pid.search(line)
+        if pid is not None:
+            self.add_pid(int(pid.group(1)))
+
+    def record_cluster_file(self, fname):
+        """Record the job ids and pids in a cluster file of ipyparallel>=7.
+
+        These files (``security/cluster-{cluster_id}.json``) contain the
+        state of every launcher, as written by the launcher itself.
+        """
+        with suppress(FileNotFoundError, ValueError):
+            with open(fname) as f:
+                states = [json.load(f)]
+            while states:
+                state = states.pop()
+                if state.get("job_id"):
+                    self.add_job_id(str(state["job_id"]))
+                elif isinstance(state.get("pid"), int) and state["pid"] > 0:
+                    self.add_pid(state["pid"])
+                states.extend(v for v in state.values() if isinstance(v, dict))
+
+    def add_job_id(self, job_id):
+        if job_id not in self.job_ids:
+            self.job_ids.append(job_id)
+            self.save()
+
+    def add_pid(self, pid):
+        if pid not in self.pids:
+            self.pids.append(pid)
+            self.save()
+
+    def save(self, remaining=False):
+        """Save the registry, with `remaining` the jobs and processes are
+        also kept for the next cluster (see `new`)."""
+        os.makedirs(os.path.dirname(self.fname), exist_ok=True)
+        data = {"job_ids": self.job_ids, "pids": self.pids}
+        if remaining:
+            data["remaining"] = dict(data)
+        with open(self.fname, "w") as f:
+            json.dump(data, f)
+
+    def keep_remaining(self, job_ids, pids):
+        """Only keep the jobs and processes that a clean-up couldn't remove."""
+        remaining = {_short_job_id(job_id) for job_id in job_ids}
+        self.job_ids = [j for j in self.job_ids if _short_job_id(j) in remaining]
+        self.pids = list(pids)
+        self.save(remaining=True)
+
+    def clear(self):
+        self.job_ids, self.pids = [], []
+        with suppress(FileNotFoundError):
+            os.remove(self.fname)
+
+
+def _short_job_id(job_id):
+    # '123[].hpc05.hpc' -> '123[]' and the SLURM array task '123_4' -> '123'
+    return job_id.split(".")[0].split("_")[0]
+
+
+def _username():
+    return os.environ.get("USER") or getpass.getuser()
+
+
+def _run(cmd):
+    """Run `cmd` (a list) and return its stdout, or '' if it doesn't exist."""
+    with suppress(FileNotFoundError):
+        process = subprocess.run(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=False
+        )
+        return process.stdout.decode()
+    return ""
+
+
+def pbs_job_ids(username=None):
+    """Return the ids of the PBS jobs of `username` that can be cancelled."""
+    out = _run(["qselect", "-u", username or _username(), "-s", PBS_STATES])
+    return [line.strip() for line in out.splitlines() if line.strip()]
+
+
+def slurm_job_ids(names, username=None):
+    """Return the ids of the SLURM jobs of `username` with a name in `names`."""
+    out = _run(
+        ["squeue", "-h", "-u", username or _username(), "-t", SLURM_STATES]
+        + ["-o", "%i %j"]
+    )
+    job_ids = []
+    for line in out.splitlines():
+        job_id, _, name = line.strip().partition(" ")
+        if job_id and name in names:
+            job_ids.append(job_id)
+    return job_ids
+
+
+def cancel_jobs(
+    list_jobs, cancel_cmd, chunk_size=100, max_workers=4, retries=3, interval=1
+):
+    """Cancel jobs in chunks with bounded parallelism and verify it worked.
+
+    Parameters
+    ----------
+    list_jobs : callable
+        Returns the ids of the jobs that should be cancelled.
+    cancel_cmd : str
+        Command that cancels the jobs passed as arguments, e.g. "qdel".
+    chunk_size : int
+        Maximum number of job ids per `cancel_cmd` call.
+    max_workers : int
+        Maximum number of `cancel_cmd` calls that run at the same time.
+    retries : int
+        Number of times to cancel the jobs that are still there.
+    interval : float
+        Time in seconds to wait before checking whether the jobs are gone.
+
+    Returns
+    -------
+    n_jobs : int
+        Number of jobs that were found.
+    remaining : list
+        Ids of the jobs that are still there after all retries.
+    """
+    job_ids = list_jobs()
+    n_jobs = len(job_ids)
+    with ThreadPoolExecutor(max_workers) as executor:
+        for _ in range(retries):
+            if not job_ids:
+                break
+            chunks = [
+                job_ids[i : i + chunk_size] for i in range(0, len(job_ids), chunk_size)
+            ]
+            list(executor.map(lambda chunk: _run([cancel_cmd, *chunk]), chunks))
+            to_cancel = set(job_ids)
+            job_ids = [job_id for job_id in list_jobs() if job_id in to_cancel]
+            if job_ids:
+                # Give the scheduler some time to process the cancellations.
+                time.sleep(interval)
+                job_ids = [job_id for job_id in list_jobs() if job_id in to_cancel]
+    return n_jobs, job_ids
+
+
+def kill_processes(patterns=PROCESS_PATTERNS, timeout=5, profile=None, pids=()):
+    """Kill the processes of this user whose command line matches a pattern.
+
+    This process and its parents are never killed. Processes that do
+    not stop after `timeout` seconds are killed with SIGKILL.
+
+    Parameters
+    ----------
+    patterns : list of str
+        Kill processes whose command line contains one of these.
+    timeout : float
+        Time in seconds to wait for the processes to terminate.
+    profile : str, optional
+        Only kill the processes that use this profile (or are in `pids`).
+    pids : list of int
+        Process ids that are killed when they match `patterns`, even if
+        their command line doesn't mention `profile`.
+
+    Returns
+    -------
+    n_killed : int
+        Number of processes that were killed.
+    """
+    username = _username()
+    me = psutil.Process()
+    protected = {me.pid} | {p.pid for p in me.parents()}
+    if profile is not None:
+        # Matches "--profile=pbs", "--profile pbs" and ".../profile_pbs/"
+        # but not "--profile=pbs2" or "profile_pbs_15GB".
+        uses_profile = re.compile(
+            rf"(--profile[= ]|profile_){re.escape(profile)}(?![\w-])"
+        ).search
+    procs = []
+    for proc in psutil.process_iter():
+        with suppress(psutil.Error):
+            if proc.pid in protected or proc.username() != username:
+                continue
+            cmd = " ".join(proc.cmdline())
+            if not any(pattern in cmd for pattern in patterns):
+                continue
+            if profile is None or proc.pid in pids or uses_profile(cmd):
+                proc.terminate()
+                procs.append(proc)
+    _, alive = psutil.wait_procs(procs, timeout=timeout)
+    for proc in alive:
+        with suppress(psutil.Error):
+            proc.kill()
+    return len(procs)
+
+
+def all_job_ids(username=None):
+    """Return the ids of all PBS and SLURM jobs of `username`."""
+    username = username or _username()
+    out = _run(["squeue", "-h", "-u", username, "-t", SLURM_STATES, "-o", "%i"])
+    return pbs_job_ids(username) + out.split()
+
+
+def remove_files(patterns=FILE_PATTERNS):
+    """Remove the job output files in the current directory."""
+    for pattern in patterns:
+        for fname in glob.glob(pattern):
+            with suppress(OSError):
+                os.remove(fname)
+
+
+def clean_up(slurm_names, chunk_size=100, max_workers=4):
+    """Cancel the jobs, kill the processes, and remove the files of ipcluster.
+
+    The independent steps run concurrently.
+
+    Parameters
+    ----------
+    slurm_names : list of str
+        Names of the SLURM jobs that are cancelled, all PBS jobs are cancelled.
+    chunk_size : int
+        Maximum number of jobs per ``qdel`` or ``scancel`` call.
+    max_workers : int
+        Maximum number of ``qdel`` or ``scancel`` calls at the same time.
+
+    Returns
+    -------
+    summary : dict
+        Number of ``"jobs"`` that were found, the ids of the jobs that are
+        ``"remaining"``, and the number of ``"processes"`` that were killed.
+    """
+    with ThreadPoolExecutor(4) as executor:
+        pbs = executor.submit(cancel_jobs, pbs_job_ids, "qdel", chunk_size, max_workers)
+        slurm = executor.submit(
+            cancel_jobs,
+            lambda: slurm_job_ids(slurm_names),
+            "scancel",
+            chunk_size,
+            max_workers,
+        )
+        processes = executor.submit(kill_processes)
+        files = executor.submit(remove_files)
+        n_pbs, remaining_pbs = pbs.result()
+        n_slurm, remaining_slurm = slurm.result()
+        files.result()
+        return {
+            "jobs": n_pbs + n_slurm,
+            "remaining": remaining_pbs + remaining_slurm,
+            "processes": processes.result(),
+        }
+
+
+def clean_up_profile(profile, chunk_size=100, max_workers=4):
+    """Like `clean_up` but only for the jobs and processes of `profile`.
+
+    Cancels the PBS or SLURM jobs in the `Registry` of the profile, kills
+    the processes that use the profile, and removes the job output files
+    of the registered jobs.
+
+    Returns
+    -------
+    summary : dict
+        See `clean_up`.
+    """
+    registry = Registry(profile)
+    registered = {_short_job_id(job_id) for job_id in registry.job_ids}
+
+    def list_jobs():
+        return [j for j in all_job_ids() if _short_job_id(j) in registered]
+
+    cancel_cmd = "qdel" if shutil.which("qdel") else "scancel"
+    file_patterns = []
+    for job_id in registered:
+        job_id = job_id.split("[")[0]
+        file_patterns += [f"*.[oe]{job_id}*", f"slurm-{job_id}*"]
+    with ThreadPoolExecutor(3) as executor:
+        jobs = executor.submit(
+            cancel_jobs, list_jobs, cancel_cmd, chunk_size, max_workers
+        )
+        processes = executor.submit(kill_processes, profile=profile, pids=registry.pids)
+        files = executor.submit(remove_files, file_patterns)
+        n_jobs, remaining = jobs.result()
+        files.result()
+        summary = {
+            "jobs": n_jobs,
+            "remaining": remaining,
+            "processes": processes.result(),
+        }
+    remaining_pids = [pid for pid in registry.pids if psutil.pid_exists(pid)]
+    if remaining or remaining_pids:
+        registry.keep_remaining(remaining, remaining_pids)
+    else:
+        registry.clear()
+    return summary
@@ -3,12 +3,14 @@ import os
 import subprocess
 import tempfile
 import time
-from contextlib import suppress
+from contextlib import ExitStack, suppress
 
 import ipyparallel
-import zmq.ssh
 
-from hpc05.ssh_utils import setup_ssh
+from hpc05.connection_files import get_connection_file, remote_connection_file
+from hpc05.ssh_utils import pooled_ssh
+from hpc05.timeline import TIMELINE
+from hpc05.tunnel import Tunnel
 from hpc05.utils import bash, on_hostname, print_same_line
 
 import logging
@@ -29,6 +31,13 @@ def get_culler_cmd(profile="pbs", env_path=None, culler_args=None):
     return bash(cmd)
 
 
+def start_remote_culler(culler_cmd, hostname="hpc05", username=None, password=None):
+    # Closing the connection right away results in the culler not
+    # being started, the pooled connection is kept open.
+    with TIMELINE.span("culler_start"), pooled_ssh(hostname, username, password) as ssh:
+        ssh.exec_command(culler_cmd, get_pty=True)
+
+
 class Client(ipyparallel.Client):
     """Return an `ipyparallel.Client` and connect to a remote `ipcluster`
     over ssh if `local=False` and start the engine culler.
@@ -62,8 +71,9 @@ class Client(ipyparallel.Client):
     ----------
     json_filename : str
         file name of tmp local json file with connection details.
-    tunnel : pexpect.spawn object
-        ssh tunnel for making connection to the hpc05.
+    tunnel : hpc05.tunnel.Tunnel object
+        ssh tunnel for making connection to the hpc05, ``tunnel.counters``
+        holds the number of bytes that went through each port.
 
     Notes
     -----
@@ -98,24 +108,24 @@ class Client(ipyparallel.Client):
                     stdout=open("/dev/null", "w"),
                     stderr=open("logfile.log", "a"),
                 )
-            super().__init__(profile=profile, *args, **kwargs)
+            with TIMELINE.span("client_connect"):
+                super().__init__(profile=profile, *args, **kwargs)
         else:
-            import pexpect
-
             json_file, self.json_filename = tempfile.mkstemp()  # Create temporary file
             os.close(json_file)
 
-            # Try to get the json 10 times.
-            remote_json = (
-                fr".ipython/profile_{profile}/security/ipcontroller-client.json"
-            )
+            # Try to get the json 10 times, a cached copy is used when
+            # the remote file didn't change.
+            remote_json = remote_connection_file(profile)
             print_same_line(f"Trying to copy over {remote_json}.")
+            t_start = time.time()
             for i in range(10):
                 print_same_line(f"Trying to copy over {remote_json}. Attempt: {i}/10.")
-                with setup_ssh(hostname, username, password) as ssh:
+                with pooled_ssh(hostname, username, password) as ssh:
                     with suppress(FileNotFoundError), ssh.open_sftp() as sftp:
-                        sftp.chdir(os.path.dirname(remote_json))
-                        sftp.get(os.path.basename(remote_json), self.json_filename)
+                        cached_json, copied = get_connection_file(
+                            sftp, remote_json, hostname, profile
+                        )
                         break
                 if i == 9:
                     raise FileNotFoundError(
@@ -126,50 +136,58 @@ class Client(ipyparallel.Client):
                         "`hpc05.profile.create_remote_pbs_profile()`."
                     )
                 time.sleep(1)
-            print_same_line(
-                f"Copied over {remote_json} in {i+1} attempt.", new_line_end=True
+            TIMELINE.add(
+                "copy_connection_file",
+                t_start,
+                time.time(),
+                copied=copied,
+                attempts=i + 1,
             )
+            if copied:
+                msg = f"Copied over {remote_json} in {i+1} attempt."
+            else:
+                msg = f"Using the cached {remote_json}, it didn't change."
+            print_same_line(msg, new_line_end=True)
 
             # Read the json file
-            with open(self.json_filename) as json_file:
+            with open(cached_json) as json_file:
                 json_data = json.load(json_file)
 
             keys = ("control", "iopub", "mux", "notification", "registration", "task")
 
+            # Forward six random local ports to the remote ports
+            forwards = {key: (0, json_data["location"], json_data[key]) for key in keys}
+            # Keep the connection borrowed while the tunnel uses it, otherwise
+            # the pool closes it after `idle_timeout`.
+            self._tunnel_ssh = ExitStack()
+
+            def get_transport():
+                self._tunnel_ssh.close()  # return the connection that dropped
+                ssh = self._tunnel_ssh.enter_context(
+                    pooled_ssh(hostname, username, password)
+                )
+                return ssh.get_transport()
+
+            with TIMELINE.span("tunnel"):
+                self.tunnel = Tunnel(get_transport, forwards).start()
+            TIMELINE.event("tunnel_ready")
+
             local_json_data = json_data.copy()
             local_json_data["location"] = "localhost"
-
-            # Select six random ports for the local machine
-            local_ports = zmq.ssh.tunnel.select_random_ports(6)
-            for port, key in zip(local_ports, keys):
-                local_json_data[key] = port
+            local_json_data.update(self.tunnel.local_ports)
 
             # Replace remote ports by local ports
             with open(self.json_filename, "w") as json_file:
                 json.dump(local_json_data, json_file)
 
-            ips = [
-                "{}:{}:{} ".format(
-                    local_json_data[key], json_data["location"], json_data[key]
-                )
-                for key in keys
-            ]
-            ssh_forward_cmd = (
-                "ssh -o ConnectTimeout=10 -N -L " + "-L ".join(ips) + hostname
-            )
-            self.tunnel = pexpect.spawn(ssh_forward_cmd)
-            self.tunnel.expect(
-                [pexpect.TIMEOUT, pexpect.EOF, "[Pp]assword", "passphrase"], timeout=6
-            )
-
             if culler:
-                # Using `with setup_ssh` here results in the culler not being started.
-                ssh = setup_ssh(hostname, username, password)
-                ssh.exec_command(culler_cmd, get_pty=True)
-            super().__init__(self.json_filename, *args, **kwargs)
-
-        if not on_hostname(hostname):
-
-            def __del__(self):
-                if self.tunnel:
-                    self.tunnel.close()
+                start_remote_culler(culler_cmd, hostname, username, password)
+            with TIMELINE.span("client_connect"):
+                super().__init__(self.json_filename, *args, **kwargs)
+
+    def close(self, *args, **kwargs):
+        super().close(*args, **kwargs)
+        tunnel = getattr(self, "tunnel", None)
+        if tunnel is not None:
+            tunnel.close()
+            self._tunnel_ssh.close()
@@ -1,48 +1,55 @@
 from contextlib import suppress
+from functools import partial
 import glob
 import os.path
-import subprocess
+import threading
 import time
 
+from ipyparallel import serialize
 from ipyparallel.error import NoEnginesRegistered
 
+from hpc05.cleanup import Registry, clean_up, clean_up_profile
 from hpc05.client import Client
-from hpc05.ssh_utils import setup_ssh
+from hpc05.file_watch import follow, wait_for_file
+from hpc05.registration import close_watcher, get_watcher, has_watcher
+from hpc05.ssh_utils import pooled_ssh
+from hpc05.timeline import TIMELINE
 from hpc05.utils import print_same_line
 
 
 VERBOSE = True
 
 
-def watch_file(fname):
-    fp = open(fname, "r")
-    while True:
-        new = fp.readline()
-        # Once all lines are read this just returns ''
-        # until the file changes and a new line appears
-        if new:
-            yield new.strip()
-        else:
-            time.sleep(0.01)
-
-
-def watch_stdout(stdout):
-    text_iter = iter(stdout.readline, b"")
-    while True:
-        lines = [
-            l.strip() for l in next(text_iter).replace("\r", "\n").strip().split("\n")
-        ]
+def watch_file(fname, timeout=None):
+    # Blocks on inotify (or backs off) until the file changes
+    # and a new line appears.
+    return follow(fname, timeout)
+
+
+def watch_stdout(stdout, timeout=None):
+    for text in iter(stdout.readline, ""):
+        if not text:  # EOF of a binary stream
+            return
+        lines = [l.strip() for l in text.replace("\r", "\n").strip().split("\n")]
         for line in lines:
             if line:
                 yield line
 
 
-def wait_for_succesful_start(log_file, timeout=300):
+def wait_for_succesful_start(log_file, timeout=300, on_line=None, stop=None):
     t_start = time.time()
     watch = watch_file if isinstance(log_file, str) else watch_stdout
-    for line in watch(log_file):
+    for line in watch(log_file, timeout):
+        if stop is not None and stop.is_set():
+            return  # nobody waits for the start anymore, stop printing
         print(line) if VERBOSE else print_same_line(line)
+        if on_line is not None:
+            on_line(line)
+        if line.startswith("Found the log-file"):
+            # Printed by `start_ipcluster` on the remote.
+            TIMELINE.event("log_file_found")
         if "Engines appear to have started successfully" in line:
+            TIMELINE.event("engines_started")
             break
 
         if "Cluster is already running with" in line:
@@ -55,7 +62,8 @@ def wait_for_succesful_start(log_file, timeout=300):
 
         if time.time() - t_start > timeout:
             raise Exception(f"Failed to start a ipcluster in {timeout} seconds.")
-        time.sleep(0.01)
+    else:
+        raise Exception(f"Failed to start a ipcluster in {timeout} seconds.")
     msg = 'The log-file reports "Engines appear to have started successfully".'
     print_same_line(msg, new_line_end=True)
 
@@ -101,19 +109,33 @@ def start_ipcluster(n, profile, env_path=None, timeout=300):
 
     # For an unknown reason `subprocess.Popen(cmd.split())` doesn't work when
     # running `start_remote_ipcluster` and connecting to it, so we use os.system.
+    t_launch = time.time()
     os.system(cmd + ("> /dev/null 2>&1" if not VERBOSE else ""))
-    for i in range(timeout):
-        print_same_line(f"Waiting for {i} seconds for the log-file.")
-        time.sleep(1)  # We wait a bit since we need the log file to exist
-
-        # We don't PIPE stdout of the process above because we need a detached
-        # process so we tail the log file.
-        with suppress(IndexError):
-            log_file = glob.glob(log_file_pattern)[0]
-            break
-    print(f"Found the log-file ({log_file}) in {i} seconds.")
-
-    wait_for_succesful_start(log_file, timeout=timeout)
+    TIMELINE.event("ipcluster_launched", n=n, profile=profile)
+    t_start = time.time()
+    print_same_line("Waiting for the log-file.")
+    # We don't PIPE stdout of the process above because we need a detached
+    # process so we tail the log file.
+    log_file = wait_for_file(log_file_pattern, timeout)
+    t = time.time() - t_start
+    if log_file is None:
+        raise Exception(f"No log-file appeared in {timeout} seconds.")
+    TIMELINE.event("log_file_found", log_file=log_file)
+    print(f"Found the log-file ({log_file}) in {t:.1f} seconds.")
+
+    registry = Registry(profile, new=True)
+    wait_for_succesful_start(log_file, timeout=timeout, on_line=registry.record_line)
+    ipcluster_pid = os.path.expanduser(
+        f"~/.ipython/profile_{profile}/pid/ipcluster.pid"
+    )
+    with suppress(FileNotFoundError, ValueError), open(ipcluster_pid) as f:
+        registry.add_pid(int(f.read().strip()))
+    cluster_files = os.path.expanduser(
+        f"~/.ipython/profile_{profile}/security/cluster-*.json"
+    )
+    for fname in glob.glob(cluster_files):
+        if os.path.getmtime(fname) >= t_launch:  # not of an old cluster
+            registry.record_cluster_file(fname)
 
 
 def start_remote_ipcluster(
@@ -124,6 +146,7 @@ def start_remote_ipcluster(
     password=None,
     env_path=None,
     timeout=300,
+    stop=None,
 ):
     """Starts an `ipcluster` over ssh on `hostname` and wait untill it's
     successfully started.
@@ -147,6 +170,8 @@ def start_remote_ipcluster(
         Defaults to the environment that is sourced in `.bashrc` or `.bash_profile`.
     timeout : int
         Time for which we try to connect to get all the engines.
+    stop : threading.Event, optional
+        When set, stop following (and printing) the remote log-file.
 
     Returns
     -------
@@ -158,11 +183,12 @@ def start_remote_ipcluster(
     else:
         python_exec = os.path.join(env_path, "bin", "python")
 
-    with setup_ssh(hostname, username, password) as ssh:
-        cmd = f"import hpc05; hpc05.start_ipcluster({n}, '{profile}', '{env_path}', {timeout})"
-        cmd = f'{python_exec} -c "{cmd}"'
-        stdin, stdout, stderr = ssh.exec_command(cmd, get_pty=True)
-        wait_for_succesful_start(stdout, timeout=timeout)
+    with TIMELINE.span("start_remote_ipcluster", n=n, profile=profile):
+        with pooled_ssh(hostname, username, password) as ssh:
+            cmd = f"import hpc05; hpc05.start_ipcluster({n}, '{profile}', '{env_path}', {timeout})"
+            cmd = f'{python_exec} -c "{cmd}"'
+            stdin, stdout, stderr = ssh.exec_command(cmd, get_pty=True)
+            wait_for_succesful_start(stdout, timeout=timeout, stop=stop)
 
 
 def connect_ipcluster(
@@ -178,13 +204,15 @@ def connect_ipcluster(
     timeout=300,
     folder=None,
     client_kwargs=None,
+    wait_mode="notification",
+    min_engines=None,
 ):
     """Connect to an `ipcluster` on the cluster headnode.
 
     Parameters
     ----------
     n : int
-        Number of engines to be started.
+        Number of engines to be started, the target number of engines.
     profile : str, default 'pbs'
         Profile name of IPython profile.
     hostname : str
@@ -212,6 +240,15 @@ def connect_ipcluster(
         Folder that is added to the path of the engines, e.g. "~/Work/my_current_project".
     client_kwargs : dict
         Keyword arguments that are passed to `hpc05.Client()`.
+    wait_mode : str, default: "notification"
+        How to wait for the engines. "notification" returns the moment the
+        n-th engine registers with the hub, "poll" checks ``len(client)``
+        every second.
+    min_engines : int, optional
+        Return as soon as `min_engines` engines are connected instead of waiting
+        for all `n`. The returned `dview` and `lview` then grow as more engines
+        register, each new engine is set up (dill and `folder`) before it is
+        added to the views. By default it waits for all `n` engines.
 
     Returns
     -------
@@ -222,6 +259,7 @@ def connect_ipcluster(
     lview : ipyparallel.client.view.LoadBalancedView
         LoadedBalancedView, equivalent to `client.load_balanced_view()`.
     """
+    t_start = time.time()
     client = Client(
         profile=profile,
         hostname=hostname,
@@ -236,6 +274,173 @@ def connect_ipcluster(
     )
     print("Connected to the `ipcluster` using an `ipyparallel.Client`.")
 
+    dview, lview = setup_views(client, n, timeout, folder, wait_mode, min_engines)
+    TIMELINE.add("connect_ipcluster", t_start, time.time(), n=n, profile=profile)
+    return client, dview, lview
+
+
+def setup_views(
+    client, n, timeout=300, folder=None, wait_mode="notification", min_engines=None
+):
+    """Wait for the engines and return the views like `connect_ipcluster`.
+
+    Parameters
+    ----------
+    client : ipyparallel.Client object
+        A connected client.
+    n, timeout, folder, wait_mode, min_engines
+        See `connect_ipcluster`.
+
+    Returns
+    -------
+    dview : ipyparallel.client.view.DirectView object
+        Direct view, equivalent to `client[:]`.
+    lview : ipyparallel.client.view.LoadBalancedView
+        LoadedBalancedView, equivalent to `client.load_balanced_view()`.
+    """
+    if min_engines is None:
+        min_engines = n
+
+    # Engines that registered before we connected don't send a notification.
+    TIMELINE.event("engines_registered_before_connect", n_engines=len(client))
+    if wait_mode == "notification":
+        wait_for_engines(client, min_engines, timeout, target=n)
+    elif wait_mode == "poll":
+        _poll_for_engines(client, min_engines, timeout, target=n)
+    else:
+        raise ValueError(
+            f"wait_mode should be 'notification' or 'poll', not {wait_mode}."
+        )
+
+    dview = client[:]
+    dview.use_dill()
+    lview = client.load_balanced_view()
+
+    if folder is not None:
+        print(f"Adding {folder} to path.")
+        dview.execute(_add_to_path_cmd(folder)).result()
+
+    TIMELINE.event("views_ready", n_engines=len(dview))
+
+    if min_engines < n:
+        # Only hand out tasks to engines that are set up.
+        lview = client.load_balanced_view(targets=dview.targets)
+        add_late_engines(client, [dview, lview], folder)
+        print(
+            f"Returning with {len(dview)} out of {n} engines, "
+            "the views will grow when more engines connect."
+        )
+
+    return dview, lview
+
+
+def _add_to_path_cmd(folder):
+    return f"import sys, os; sys.path.append(os.path.expanduser('{folder}'))"
+
+
+def add_late_engines(client, views, folder=None):
+    """Add engines that register with the hub later to `views`.
+
+    A new engine is set up like the ones returned by `connect_ipcluster`
+    (dill serialization and `folder` in its path) and only then added
+    to the targets of the views, so it never receives a task before it
+    is ready.
+
+    Parameters
+    ----------
+    client : ipyparallel.Client object
+        A connected client.
+    views : list of ipyparallel.client.view.View objects
+        Views with explicit (list) targets, e.g. `client[:]` or
+        `client.load_balanced_view(targets=[...])`.
+    folder : str, optional
+        Folder that is added to the path of the engines.
+    """
+    lock = threading.Lock()
+    seen = set(views[0].targets)
+
+    def add_to_views(engine_id, setup):
+        if setup.exception() is not None:
+            print(f"Could not setup engine {engine_id}: {setup.exception()}")
+            return
+        with lock:
+            for view in views:
+                if engine_id not in view.targets:
+                    view.targets = view.targets + [engine_id]
+
+    def setup_engine(engine_id):
+        with lock:
+            if engine_id in seen:
+                return
+            seen.add(engine_id)
+        view = client.direct_view(engine_id)
+        setup = view.apply(serialize.use_dill)
+        if folder is not None:
+            # Engines execute in order, so this runs after `use_dill`.
+            setup = view.execute(_add_to_path_cmd(folder))
+        setup.add_done_callback(partial(add_to_views, engine_id))
+
+    get_watcher(client).callbacks.append(setup_engine)
+    for engine_id in client.ids:
+        # Engines that registered before the callback was added.
+        setup_engine(engine_id)
+
+
+def _progress_msg(n_engines, n, target, t):
+    msg = f"Connected to {n_engines} out of {target or n} engines after {t} seconds"
+    if target is not None and n < target:
+        msg += f", returning at {n}"
+    return msg + "."
+
+
+def wait_for_engines(client, n, timeout=300, target=None):
+    """Wait until `n` engines are registered with the hub of `client`.
+
+    Instead of polling, this blocks on the registration notifications
+    that the hub sends to the client, so it returns as soon as the
+    n-th engine registers.
+
+    Parameters
+    ----------
+    client : ipyparallel.Client object
+        A connected client.
+    n : int
+        Number of engines to wait for.
+    timeout : int
+        Time limit after which an Exception is raised.
+    target : int, optional
+        The number of engines that is reported in the progress, when
+        more than `n` engines are started.
+    """
+    # Don't leave a handler behind when nothing else uses the watcher.
+    new_watcher = not has_watcher(client)
+    watcher = get_watcher(client)
+    t_start = time.time()
+    n_engines_old = -1
+    try:
+        while True:
+            n_seen = watcher.n_registrations
+            n_engines = len(client)
+            t = int(time.time() - t_start)
+            if n_engines != n_engines_old:
+                msg = _progress_msg(n_engines, n, target, t)
+                print_same_line(msg, new_line_end=(n_engines >= n))
+                n_engines_old = n_engines
+            if n_engines >= n:
+                return
+            remaining = timeout - (time.time() - t_start)
+            if remaining <= 0 or not watcher.wait(n_seen, remaining):
+                if len(client) >= n:
+                    continue
+                raise Exception(
+                    f"Not all ({n_engines}/{n}) connected after {timeout} seconds."
+                )
+    finally:
+        if new_watcher:
+            close_watcher(client)
+
+
+def _poll_for_engines(client, n, timeout=300, target=None):
     t_start = time.time()
     done = False
     n_engines_old = 0
@@ -244,9 +449,9 @@ def connect_ipcluster(
         done = n_engines >= n
         with suppress(NoEnginesRegistered):
             # This can happen, we just need to wait a little longer.
-            dview = client[:]
+            client[:]
         t = int(time.time() - t_start)
-        msg = f"Connected to {n_engines} out of {n} engines after {t} seconds."
+        msg = _progress_msg(n_engines, n, target, t)
         print_same_line(msg, new_line_end=(n_engines_old != n_engines))
         if t > timeout:
             raise Exception(
@@ -255,16 +460,6 @@ def connect_ipcluster(
         n_engines_old = n_engines
         time.sleep(1)
 
-    dview.use_dill()
-    lview = client.load_balanced_view()
-
-    if folder is not None:
-        print(f"Adding {folder} to path.")
-        cmd = f"import sys, os; sys.path.append(os.path.expanduser('{folder}'))"
-        dview.execute(cmd).result()
-
-    return client, dview, lview
-
 
 def start_and_connect(
     n,
@@ -278,6 +473,7 @@ def start_and_connect(
     folder=None,
     client_kwargs=None,
     kill_old_ipcluster=True,
+    min_engines=None,
 ):
     """Start an `ipcluster` locally and connect to it.
 
@@ -308,8 +504,11 @@ def start_and_connect(
     client_kwargs : dict
         Keyword arguments that are passed to `hpc05.Client()`.
     kill_old_ipcluster : bool
-        If True, it cleansup any old instances of `ipcluster` and kills
-        your jobs in qstat or squeue.
+        If True, it cleansup any old instances of `ipcluster` of this
+        `profile` and kills its jobs in qstat or squeue.
+    min_engines : int, optional
+        Return as soon as `min_engines` engines are connected, the returned
+        views grow when the remaining engines connect. See `connect_ipcluster`.
 
     Returns
     -------
@@ -321,7 +520,7 @@ def start_and_connect(
         LoadedBalancedView, equivalent to `client.load_balanced_view()`.
     """
     if kill_old_ipcluster:
-        kill_ipcluster(profile)
+        kill_ipcluster(profile=profile)
         print("Killed old intances of ipcluster.")
 
     start_ipcluster(n, profile, env_path, timeout)
@@ -338,6 +537,7 @@ def start_and_connect(
         timeout=timeout,
         folder=folder,
         client_kwargs=client_kwargs,
+        min_engines=min_engines,
     )
 
 
@@ -354,9 +554,14 @@ def start_remote_and_connect(
     folder=None,
     client_kwargs=None,
     kill_old_ipcluster=True,
+    min_engines=None,
 ):
     """Start a remote `ipcluster` on `hostname` and connect to it.
 
+    Fetching the connection file, setting up the tunnel and starting the
+    culler happen while the engines are still queued, see
+    `hpc05.startup.start_remote_and_connect_async`.
+
     Parameters
     ----------
     n : int
@@ -386,43 +591,44 @@ def start_remote_and_connect(
     client_kwargs : dict
         Keyword arguments that are passed to `hpc05.Client()`.
     kill_old_ipcluster : bool
-        If True, it cleansup any old instances of `ipcluster` and kills
-        your jobs in qstat or squeue.
+        If True, it cleansup any old instances of `ipcluster` of this
+        `profile` and kills its jobs in qstat or squeue.
+    min_engines : int, optional
+        Return as soon as `min_engines` engines are connected, the returned
+        views grow when the remaining engines connect. See `connect_ipcluster`.
 
     Returns
     -------
     client : ipython.Client object
-        An IPyparallel client.
+        An IPyparallel client, ``client.startup_timings`` has the
+        time spent in each startup stage.
     dview : ipyparallel.client.view.DirectView object
         Direct view, equivalent to `client[:]`.
     lview : ipyparallel.client.view.LoadBalancedView
         LoadedBalancedView, equivalent to `client.load_balanced_view()`.
     """
-    if kill_old_ipcluster:
-        kill_remote_ipcluster(hostname, username, password, env_path)
-        print("Killed old intances of ipcluster.")
-
-    start_remote_ipcluster(n, profile, hostname, username, password, env_path, timeout)
-    time.sleep(2)
-
-    # all arguments for `connect_ipcluster` except `local`.
-    return connect_ipcluster(
-        n,
-        profile=profile,
-        hostname=hostname,
-        username=username,
-        password=password,
-        culler=culler,
-        culler_args=culler_args,
-        env_path=env_path,
-        local=False,
-        timeout=timeout,
-        folder=folder,
-        client_kwargs=client_kwargs,
+    from hpc05.startup import run_sync, start_remote_and_connect_async
+
+    return run_sync(
+        start_remote_and_connect_async(
+            n,
+            profile=profile,
+            hostname=hostname,
+            username=username,
+            password=password,
+            culler=culler,
+            culler_args=culler_args,
+            env_path=env_path,
+            timeout=timeout,
+            folder=folder,
+            client_kwargs=client_kwargs,
+            kill_old_ipcluster=kill_old_ipcluster,
+            min_engines=min_engines,
+        )
     )
 
 
-def kill_ipcluster(name=None):
+def kill_ipcluster(name=None, chunk_size=100, max_workers=4, profile=None):
     """Kill your ipcluster and cleanup the files.
 
     This should do the same as the following bash function (recommended:
@@ -438,31 +644,50 @@ def kill_ipcluster(name=None):
         pkill -f ipyparallel.engines 2> /dev/null
     }
     ```
-    """
-    clean_up_cmds = [
-        "qselect -u $USER | xargs qdel",
-        "rm -f *.hpc05.hpc* ipengine* ipcontroller* pbs_*",
-        "pkill -f hpc05_culler",
-        "pkill -f ipcluster",
-        "pkill -f ipengine",
-        "pkill -f ipyparallel.controller",
-        "pkill -f ipyparallel.engines",
-        "scancel --name='ipy-engine-' --user=$USER",  # SLURM
-        "scancel --name='ipy-controller-' --user=$USER",  # SLURM
-    ]
+    but the job ids are queried once and cancelled in chunks of `chunk_size`
+    with at most `max_workers` ``qdel``/``scancel`` calls at the same time,
+    while the processes are killed and the files removed concurrently.
+    Afterwards it checks that the jobs are gone.
 
-    if name is not None:
-        clean_up_cmds.append(f"scancel --name='{name}' --user=$USER")
+    When `profile` is passed, only the jobs and processes of that profile
+    are cleaned up, using the job ids and pids that `start_ipcluster`
+    registered. Clusters of other profiles keep running.
 
-    clean_up_cmds = [cmd + " 2> /dev/null" for cmd in clean_up_cmds]
+    Parameters
+    ----------
+    name : str, optional
+        Name of an extra SLURM job to cancel.
+    chunk_size : int
+        Maximum number of job ids per ``qdel`` or ``scancel`` call.
+    max_workers : int
+        Maximum number of ``qdel`` or ``scancel`` calls at the same time.
+    profile : str, optional
+        Only clean up the jobs and processes of this profile.
 
-    for cmd in clean_up_cmds:
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, shell=True)
-        process.wait()
+    Returns
+    -------
+    summary : dict
+        See `hpc05.cleanup.clean_up`.
+    """
+    if profile is not None:
+        summary = clean_up_profile(profile, chunk_size, max_workers)
+    else:
+        slurm_names = ["ipy-engine-", "ipy-controller-"]  # SLURM
+        if name is not None:
+            slurm_names.append(name)
+        summary = clean_up(slurm_names, chunk_size, max_workers)
+    msg = (
+        f"Cancelled {summary['jobs']} jobs and "
+        f"killed {summary['processes']} processes."
+    )
+    if summary["remaining"]:
+        msg += f" Jobs that could not be cancelled: {summary['remaining']}."
+    print(msg)
+    return summary
 
 
 def kill_remote_ipcluster(
-    hostname="hpc05", username=None, password=None, env_path=None
+    hostname="hpc05", username=None, password=None, env_path=None, profile=None
 ):
     """Kill your remote ipcluster and cleanup the files.
 
@@ -479,6 +704,8 @@ def kill_remote_ipcluster(
         pkill -f ipyparallel.engines 2> /dev/null
     }
     ```
+    Pass `profile` to only clean up the jobs and processes of that profile,
+    see `kill_ipcluster`.
     """
     if env_path is None:
         env_path = ""
@@ -486,8 +713,9 @@ def kill_remote_ipcluster(
     else:
         python_exec = os.path.join(env_path, "bin", "python")
 
-    with setup_ssh(hostname, username, password) as ssh:
-        cmd = f"import hpc05; hpc05.connect.kill_ipcluster()"
+    with pooled_ssh(hostname, username, password) as ssh:
+        arg = f"profile='{profile}'" if profile is not None else ""
+        cmd = f"import hpc05; hpc05.connect.kill_ipcluster({arg})"
         cmd = f'{python_exec} -c "{cmd}"'
         stdin, stdout, stderr = ssh.exec_command(cmd, get_pty=True)
         with suppress(Exception):
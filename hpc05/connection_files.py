@@ -0,0 +1,68 @@
+import json
+import os
+from contextlib import suppress
+
+CACHE_DIR = os.path.expanduser("~/.hpc05/connection_files")
+
+
+def remote_connection_file(profile):
+    """Path of the controller's connection file, relative to the remote home."""
+    return f".ipython/profile_{profile}/security/ipcontroller-client.json"
+
+
+def get_connection_file(sftp, remote_json, hostname, profile):
+    """Return a local copy of the controller's connection file.
+
+    The file is cached per `hostname` and `profile`, it is only copied over
+    again when the `mtime` or `size` of `remote_json` changed, which costs
+    a single ``stat`` when reconnecting to a running cluster.
+
+    Parameters
+    ----------
+    sftp : paramiko.SFTPClient
+        An open sftp session to `hostname`.
+    remote_json : str
+        Path of ``ipcontroller-client.json`` on `hostname`.
+    hostname : str
+        Hostname of machine where the ipcluster runs.
+    profile : str
+        Profile name of IPython profile.
+
+    Returns
+    -------
+    fname : str
+        Path of the local copy.
+    copied : bool
+        Whether the file was copied over or taken from the cache.
+    """
+    stat = sftp.stat(remote_json)  # raises FileNotFoundError
+    remote_stat = {"mtime": stat.st_mtime, "size": stat.st_size}
+
+    folder = os.path.join(CACHE_DIR, hostname, f"profile_{profile}")
+    fname = os.path.join(folder, os.path.basename(remote_json))
+    stat_fname = fname + ".stat"
+    with suppress(FileNotFoundError, ValueError):
+        with open(stat_fname) as f:
+            if json.load(f) == remote_stat and os.path.exists(fname):
+                return fname, False
+
+    os.makedirs(folder, exist_ok=True)
+    sftp.get(remote_json, fname + ".tmp")
+    os.replace(fname + ".tmp", fname)
+    with open(stat_fname, "w") as f:
+        json.dump(remote_stat, f)
+    return fname, True
+
+
+def clear_connection_files(hostname=None, profile=None):
+    """Remove cached connection files, by default all of them."""
+    for root, _, fnames in os.walk(CACHE_DIR):
+        parts = os.path.relpath(root, CACHE_DIR).split(os.sep)
+        if len(parts) != 2:
+            continue
+        if hostname is not None and parts[0] != hostname:
+            continue
+        if profile is not None and parts[1] != f"profile_{profile}":
+            continue
+        for fname in fnames:
+            os.remove(os.path.join(root, fname))
@@ -0,0 +1,143 @@
+import ctypes
+import ctypes.util
+import glob
+import os
+import select
+import sys
+import time
+from contextlib import suppress
+
+# Flags from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+
+class Inotify:
+    """Wait for changes of a file or directory using Linux's inotify.
+
+    Parameters
+    ----------
+    path : str
+        File or directory to watch.
+    mask : int
+        Events to watch for, e.g. ``IN_MODIFY | IN_CLOSE_WRITE``.
+    """
+
+    def __init__(self, path, mask):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        if libc.inotify_add_watch(fd, os.fsencode(path), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, os.strerror(errno), path)
+        self.fd = fd
+
+    def wait(self, timeout=None):
+        """Block until an event arrives or `timeout` seconds passed."""
+        if timeout is not None:
+            timeout = max(timeout, 0)
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            # We only care that something happened, not what.
+            with suppress(BlockingIOError):
+                while os.read(self.fd, 4096):
+                    pass
+        return bool(ready)
+
+    def reset(self):
+        pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Backoff:
+    """Sleep with exponentially increasing intervals between checks.
+
+    Used when inotify is not available, `reset` should be called
+    whenever a check found something new.
+    """
+
+    def __init__(self, min_delay=0.01, max_delay=1):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay = min_delay
+
+    def wait(self, timeout=None):
+        delay = self.delay if timeout is None else min(self.delay, max(timeout, 0))
+        time.sleep(delay)
+        self.delay = min(2 * self.delay, self.max_delay)
+        return True
+
+    def reset(self):
+        self.delay = self.min_delay
+
+    def close(self):
+        pass
+
+
+def get_waiter(path, mask):
+    """Return an `Inotify` waiter on Linux, and a `Backoff` otherwise."""
+    if sys.platform.startswith("linux"):
+        with suppress(OSError, AttributeError, TypeError):
+            return Inotify(path, mask)
+    return Backoff()
+
+
+def follow(fname, timeout=None):
+    """Yield the lines that are appended to `fname`, like ``tail -f``.
+
+    Parameters
+    ----------
+    fname : str
+        File to follow, it is read from the start.
+    timeout : float, optional
+        Stop after `timeout` seconds, by default follow forever.
+    """
+    t_end = None if timeout is None else time.time() + timeout
+    # Start watching before reading, such that no write can be missed.
+    waiter = get_waiter(fname, IN_MODIFY | IN_CLOSE_WRITE)
+    try:
+        with open(fname, "r") as fp:
+            line = ""
+            while True:
+                line += fp.readline()
+                if line.endswith("\n"):
+                    waiter.reset()
+                    yield line.strip()
+                    line = ""
+                    continue
+                remaining = None if t_end is None else t_end - time.time()
+                if remaining is not None and remaining <= 0:
+                    return
+                waiter.wait(remaining)
+    finally:
+        waiter.close()
+
+
+def wait_for_file(pattern, timeout=None):
+    """Wait until a file that matches the glob `pattern` exists.
+
+    Returns
+    -------
+    fname : str or None
+        The first matching file or None if `timeout` passed.
+    """
+    t_end = None if timeout is None else time.time() + timeout
+    waiter = get_waiter(os.path.dirname(pattern), IN_CREATE | IN_MOVED_TO)
+    try:
+        while True:
+            fnames = glob.glob(pattern)
+            if fnames:
+                return fnames[0]
+            remaining = None if t_end is None else t_end - time.time()
+            if remaining is not None and remaining <= 0:
+                return None
+            waiter.wait(remaining)
+    finally:
+        waiter.close()
@@ -8,7 +8,7 @@ import textwrap
 from IPython.paths import locate_profile
 
 import hpc05_monitor
-from hpc05.ssh_utils import setup_ssh
+from hpc05.ssh_utils import pooled_ssh
 
 
 # XXX: 2018-09-24: I used to add
@@ -30,6 +30,13 @@ DEFAULTS = {
     ],
 }
 
+# Profiles the tasks on the engines, see `hpc05_profiler`.
+PROFILER_LINES = {
+    "ipengine_config.py": [
+        "c.IPEngineApp.startup_command = 'import os, sys; import hpc05_profiler; hpc05_profiler.install()'"
+    ]
+}
+
 
 def line_prepender(filename, line):
     if isinstance(line, list):
@@ -40,6 +47,14 @@ def line_prepender(filename, line):
         f.write(line + "\n" + content)
 
 
+def _defaults(profiler=False):
+    files_lines_dict = {fname: list(lines) for fname, lines in DEFAULTS.items()}
+    if profiler:
+        for fname, lines in PROFILER_LINES.items():
+            files_lines_dict[fname] += lines
+    return files_lines_dict
+
+
 def add_lines_in_profile(profile, files_lines_dict):
     for fname, line in files_lines_dict.items():
         fname = os.path.join(locate_profile(profile), fname)
@@ -68,7 +83,7 @@ def _create_parallel_profile(profile):
 
 
 def create_local_pbs_profile(
-    profile="pbs", local_controller=False, custom_template=None
+    profile="pbs", local_controller=False, custom_template=None, profiler=False
 ):
     """Creata a PBS profile for ipyparallel.
 
@@ -80,6 +95,8 @@ def create_local_pbs_profile(
         Create a ipcontroller on a seperate node if True and locally if False.
     custom_template : str
         A custom job script template, see the example below.
+    profiler : bool
+        Profile every task on the engines, see `hpc05_profiler`.
 
     Examples
     --------
@@ -124,7 +141,7 @@ def create_local_pbs_profile(
             "c.IPClusterStart.controller_launcher_class = 'PBSControllerLauncher'"
         )
 
-    files_lines_dict = {"ipcluster_config.py": ipcluster, **DEFAULTS}
+    files_lines_dict = {"ipcluster_config.py": ipcluster, **_defaults(profiler)}
 
     add_lines_in_profile(profile, files_lines_dict)
 
@@ -136,7 +153,7 @@ def create_local_pbs_profile(
 
 
 def create_local_slurm_profile(
-    profile="slurm", local_controller=False, custom_template=None
+    profile="slurm", local_controller=False, custom_template=None, profiler=False
 ):
     """Creata a SLURM profile for ipyparallel.
 
@@ -148,6 +165,8 @@ def create_local_slurm_profile(
         Create a ipcontroller on a seperate node if True and locally if False.
     custom_template : str
         A custom job script template, see the example below.
+    profiler : bool
+        Profile every task on the engines, see `hpc05_profiler`.
 
     Examples
     --------
@@ -188,7 +207,7 @@ def create_local_slurm_profile(
             "c.IPClusterStart.controller_launcher_class = 'SlurmControllerLauncher'"
         )
 
-    files_lines_dict = {"ipcluster_config.py": ipcluster, **DEFAULTS}
+    files_lines_dict = {"ipcluster_config.py": ipcluster, **_defaults(profiler)}
 
     add_lines_in_profile(profile, files_lines_dict)
 
@@ -207,6 +226,7 @@ def _create_remote_profile(
     local_controller=False,
     custom_template=None,
     batch_type="pbs",
+    profiler=False,
 ):
     assert batch_type in ("pbs", "slurm")
     if custom_template is not None:
@@ -214,8 +234,8 @@ def _create_remote_profile(
             f"Use `create_local_{batch_type}_profile` on the"
             " cluster locally or implement this function."
         )
-    with setup_ssh(hostname, username, password) as ssh:
-        cmd = f'import hpc05; hpc05.create_local_{batch_type}_profile("{profile}", {local_controller})'
+    with pooled_ssh(hostname, username, password) as ssh:
+        cmd = f'import hpc05; hpc05.create_local_{batch_type}_profile("{profile}", {local_controller}, profiler={profiler})'
         cmd = f"python -c '{cmd}'"
         stdin, stdout, stderr = ssh.exec_command(cmd, get_pty=True)
         out, err = stdout.readlines(), stderr.readlines()
@@ -232,6 +252,7 @@ def create_remote_pbs_profile(
     profile="pbs",
     local_controller=False,
     custom_template=None,
+    profiler=False,
 ):
     _create_remote_profile(
         hostname,
@@ -241,6 +262,7 @@ def create_remote_pbs_profile(
         local_controller,
         custom_template,
         batch_type="pbs",
+        profiler=profiler,
     )
 
 
@@ -251,6 +273,7 @@ def create_remote_slurm_profile(
     profile="slurm",
     local_controller=False,
     custom_template=None,
+    profiler=False,
 ):
     _create_remote_profile(
         hostname,
@@ -260,4 +283,5 @@ def create_remote_slurm_profile(
         local_controller,
         custom_template,
         batch_type="slurm",
+        profiler=profiler,
     )
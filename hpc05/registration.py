@@ -0,0 +1,96 @@
+import threading
+
+from hpc05.timeline import TIMELINE
+
+
+class RegistrationWatcher:
+    """Follow engine registrations through the hub's notification channel.
+
+    The `ipyparallel.Client` already subscribes to the hub's ``notification``
+    channel, this object hooks into its ``registration_notification`` handler
+    such that we can act on a registration the moment it arrives, instead of
+    polling ``len(client)``.
+
+    Parameters
+    ----------
+    client : ipyparallel.Client
+        A connected client.
+
+    Attributes
+    ----------
+    n_registrations : int
+        Number of registration notifications seen since the watcher started.
+    callbacks : list
+        Functions that are called as ``callback(engine_id)`` on every
+        registration. With ``ipyparallel>=7`` these are called from the
+        client's IO thread, so they should not block.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.n_registrations = 0
+        self.callbacks = []
+        self._condition = threading.Condition()
+        handlers = client._notification_handlers
+        self._register_engine = handlers["registration_notification"]
+        handlers["registration_notification"] = self._on_registration
+
+    def _on_registration(self, msg):
+        self._register_engine(msg)
+        engine_id = msg["content"]["id"]
+        TIMELINE.event("engine_registered", engine_id=engine_id)
+        for callback in list(self.callbacks):
+            callback(engine_id)
+        with self._condition:
+            self.n_registrations += 1
+            self._condition.notify_all()
+
+    def wait(self, n_seen, timeout):
+        """Wait until more than `n_seen` registrations happened.
+
+        Returns
+        -------
+        bool
+            False if `timeout` (in seconds) passed without a new registration.
+        """
+        if hasattr(self.client, "_notification_stream"):
+            # ipyparallel>=7 dispatches the notifications on its IO thread.
+            with self._condition:
+                return self._condition.wait_for(
+                    lambda: self.n_registrations > n_seen, timeout
+                )
+
+        # Older clients only handle notifications when they are flushed,
+        # so block on the socket itself instead of sleeping.
+        socket = self.client._notification_socket
+        if socket.poll(1000 * max(timeout, 0)):
+            self.client._flush_notifications()
+        return self.n_registrations > n_seen
+
+    def close(self):
+        """Restore the original registration handler of the client."""
+        handlers = self.client._notification_handlers
+        if handlers.get("registration_notification") == self._on_registration:
+            handlers["registration_notification"] = self._register_engine
+
+
+def get_watcher(client):
+    """Return the `RegistrationWatcher` of `client`, create it when needed."""
+    watcher = getattr(client, "_hpc05_registrations", None)
+    if watcher is None:
+        watcher = RegistrationWatcher(client)
+        client._hpc05_registrations = watcher
+    return watcher
+
+
+def has_watcher(client):
+    """Whether `client` has a `RegistrationWatcher`."""
+    return getattr(client, "_hpc05_registrations", None) is not None
+
+
+def close_watcher(client):
+    """Close the `RegistrationWatcher` of `client`, unless it has callbacks."""
+    watcher = getattr(client, "_hpc05_registrations", None)
+    if watcher is not None and not watcher.callbacks:
+        watcher.close()
+        del client._hpc05_registrations
@@ -0,0 +1,359 @@
+import hashlib
+import inspect
+import os
+import pickle
+import site
+import sys
+import sysconfig
+import tempfile
+from contextlib import suppress
+from functools import lru_cache, partial
+
+# Length of the sha256 checksum at the start of every entry.
+_CHECKSUM_SIZE = 32
+
+
+def _global_names(code):
+    """The global names that `code` (including its nested functions) uses."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= _global_names(const)
+    return names
+
+
+@lru_cache(maxsize=None)
+def _library_paths():
+    """The folders of the standard library and the installed packages."""
+    paths = set(sysconfig.get_paths().values())
+    with suppress(AttributeError):  # not available in a virtualenv's site.py
+        paths.update(site.getsitepackages())
+    paths.add(site.getusersitepackages())
+    return tuple(os.path.join(os.path.realpath(p), "") for p in paths)
+
+
+def _by_value(obj):
+    """Whether the function or class `obj` is hashed by value.
+
+    This is the case for objects that are defined in ``__main__`` or in
+    a module outside the standard library and the installed packages,
+    e.g. a ``.py`` file next to the notebook that is still being edited.
+    """
+    if obj.__module__ == "__main__":
+        return True
+    fname = getattr(sys.modules.get(obj.__module__), "__file__", None)
+    if fname is None:  # a built-in module
+        return False
+    return not os.path.realpath(fname).startswith(_library_paths())
+
+
+def _state(obj, seen):
+    """A picklable form of `obj` that is the same in every Python process.
+
+    Code objects are represented without their filename and line numbers,
+    these change when a notebook's kernel restarts. Functions (and classes)
+    that are defined in ``__main__`` or in the user's own modules (see
+    `_by_value`) are represented by value, including their defaults,
+    closure, and the globals they use, the ones of the standard library
+    and the installed packages, and modules by their name, and other
+    values by their ``dill`` serialization.
+    """
+    import dill
+
+    if inspect.iscode(obj):
+        return (
+            "code",
+            obj.co_name,
+            obj.co_argcount,
+            obj.co_kwonlyargcount,
+            obj.co_flags,
+            obj.co_code,
+            obj.co_names,
+            obj.co_varnames,
+            obj.co_freevars,
+            obj.co_cellvars,
+            _state(obj.co_consts, seen),
+        )
+    if isinstance(obj, partial):
+        return (
+            "partial",
+            *(_state(x, seen) for x in (obj.func, obj.args, obj.keywords)),
+        )
+    if inspect.ismodule(obj):
+        return ("module", obj.__name__)
+    if inspect.isfunction(obj) or inspect.isclass(obj):
+        if not _by_value(obj):
+            return ("ref", obj.__module__, obj.__qualname__)
+        if id(obj) in seen:  # a recursive function
+            return ("seen", obj.__module__, obj.__qualname__)
+        seen.add(id(obj))
+        if inspect.isclass(obj):
+            with suppress(OSError, TypeError):
+                source = inspect.getsource(obj)
+                return ("class", obj.__module__, obj.__qualname__, source)
+            return (
+                "class",
+                obj.__module__,
+                obj.__qualname__,
+                dill.dumps(obj, protocol=4),
+            )
+        f_globals = obj.__globals__
+        names = sorted(_global_names(obj.__code__) & f_globals.keys())
+        closure = []
+        for cell in obj.__closure__ or ():
+            with suppress(ValueError):  # an empty cell
+                closure.append(cell.cell_contents)
+        return (
+            "function",
+            obj.__module__,
+            _state(obj.__code__, seen),
+            _state(obj.__defaults__, seen),
+            _state(obj.__kwdefaults__, seen),
+            _state(closure, seen),
+            _state({name: f_globals[name] for name in names}, seen),
+        )
+    if isinstance(obj, (list, tuple)):
+        return (type(obj).__name__, tuple(_state(x, seen) for x in obj))
+    if isinstance(obj, dict):
+        return (
+            "dict",
+            tuple((_state(k, seen), _state(v, seen)) for k, v in obj.items()),
+        )
+    if isinstance(obj, (set, frozenset)):
+        # The order of a set of strings changes between processes.
+        states = sorted(pickle.dumps(_state(x, seen), protocol=4) for x in obj)
+        return (type(obj).__name__, tuple(states))
+    return dill.dumps(obj, protocol=4)
+
+
+def function_hash(f, version=None):
+    """Hash of the source and the code of the function, including its closure.
+
+    Functions that are defined in ``__main__`` (e.g. in a notebook) or in
+    the user's own modules are hashed by value, including the defaults,
+    the closure, and the globals they use, but not the filename and line
+    numbers of their code, so the hash doesn't change when the kernel
+    restarts. See `_state`.
+
+    The functions and classes of the standard library and the installed
+    packages are hashed by their name only, so pass a different `version`
+    (any value with a stable ``repr``) when the results depend on a
+    package that changed, e.g. ``version=kwant.__version__``.
+    """
+    h = hashlib.sha256()
+    with suppress(OSError, TypeError):
+        h.update(inspect.getsource(getattr(f, "func", f)).encode())
+    h.update(pickle.dumps(_state(f, set()), protocol=4))
+    if version is not None:
+        h.update(repr(version).encode())
+    return h.hexdigest()
+
+
+def _is_intact(data):
+    """Whether the checksum at the start of `data` matches the rest."""
+    checksum, payload = data[:_CHECKSUM_SIZE], data[_CHECKSUM_SIZE:]
+    return hashlib.sha256(payload).digest() == checksum
+
+
+def _call_indexed(f, i, *args):
+    return i, f(*args)
+
+
+class ResultCache:
+    """An on-disk cache of results, with a size limit.
+
+    Every result is stored in its own file, ``{folder}/{key[:2]}/{key}``,
+    that starts with the sha256 checksum of the ``dill`` serialized result.
+    Files are written to a temporary file and then renamed, so a cache in a
+    shared folder can be used by several processes at the same time.
+
+    Parameters
+    ----------
+    folder : str, default: "~/.cache/hpc05"
+        The folder of the cache.
+    max_size : int, default: 10 GB
+        Maximal size (in bytes) of the cache, `evict` removes the least
+        recently used results above this size.
+
+    Attributes
+    ----------
+    hits : int
+        Number of results that were found.
+    misses : int
+        Number of results that were not found (or corrupted).
+    """
+
+    def __init__(self, folder="~/.cache/hpc05", max_size=10 * 1024**3):
+        self.folder = os.path.expanduser(folder)
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, f_hash, args):
+        """The key of the result of ``f(*args)``, with ``f_hash = function_hash(f)``."""
+        import dill
+
+        h = hashlib.sha256(f_hash.encode())
+        h.update(dill.dumps(args, protocol=4))
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.folder, key[:2], key)
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def __getitem__(self, key):
+        import dill
+
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            raise KeyError(key)
+        if not _is_intact(data):
+            with suppress(OSError):
+                os.remove(path)
+            self.misses += 1
+            raise KeyError(key)
+        with suppress(OSError):
+            os.utime(path)  # for the LRU eviction
+        self.hits += 1
+        return dill.loads(data[_CHECKSUM_SIZE:])
+
+    def __setitem__(self, key, value):
+        import dill
+
+        payload = dill.dumps(value, protocol=4)
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(hashlib.sha256(payload).digest())
+                f.write(payload)
+            os.replace(tmp, path)
+        except BaseException:
+            with suppress(OSError):
+                os.remove(tmp)
+            raise
+
+    def _entries(self):
+        """``(mtime, size, path)`` of all entries."""
+        entries = []
+        with suppress(FileNotFoundError):
+            for shard in os.scandir(self.folder):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.name.startswith(".tmp"):
+                        continue
+                    with suppress(FileNotFoundError):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    @property
+    def size(self):
+        """The total size (in bytes) of the cache."""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Remove the least recently used results until the cache fits in `max_size`.
+
+        Returns
+        -------
+        n_removed : int
+            Number of removed results.
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        n_removed = 0
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            with suppress(FileNotFoundError):
+                os.remove(path)
+                n_removed += 1
+            total -= size
+        return n_removed
+
+    def verify(self):
+        """Check the checksums of all results and remove the corrupted ones.
+
+        Returns
+        -------
+        corrupted : list
+            The keys of the removed results.
+        """
+        corrupted = []
+        for _, _, path in self._entries():
+            with suppress(FileNotFoundError):
+                with open(path, "rb") as f:
+                    data = f.read()
+                if not _is_intact(data):
+                    os.remove(path)
+                    corrupted.append(os.path.basename(path))
+        return corrupted
+
+    def clear(self):
+        """Remove all results."""
+        for _, _, path in self._entries():
+            with suppress(FileNotFoundError):
+                os.remove(path)
+
+
+def cached_map(view, f, *sequences, cache=None, version=None, **map_kwargs):
+    """Like ``view.map_sync(f, *sequences)``, but only computes the results
+    that are not in `cache` yet.
+
+    The results are stored as soon as they come in, so after a crash or a
+    kernel restart, the finished points of a parameter sweep are not
+    computed again. The key of a result is the hash of the function (see
+    `function_hash`) and its arguments.
+
+    Parameters
+    ----------
+    view : ipyparallel.client.view.LoadBalancedView
+        E.g. the `lview` returned by `hpc05.connect_ipcluster`.
+    f : callable
+        The function, called as ``f(*args)`` with an item of every sequence.
+    *sequences : iterables
+        The arguments of `f`.
+    cache : ResultCache, optional
+        By default a `ResultCache` in "~/.cache/hpc05".
+    version : optional
+        Salt of the function's hash, change it to compute the results again,
+        e.g. when a package that `f` uses was updated, see `function_hash`.
+    **map_kwargs
+        Passed to ``view.map_async``, e.g. ``chunksize``.
+
+    Returns
+    -------
+    results : list
+        The results, in the order of `sequences`.
+    """
+    if cache is None:
+        cache = ResultCache()
+    f_hash = function_hash(f, version)
+    items = list(zip(*sequences))
+    keys = [cache.key(f_hash, args) for args in items]
+    results = [None] * len(items)
+    todo = []
+    for i, key in enumerate(keys):
+        try:
+            results[i] = cache[key]
+        except KeyError:
+            todo.append(i)
+    if todo:
+        args = [items[i] for i in todo]
+        ar = view.map_async(
+            partial(_call_indexed, f), todo, *zip(*args), ordered=False, **map_kwargs
+        )
+        for i, result in ar:
+            cache[keys[i]] = result
+            results[i] = result
+        cache.evict()
+    return results
@@ -0,0 +1,84 @@
+import hpc05_monitor
+
+
+class MemoryAwareView:
+    """A load-balanced view that keeps new tasks away from engines that
+    are almost out of memory and prefers engines on underloaded nodes.
+
+    Every time tasks are submitted, the targets are chosen with the latest
+    data of `hpc05_monitor` (so start it with ``hpc05_monitor.start(client)``
+    and ``hpc05_monitor.publish_data_forever`` on the engines):
+
+    * engines with a `hpc05_monitor.memory_usage` of at least `max_mem`
+      (of their node or their cgroup) are excluded,
+    * of the remaining engines, the ones on nodes with a CPU usage of at
+      least `max_cpu` are excluded, unless that would exclude them all.
+
+    Engines without data (e.g. that just registered) are always included.
+    When all engines are excluded, the targets of `view` are used.
+    The targets are fixed when the tasks are submitted, so submit large
+    numbers of tasks in several calls to make use of newer data.
+
+    Parameters
+    ----------
+    view : ipyparallel.client.view.LoadBalancedView
+        E.g. the `lview` returned by `hpc05.connect_ipcluster`.
+    max_mem : float, default: 85
+        Memory usage (in %) above which engines get no new tasks.
+    max_cpu : float, default: 90
+        CPU usage (in %) above which nodes are avoided.
+    data : dict, optional
+        The data per engine id, by default `hpc05_monitor.LATEST_DATA`.
+
+    Examples
+    --------
+    >>> view = MemoryAwareView(lview, max_mem=80)
+    >>> results = view.map_sync(f, xs)
+    """
+
+    def __init__(self, view, max_mem=85, max_cpu=90, data=None):
+        self.view = view
+        self.max_mem = max_mem
+        self.max_cpu = max_cpu
+        self.data = data
+
+    def targets(self):
+        """The engine ids that the next tasks may run on."""
+        data = hpc05_monitor.LATEST_DATA if self.data is None else self.data
+        targets = self.view.targets
+        if targets is None:
+            engine_ids = self.view.client.ids
+        elif isinstance(targets, int):
+            engine_ids = [targets]
+        else:
+            engine_ids = list(targets)
+        unknown, underloaded, overloaded = [], [], []
+        for eid in engine_ids:
+            info = data.get(eid)
+            if info is None:
+                unknown.append(eid)
+            elif hpc05_monitor.memory_usage(info) >= self.max_mem:
+                continue
+            elif info["cpu"] >= self.max_cpu:
+                overloaded.append(eid)
+            else:
+                underloaded.append(eid)
+        eligible = unknown + (underloaded or overloaded)
+        return sorted(eligible) if eligible else targets
+
+    def apply_async(self, f, *args, **kwargs):
+        with self.view.temp_flags(targets=self.targets()):
+            return self.view.apply_async(f, *args, **kwargs)
+
+    def apply_sync(self, f, *args, **kwargs):
+        return self.apply_async(f, *args, **kwargs).get()
+
+    def map_async(self, f, *sequences, **kwargs):
+        with self.view.temp_flags(targets=self.targets()):
+            return self.view.map_async(f, *sequences, **kwargs)
+
+    def map_sync(self, f, *sequences, **kwargs):
+        return self.map_async(f, *sequences, **kwargs).get()
+
+    def __getattr__(self, name):
+        return getattr(self.view, name)
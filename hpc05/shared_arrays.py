@@ -0,0 +1,156 @@
+import glob
+import hashlib
+import os
+import shutil
+import socket
+from collections import defaultdict
+from contextlib import suppress
+
+# The files of the arrays are called "{PREFIX}{name}-{key}.npy".
+PREFIX = "hpc05-broadcast-"
+
+# The arrays that `broadcast` loaded on this engine, name -> array.
+LOADED = {}
+
+
+def _array_key(array):
+    import numpy as np
+
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{array.dtype.str}{array.shape}".encode())
+    h.update(array.reshape(-1).view(np.uint8))
+    return h.hexdigest()
+
+
+def _hostname():
+    return socket.gethostname()
+
+
+def _store(path, array):
+    """Write `array` to `path` on the engine, via a temporary file."""
+    import numpy as np
+
+    folder = os.path.dirname(path)
+    os.makedirs(folder, exist_ok=True)
+    free = shutil.disk_usage(folder).free
+    if free < array.nbytes:
+        raise Exception(
+            f"Only {free / 1e9:.1f} GB free in {folder} on {_hostname()}, but the"
+            f" array is {array.nbytes / 1e9:.1f} GB, pass another `folder`."
+        )
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp, path)
+    except BaseException:
+        with suppress(OSError):
+            os.remove(tmp)
+        raise
+
+
+def _load(name, path):
+    """Memory-map the array at `path` as `name` in the engine's namespace."""
+    import numpy as np
+    from IPython import get_ipython
+
+    array = np.load(path, mmap_mode="r")
+    get_ipython().user_ns[name] = LOADED[name] = array
+
+
+def _forget(name=None):
+    from IPython import get_ipython
+
+    user_ns = get_ipython().user_ns
+    for n in [name] if name is not None else list(LOADED):
+        array = LOADED.pop(n, None)
+        if array is not None and user_ns.get(n) is array:
+            del user_ns[n]
+
+
+def _remove(folder, name=None):
+    key = "?" * 32
+    pattern = f"{PREFIX}{name}-{key}.npy" if name is not None else f"{PREFIX}*"
+    n_removed = 0
+    for fname in glob.glob(os.path.join(folder, pattern)):
+        with suppress(OSError):
+            os.remove(fname)
+            n_removed += 1
+    return n_removed
+
+
+def _engines_per_host(dview):
+    hosts = defaultdict(list)
+    for eid, host in dview.apply_async(_hostname).get_dict().items():
+        hosts[host].append(eid)
+    return hosts
+
+
+def broadcast(dview, name, array, folder="/dev/shm"):
+    """Send `array` once per host and make it available as `name` on all engines.
+
+    Unlike ``dview.push({name: array})``, which sends (and stores) a copy
+    for every engine, the array is sent to a single engine per host, which
+    writes it to a ``.npy`` file in `folder`. All engines on that host then
+    memory-map this file (read-only), so they share the same memory.
+    When the file of the same array is already on a host (e.g. after
+    broadcasting it before), nothing is sent to that host.
+
+    The files stay on the nodes until `clear_broadcast` is called, in "/dev/shm"
+    they use memory, so call `clear_broadcast` when the array is no longer needed.
+
+    Parameters
+    ----------
+    dview : ipyparallel.client.view.DirectView
+        The engines, e.g. the `dview` returned by `hpc05.connect_ipcluster`.
+    name : str
+        The name of the array in the namespace of the engines.
+    array : numpy.ndarray
+        The array, it can't contain Python objects.
+    folder : str, default: "/dev/shm"
+        The folder on the nodes, "/dev/shm" is in memory, use a local
+        scratch folder when it is too small.
+
+    Returns
+    -------
+    dict
+        The ``path`` of the file on the nodes, and the hosts to which the
+        array was ``sent`` and that had it ``cached``.
+
+    Examples
+    --------
+    >>> hpc05.broadcast(dview, "big", big_array)
+    >>> lview.map_sync(lambda i: big[i].sum(), range(100))
+    """
+    import numpy as np
+
+    array = np.ascontiguousarray(array)
+    if array.dtype.hasobject:
+        raise ValueError("Arrays with Python objects can't be memory-mapped.")
+    path = os.path.join(folder, f"{PREFIX}{name}-{_array_key(array)}.npy")
+    hosts = _engines_per_host(dview)
+    leaders = {host: min(eids) for host, eids in hosts.items()}
+    client = dview.client
+    exists = client[list(leaders.values())].apply_async(os.path.exists, path)
+    exists = exists.get_dict()
+    sent = [host for host, eid in leaders.items() if not exists[eid]]
+    stores = [client[leaders[host]].apply_async(_store, path, array) for host in sent]
+    for ar in stores:
+        ar.get()
+    dview.apply_sync(_load, name, path)
+    cached = [host for host in leaders if host not in sent]
+    return {"path": path, "sent": sent, "cached": cached}
+
+
+def clear_broadcast(dview, name=None, folder="/dev/shm"):
+    """Remove the broadcast array `name` (or all of them) from the engines
+    and its files from the nodes.
+
+    Returns
+    -------
+    n_removed : int
+        Number of removed files.
+    """
+    dview.apply_sync(_forget, name)
+    leaders = [min(eids) for eids in _engines_per_host(dview).values()]
+    return sum(dview.client[leaders].apply_sync(_remove, folder, name))
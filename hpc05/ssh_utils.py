@@ -1,7 +1,14 @@
+import atexit
+from contextlib import contextmanager
 import os.path
+import threading
+import time
+
 import paramiko
 from paramiko.ssh_exception import PasswordRequiredException, SSHException
 
+from hpc05.timeline import TIMELINE
+
 
 def get_info_from_ssh_config(hostname):
     user_config_file = os.path.expanduser("~/.ssh/config")
@@ -19,6 +26,8 @@ def get_info_from_ssh_config(hostname):
 
 
 def setup_ssh(hostname="hpc05", username=None, password=None):
+    """Open a new ssh connection, use `pooled_ssh` to reuse connections."""
+    proxy = None
     if username is None:
         try:
             username, hostname, proxy = get_info_from_ssh_config(hostname)
@@ -39,3 +48,127 @@ def setup_ssh(hostname="hpc05", username=None, password=None):
         ]
         raise Exception("\n".join(msg))
     return ssh
+
+
+class SSHPool:
+    """Keep ssh connections open and share them between hpc05 calls.
+
+    Connections are keyed by ``(hostname, username)``, so the ``~/.ssh/config``
+    lookup and the key exchange (possibly through a ProxyCommand) only happen
+    once per host. Idle connections are kept alive with keepalive packets and
+    are closed after `idle_timeout` seconds without use.
+
+    Parameters
+    ----------
+    idle_timeout : int
+        Seconds after which an unused connection is closed.
+    keepalive : int
+        Interval in seconds of the keepalive packets.
+
+    Attributes
+    ----------
+    n_handshakes : int
+        Number of new connections that were made by the pool.
+    """
+
+    def __init__(self, idle_timeout=600, keepalive=30):
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.n_handshakes = 0
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._stop = threading.Event()
+        self._reaper = None
+
+    def get(self, hostname="hpc05", username=None, password=None):
+        """Return an open `paramiko.SSHClient`, do not close it."""
+        return self._checkout(hostname, username, password, users=0)["ssh"]
+
+    @contextmanager
+    def connection(self, hostname="hpc05", username=None, password=None):
+        """Context manager that borrows a connection from the pool.
+
+        The connection is not closed on exit and will not be evicted
+        while it is in use.
+        """
+        connection = self._checkout(hostname, username, password, users=1)
+        try:
+            yield connection["ssh"]
+        finally:
+            with self._lock:
+                connection["users"] -= 1
+                connection["last_used"] = time.time()
+
+    def _checkout(self, hostname, username, password, users):
+        """Return the pool's entry of an open connection, with `users` added.
+
+        Only logins to the same host wait for each other, the pool itself
+        is not locked while connecting.
+        """
+        key = (hostname, username)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                connection = self._connections.get(key)
+                if connection is not None and _is_active(connection["ssh"]):
+                    connection["last_used"] = time.time()
+                    connection["users"] += users
+                    return connection
+                self._connections.pop(key, None)
+            if connection is not None:
+                connection["ssh"].close()
+            with TIMELINE.span("ssh_connect", hostname=hostname):
+                ssh = setup_ssh(hostname, username, password)
+            ssh.get_transport().set_keepalive(self.keepalive)
+            connection = {"ssh": ssh, "last_used": time.time(), "users": users}
+            with self._lock:
+                self.n_handshakes += 1
+                self._connections[key] = connection
+                self._start_reaper()
+            return connection
+
+    def close_idle(self):
+        """Close the connections that are unused for `idle_timeout` seconds."""
+        now = time.time()
+        with self._lock:
+            for key, connection in list(self._connections.items()):
+                idle = now - connection["last_used"]
+                if connection["users"] == 0 and idle > self.idle_timeout:
+                    connection["ssh"].close()
+                    del self._connections[key]
+
+    def close(self):
+        """Close all connections."""
+        self._stop.set()
+        with self._lock:
+            for connection in self._connections.values():
+                connection["ssh"].close()
+            self._connections.clear()
+
+    def _start_reaper(self):
+        if self._reaper is not None and self._reaper.is_alive():
+            return
+        self._stop.clear()
+
+        def reap():
+            while not self._stop.wait(self.idle_timeout / 2):
+                self.close_idle()
+
+        self._reaper = threading.Thread(target=reap, daemon=True)
+        self._reaper.start()
+
+
+def _is_active(ssh):
+    transport = ssh.get_transport()
+    return transport is not None and transport.is_active()
+
+
+POOL = SSHPool()
+atexit.register(POOL.close)
+
+
+def pooled_ssh(hostname="hpc05", username=None, password=None):
+    """Borrow a connection from `POOL`, use as ``with pooled_ssh() as ssh:``."""
+    return POOL.connection(hostname, username, password)
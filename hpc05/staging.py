@@ -0,0 +1,217 @@
+import hashlib
+import json
+import math
+import os
+import shlex
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+
+from hpc05.ssh_utils import pooled_ssh
+from hpc05.utils import print_same_line
+
+# The manifests of the uploads, these record which chunks are uploaded.
+# Not inside "~/.cache/hpc05", that folder belongs to the `ResultCache`.
+MANIFEST_FOLDER = os.path.expanduser("~/.cache/hpc05-staging")
+
+
+class StagedFile:
+    """A reference to a file on the cluster's filesystem.
+
+    Pass this to the engines instead of the data, only the path is sent.
+    It works wherever a path does (it implements ``os.PathLike``).
+
+    Parameters
+    ----------
+    path : str
+        The absolute path on the cluster.
+    size : int, optional
+        The size in bytes.
+    dtype, shape, offset : optional
+        Passed to `numpy.memmap` in `load`, for raw binary files.
+    """
+
+    def __init__(self, path, size=None, dtype=None, shape=None, offset=0):
+        self.path = path
+        self.size = size
+        self.dtype = dtype
+        self.shape = shape
+        self.offset = offset
+
+    def __fspath__(self):
+        return self.path
+
+    def __repr__(self):
+        return f"StagedFile({self.path!r}, size={self.size})"
+
+    def open(self, mode="rb"):
+        return open(self.path, mode)
+
+    def load(self):
+        """Memory-map the file (read-only), use on the engines.
+
+        A ``.npy`` file is loaded with ``numpy.load(..., mmap_mode="r")``,
+        other files with ``numpy.memmap`` (as bytes by default).
+        """
+        import numpy as np
+
+        if self.path.endswith(".npy"):
+            return np.load(self.path, mmap_mode="r")
+        return np.memmap(
+            self.path,
+            dtype=self.dtype or np.uint8,
+            mode="r",
+            offset=self.offset,
+            shape=self.shape,
+        )
+
+
+def _manifest_fname(hostname, remote_path):
+    key = hashlib.sha256(f"{hostname}:{remote_path}".encode()).hexdigest()[:16]
+    return os.path.join(MANIFEST_FOLDER, f"{key}.json")
+
+
+def _read_manifest(fname):
+    with suppress(FileNotFoundError, ValueError):
+        with open(fname) as f:
+            return json.load(f)
+    return {}
+
+
+def _write_manifest(fname, manifest):
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    with open(fname + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(fname + ".tmp", fname)
+
+
+def _remote_size(sftp, path):
+    with suppress(FileNotFoundError):
+        return sftp.stat(path).st_size
+
+
+def _upload_chunks(ssh, local_path, part, chunks, chunk_size, on_done):
+    """Upload `chunks` over a separate sftp channel."""
+    with ssh.open_sftp() as sftp, open(local_path, "rb") as src:
+        for i in chunks:
+            src.seek(i * chunk_size)
+            data = src.read(chunk_size)
+            # Closing the file waits until all pipelined writes are done.
+            with sftp.open(part, "r+") as dst:
+                dst.set_pipelined(True)
+                dst.seek(i * chunk_size)
+                dst.write(data)
+            on_done(i)
+
+
+def stage(
+    local_path,
+    remote_path,
+    hostname="hpc05",
+    username=None,
+    password=None,
+    chunk_size=32 * 1024**2,
+    n_parallel=4,
+    dtype=None,
+    shape=None,
+    offset=0,
+):
+    """Upload a file to the cluster's filesystem, such that the engines can
+    memory-map it, instead of sending the data through the tunnel.
+
+    The file is uploaded in chunks, over `n_parallel` sftp channels of a
+    pooled ssh connection, to ``{remote_path}.part``, which is renamed to
+    `remote_path` when complete. The uploaded chunks are recorded in a
+    local manifest (in `MANIFEST_FOLDER`), so an interrupted upload resumes
+    where it stopped when calling `stage` again. When the file is already
+    uploaded (and didn't change locally), nothing is uploaded.
+
+    Parameters
+    ----------
+    local_path : str
+        The local file.
+    remote_path : str
+        The path on the cluster, should be on a filesystem that the
+        engines share, may start with "~/".
+    hostname : str
+        Hostname of cluster headnode.
+    username : str
+        Username to log into `hostname`. If not provided, it tries to look it up in
+        your `.ssh/config`.
+    password : str
+        Password for `ssh username@hostname`.
+    chunk_size : int, default: 32 MB
+        Size of the chunks in bytes.
+    n_parallel : int, default: 4
+        Number of chunks that are uploaded at the same time.
+    dtype, shape, offset : optional
+        See `StagedFile`.
+
+    Returns
+    -------
+    StagedFile
+        The reference to pass to the engines, e.g.
+        ``lview.map(lambda i: f(staged.load()[i]), ...)``.
+    """
+    stat = os.stat(local_path)
+    size = stat.st_size
+    n_chunks = math.ceil(size / chunk_size)
+    source = {"size": size, "mtime": stat.st_mtime, "chunk_size": chunk_size}
+
+    with pooled_ssh(hostname, username, password) as ssh:
+        with ssh.open_sftp() as sftp:
+            if remote_path.startswith("~/"):
+                remote_path = sftp.normalize(".") + remote_path[1:]
+            staged = StagedFile(remote_path, size, dtype, shape, offset)
+            part = remote_path + ".part"
+            manifest_fname = _manifest_fname(hostname, remote_path)
+            manifest = _read_manifest(manifest_fname)
+            if manifest.get("source") != source:
+                manifest = {"source": source, "done": [], "complete": False}
+            if manifest["complete"] and _remote_size(sftp, remote_path) == size:
+                return staged
+
+            if not manifest["done"] or _remote_size(sftp, part) != size:
+                folder = shlex.quote(os.path.dirname(remote_path) or ".")
+                _, stdout, _ = ssh.exec_command(f"mkdir -p {folder}")
+                stdout.channel.recv_exit_status()
+                with sftp.open(part, "w") as f:
+                    f.truncate(size)
+                manifest.update(done=[], complete=False)
+                _write_manifest(manifest_fname, manifest)
+
+            done = set(manifest["done"])
+            todo = [i for i in range(n_chunks) if i not in done]
+            lock = threading.Lock()
+
+            def on_done(i):
+                with lock:
+                    manifest["done"].append(i)
+                    _write_manifest(manifest_fname, manifest)
+                    n_done = len(manifest["done"])
+                    print_same_line(f"Uploaded {n_done} of {n_chunks} chunks.")
+
+            n_workers = max(min(n_parallel, len(todo)), 1)
+            with ThreadPoolExecutor(n_workers) as executor:
+                futures = [
+                    executor.submit(
+                        _upload_chunks,
+                        ssh,
+                        local_path,
+                        part,
+                        todo[i::n_workers],
+                        chunk_size,
+                        on_done,
+                    )
+                    for i in range(n_workers)
+                ]
+                for future in futures:
+                    future.result()
+
+            if _remote_size(sftp, part) != size:
+                raise Exception(f"The size of {part} is not {size} bytes.")
+            sftp.posix_rename(part, remote_path)
+            manifest["complete"] = True
+            _write_manifest(manifest_fname, manifest)
+            print_same_line(f"Staged {local_path} at {remote_path}.", new_line_end=True)
+    return staged
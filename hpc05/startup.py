@@ -0,0 +1,270 @@
+import asyncio
+import threading
+import time
+from contextlib import suppress
+
+from hpc05.client import Client, get_culler_cmd, start_remote_culler
+from hpc05.connection_files import remote_connection_file
+from hpc05.ssh_utils import pooled_ssh
+from hpc05.timeline import TIMELINE
+from hpc05.utils import print_same_line
+
+
+def _run_in_thread(func, *args, **kwargs):
+    """Run a blocking function in a daemon thread and return an awaitable.
+
+    Daemon threads are used (instead of `loop.run_in_executor`) so a stage
+    that is still blocking after another stage failed cannot keep the
+    interpreter alive.
+    """
+    loop = asyncio.get_event_loop()
+    future = loop.create_future()
+
+    def set_result(result=None, error=None):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def target():
+        try:
+            result, error = func(*args, **kwargs), None
+        except Exception as e:
+            result, error = None, e
+        with suppress(RuntimeError):  # the loop is already closed
+            loop.call_soon_threadsafe(set_result, result, error)
+
+    threading.Thread(target=target, daemon=True).start()
+    return future
+
+
+def run_sync(coro):
+    """Run `coro` to completion in a new event loop in a separate thread.
+
+    This also works when an event loop is already running in the current
+    thread, like inside a Jupyter notebook.
+    """
+    outcome = {}
+
+    def target():
+        loop = asyncio.new_event_loop()
+        try:
+            outcome["result"] = loop.run_until_complete(coro)
+        except BaseException as error:
+            outcome["error"] = error
+        finally:
+            loop.close()
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+class StageTimer:
+    """Record when each startup stage starts and ends.
+
+    Attributes
+    ----------
+    timings : dict
+        Maps the stage name to a dict with the ``start`` and ``end`` time
+        (in seconds since the timer was created) and the ``duration``,
+        these are None for stages that did not finish.
+    """
+
+    def __init__(self):
+        self.t_start = time.time()
+        self.timings = {}
+
+    async def run(self, name, awaitable):
+        start = time.time() - self.t_start
+        self.timings[name] = {"start": start, "end": None, "duration": None}
+        try:
+            return await awaitable
+        finally:
+            end = time.time() - self.t_start
+            self.timings[name].update(end=end, duration=end - start)
+            TIMELINE.add(f"stage:{name}", self.t_start + start, self.t_start + end)
+
+
+def _remote_stat(remote_json, hostname, username, password):
+    with pooled_ssh(hostname, username, password) as ssh:
+        with ssh.open_sftp() as sftp:
+            with suppress(FileNotFoundError):
+                stat = sftp.stat(remote_json)
+                return stat.st_mtime, stat.st_size
+
+
+async def _wait_for_new_connection_file(
+    remote_json, previous, hostname, username, password, timeout, start, interval=0.5
+):
+    """Wait until the controller wrote a new connection file.
+
+    The file counts as new when its ``stat`` differs from `previous`
+    and stays the same for `interval` seconds (so it is completely written).
+    """
+    t_start = time.time()
+    last = previous
+    while True:
+        if start.done() and start.exception() is not None:
+            return  # `start` will raise
+        stat = await _run_in_thread(
+            _remote_stat, remote_json, hostname, username, password
+        )
+        if stat is not None and stat != previous and stat == last:
+            return
+        last = stat
+        if time.time() - t_start > timeout:
+            raise Exception(
+                f"The controller didn't write {remote_json} in {timeout} seconds."
+            )
+        await asyncio.sleep(interval)
+
+
+async def start_remote_and_connect_async(
+    n,
+    profile="pbs",
+    hostname="hpc05",
+    username=None,
+    password=None,
+    culler=True,
+    culler_args=None,
+    env_path=None,
+    timeout=300,
+    folder=None,
+    client_kwargs=None,
+    kill_old_ipcluster=True,
+    min_engines=None,
+):
+    """Start a remote `ipcluster` and connect to it, running the stages concurrently.
+
+    After the old cluster is killed, the following stages start as soon as
+    their own prerequisites are met:
+
+    * ``start``: start the ``ipcluster`` and wait for the log-file to report
+      that the engines started,
+    * ``connection_file``: wait for the controller to write a new
+      ``ipcontroller-client.json``,
+    * ``client``: copy over the connection file, setup the tunnel and connect,
+      after ``connection_file``,
+    * ``culler``: start the culler, after ``connection_file``,
+    * ``engines``: wait for the engines to register, after ``client``.
+
+    The arguments are the same as for `hpc05.start_remote_and_connect`.
+
+    Returns
+    -------
+    client : ipython.Client object
+        An IPyparallel client, ``client.startup_timings`` contains the
+        per-stage timings (see `StageTimer`).
+    dview : ipyparallel.client.view.DirectView object
+        Direct view, equivalent to `client[:]`.
+    lview : ipyparallel.client.view.LoadBalancedView
+        LoadedBalancedView, equivalent to `client.load_balanced_view()`.
+    """
+    from hpc05.connect import (
+        kill_remote_ipcluster,
+        setup_views,
+        start_remote_ipcluster,
+    )
+
+    timer = StageTimer()
+    ssh_args = (hostname, username, password)
+    remote_json = remote_connection_file(profile)
+
+    if kill_old_ipcluster:
+        await timer.run(
+            "kill",
+            _run_in_thread(kill_remote_ipcluster, *ssh_args, env_path, profile),
+        )
+        print("Killed old intances of ipcluster.")
+
+    previous = await _run_in_thread(_remote_stat, remote_json, *ssh_args)
+    stop_start = threading.Event()
+    start = asyncio.ensure_future(
+        timer.run(
+            "start",
+            _run_in_thread(
+                start_remote_ipcluster,
+                n,
+                profile,
+                *ssh_args,
+                env_path,
+                timeout,
+                stop=stop_start,
+            ),
+        )
+    )
+
+    async def connect():
+        await timer.run(
+            "connection_file",
+            _wait_for_new_connection_file(
+                remote_json, previous, *ssh_args, timeout, start
+            ),
+        )
+        if start.done() and start.exception() is not None:
+            return
+        stages = [
+            timer.run(
+                "client",
+                _run_in_thread(
+                    Client,
+                    profile=profile,
+                    hostname=hostname,
+                    username=username,
+                    password=password,
+                    culler=False,
+                    env_path=env_path,
+                    local=False,
+                    timeout=timeout,
+                    **(client_kwargs or {}),
+                ),
+            )
+        ]
+        if culler:
+            culler_cmd = get_culler_cmd(profile, env_path, culler_args)
+            stages.append(
+                timer.run(
+                    "culler",
+                    _run_in_thread(start_remote_culler, culler_cmd, *ssh_args),
+                )
+            )
+        client, *_ = await asyncio.gather(*stages)
+        print("Connected to the `ipcluster` using an `ipyparallel.Client`.")
+        dview, lview = await timer.run(
+            "engines",
+            _run_in_thread(
+                setup_views, client, n, timeout, folder, min_engines=min_engines
+            ),
+        )
+        return client, dview, lview
+
+    connected = asyncio.ensure_future(connect())
+    try:
+        while not connected.done():
+            pending = [task for task in (start, connected) if not task.done()]
+            await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if start.done() and start.exception() is not None:
+                connected.cancel()
+                raise start.exception()
+        client, dview, lview = connected.result()
+    finally:
+        if not start.done():
+            # Connected (no need to wait for the log-file to say so) or failed.
+            # Cancelling doesn't stop the thread, so also stop it from printing.
+            stop_start.set()
+            start.cancel()
+
+    client.startup_timings = timer.timings
+    msg = ", ".join(
+        f"{k}: {v['duration']:.1f} s"
+        for k, v in timer.timings.items()
+        if v["duration"] is not None
+    )
+    print_same_line(f"Startup stages took {msg}.", new_line_end=True)
+    return client, dview, lview
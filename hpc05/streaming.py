@@ -0,0 +1,182 @@
+import queue
+from contextlib import suppress
+from itertools import islice
+
+from hpc05.chunking import _run_chunk
+
+
+class Purger:
+    """Forget finished tasks in the client, the view, and the hub, in batches.
+
+    Otherwise the client (``client.results``, ``client.metadata``, and
+    ``client.history``), the view (``view.history``), and the hub keep
+    a record of every task for the whole session.
+
+    The hub refuses to purge a batch while it hasn't recorded the result
+    of one of its tasks yet, which can happen after the client received
+    that result. So the hub purges the previous batch, one batch behind.
+
+    Parameters
+    ----------
+    view : ipyparallel.client.view.View
+        The view that submitted the tasks.
+    hub : bool, default: True
+        Also purge the results in the hub's database.
+    every : int, default: 1000
+        Number of tasks that are purged at once.
+    """
+
+    def __init__(self, view, hub=True, every=1000):
+        self.view = view
+        self.hub = hub
+        self.every = every
+        self.msg_ids = []
+        self.hub_msg_ids = []  # purged in the client, not yet in the hub
+
+    def add(self, ar):
+        """Purge the tasks of the finished `AsyncResult` (with the next batch)."""
+        self.msg_ids.extend(ar.msg_ids)
+        if len(self.msg_ids) >= self.every:
+            self.purge()
+
+    def purge(self, hub=None):
+        """Purge the tasks now, `hub=False` skips the hub (which waits for its reply).
+
+        In the hub this purges the previous batch, and the current one too
+        when `hub` is given (e.g. at the end, then only the tasks whose
+        results the hub recorded).
+        """
+        msg_ids, self.msg_ids = self.msg_ids, []
+        client = self.view.client
+        if msg_ids:
+            client.purge_local_results(msg_ids)
+            purged = set(msg_ids)
+            for history in (client.history, self.view.history):
+                history[:] = [msg_id for msg_id in history if msg_id not in purged]
+        if hub is None:
+            batches, self.hub_msg_ids = [self.hub_msg_ids], msg_ids
+            hub = self.hub
+        else:
+            batches, self.hub_msg_ids = [self.hub_msg_ids, msg_ids], []
+        for batch in batches if hub else []:
+            if batch:
+                _purge_hub(client, batch)
+
+
+def _purge_hub(client, msg_ids):
+    """Purge `msg_ids` in the hub, those it recorded when it refuses some."""
+    with suppress(Exception):  # e.g. the hub doesn't store results
+        try:
+            client.purge_hub_results(msg_ids)
+        except Exception:
+            # The hub refuses all when one of them is pending.
+            query = {"msg_id": {"$in": msg_ids}, "completed": {"$ne": None}}
+            records = client.db_query(query, keys=["msg_id"])
+            client.purge_hub_results([r["msg_id"] for r in records])
+
+
+def _get_done(done_queue, timeout):
+    """The finished AsyncResults in `done_queue`, waits `timeout` for the first.
+
+    Unlike ``concurrent.futures.wait`` on all running tasks, this doesn't
+    cost time proportional to the number of tasks in flight.
+    """
+    try:
+        done = [done_queue.get(timeout=timeout)]
+    except queue.Empty:
+        return []
+    while not done_queue.empty():
+        done.append(done_queue.get_nowait())
+    return done
+
+
+def imap(
+    view,
+    f,
+    *sequences,
+    window=1000,
+    chunksize=1,
+    ordered=True,
+    purge_hub=True,
+    purge_every=1000,
+    stall_timeout=None,
+):
+    """Map `f` over `sequences` and yield the results, with bounded memory.
+
+    At most `window` tasks are in flight (or finished, but waiting for an
+    earlier task when `ordered`), the `sequences` are only read when the
+    tasks are submitted (so they can be generators), and the tasks are
+    purged from the client and the hub after their results are yielded
+    (see `Purger`). So the memory use doesn't grow with the number of tasks.
+
+    Parameters
+    ----------
+    view : ipyparallel.client.view.LoadBalancedView
+        E.g. the `lview` returned by `hpc05.connect_ipcluster`.
+    f : callable
+        The function, called as ``f(*args)`` with an item of every sequence.
+    *sequences : iterables
+        The arguments of `f`.
+    window : int, default: 1000
+        Maximal number of tasks that are in flight.
+    chunksize : int, default: 1
+        Number of items per task.
+    ordered : bool, default: True
+        Yield the results in the order of `sequences`, otherwise in the
+        order in which they finish.
+    purge_hub : bool, default: True
+        Also purge the results in the hub.
+    purge_every : int, default: 1000
+        Number of tasks that are purged at once.
+    stall_timeout : float, optional
+        Raise an exception when no task finished in this many seconds.
+
+    Yields
+    ------
+    result
+        The result of ``f(*args)``.
+
+    Examples
+    --------
+    >>> for result in hpc05.imap(lview, f, range(10**6), chunksize=10):
+    ...     total += result
+    """
+    items = zip(*sequences)
+    chunks = iter(lambda: list(islice(items, chunksize)), [])
+    running = {}  # AsyncResult -> chunk number
+    done_queue = queue.SimpleQueue()  # the AsyncResults that finished
+    finished = {}  # chunk number -> results, waiting for an earlier chunk
+    n_submitted = 0
+    next_chunk = 0  # the next chunk to yield, if ordered
+    purger = Purger(view, purge_hub, purge_every)
+    try:
+        while True:
+            n_free = window - len(running) - len(finished)
+            for chunk in islice(chunks, max(n_free, 0)):
+                ar = view.apply_async(_run_chunk, f, chunk)
+                running[ar] = n_submitted
+                ar.add_done_callback(done_queue.put)
+                n_submitted += 1
+            if not running:
+                break
+            done = _get_done(done_queue, stall_timeout)
+            if not done:
+                raise Exception(f"No task finished in {stall_timeout} seconds.")
+            for ar in done:
+                i = running.pop(ar)
+                results, _ = ar.get()
+                purger.add(ar)
+                if ordered:
+                    finished[i] = results
+                else:
+                    yield from results
+            while next_chunk in finished:
+                yield from finished.pop(next_chunk)
+                next_chunk += 1
+    finally:
+        if running:
+            with suppress(Exception):
+                view.abort(list(running))
+        with suppress(Exception):
+            # When tasks are still running, the hub might be gone.
+            purger.purge(hub=not running)
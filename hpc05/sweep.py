@@ -0,0 +1,234 @@
+import hashlib
+import os
+import pickle
+import queue
+import struct
+from contextlib import suppress
+from itertools import islice
+
+from hpc05.chunking import _run_chunk
+from hpc05.result_cache import function_hash
+from hpc05.streaming import Purger, _get_done
+
+# The file starts with the magic, the number of points, and the sha256 digests
+# of the function and the points, followed by a frame per result: its index,
+# the size of the pickled result, and the result.
+_MAGIC = b"hpc05-sweep-v2\n"
+_HEADER = struct.Struct("<Q32s32s")
+_FRAME = struct.Struct("<qQ")
+
+
+class SweepRunner:
+    """Run `f` on every point and append the results to a file as they come in.
+
+    When the run is interrupted (e.g. the culler shut down the hub or the
+    ssh tunnel died), call `run` again, with a new view after reconnecting
+    with `hpc05.connect_ipcluster`, to only compute the unfinished points.
+    This also works in a new Python process with the same `fname`, as long
+    as `f` (see `hpc05.result_cache.function_hash`) and `points` didn't change.
+    At most `max_in_flight` tasks are submitted at once, the results are
+    not kept in memory, and the finished tasks are purged from the client
+    and the hub (see `hpc05.streaming.Purger`), so the memory use doesn't
+    grow with the number of points.
+
+    Parameters
+    ----------
+    fname : str
+        The append-only file with the results.
+    f : callable
+        The function that is called with every point.
+    points : sequence
+        The points, e.g. a list, a range, or a numpy array.
+    chunksize : int, default: 1
+        Number of points per task.
+    max_in_flight : int, default: 1000
+        Maximal number of tasks that are submitted at once.
+    stall_timeout : float, default: 3600
+        Stop when no task finished in this many seconds, because the hub
+        or the tunnel is probably gone.
+
+    Attributes
+    ----------
+    finished : bytearray
+        1 for every point whose result is in the file.
+    n_finished : int
+        Number of finished points.
+
+    Examples
+    --------
+    >>> runner = SweepRunner("sweep.pickle", f, points)
+    >>> runner.run(lview)  # interrupted, reconnect and run again
+    >>> results = runner.load()
+    """
+
+    def __init__(
+        self, fname, f, points, chunksize=1, max_in_flight=1000, stall_timeout=3600
+    ):
+        self.fname = fname
+        self.f = f
+        self.points = points
+        self.chunksize = chunksize
+        self.max_in_flight = max_in_flight
+        self.stall_timeout = stall_timeout
+        self.finished = bytearray(len(points))
+        self.n_finished = 0
+        self._header = _HEADER.pack(
+            len(points),
+            bytes.fromhex(function_hash(f)),
+            hashlib.sha256(pickle.dumps(points, protocol=4)).digest(),
+        )
+        self._offset = self._scan()
+
+    def __len__(self):
+        return len(self.points)
+
+    def _read_header(self, f):
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise Exception(f"{self.fname} is not a file of a `SweepRunner`.")
+        header = f.read(_HEADER.size)
+        if header == self._header:
+            return
+        n, f_digest, points_digest = _HEADER.unpack(header)
+        _, expected_f_digest, _ = _HEADER.unpack(self._header)
+        if n != len(self.points):
+            problem = f"the results of {n} points, not {len(self.points)}"
+        elif f_digest != expected_f_digest:
+            problem = "the results of a different function"
+        else:
+            problem = "the results of different points"
+        raise Exception(
+            f"{self.fname} has {problem}, use another file name or remove it."
+        )
+
+    def _frames(self, f):
+        """Yield the offset of the payload, the index, and the size of every
+        complete frame, a frame that was cut off by a crash is ignored."""
+        file_size = os.fstat(f.fileno()).st_size
+        while True:
+            header = f.read(_FRAME.size)
+            if len(header) < _FRAME.size:
+                return
+            index, size = _FRAME.unpack(header)
+            offset = f.tell()
+            if offset + size > file_size:
+                return
+            yield offset, index, size
+            f.seek(offset + size)
+
+    def _scan(self):
+        """Mark the points that are in the file and return the end of the last frame."""
+        try:
+            f = open(self.fname, "rb")
+        except FileNotFoundError:
+            return None
+        with f:
+            self._read_header(f)
+            end = f.tell()
+            for offset, index, size in self._frames(f):
+                if not self.finished[index]:
+                    self.finished[index] = 1
+                    self.n_finished += 1
+                end = offset + size
+        return end
+
+    def results(self):
+        """Yield ``(index, result)`` in the order in which the results came in."""
+        with suppress(FileNotFoundError):
+            with open(self.fname, "rb") as f:
+                self._read_header(f)
+                for offset, index, size in self._frames(f):
+                    f.seek(offset)
+                    yield index, pickle.loads(f.read(size))
+
+    def load(self):
+        """The results in the order of `points`, None for unfinished points."""
+        results = [None] * len(self.points)
+        for index, result in self.results():
+            results[index] = result
+        return results
+
+    def _open(self):
+        if self._offset is None:
+            f = open(self.fname, "wb")
+            f.write(_MAGIC + self._header)
+            self._offset = f.tell()
+        else:
+            f = open(self.fname, "r+b")
+            f.truncate(self._offset)  # remove a frame that was cut off
+            f.seek(self._offset)
+        return f
+
+    def _chunks(self):
+        todo = (i for i in range(len(self.points)) if not self.finished[i])
+        while True:
+            indices = list(islice(todo, self.chunksize))
+            if not indices:
+                return
+            yield indices
+
+    def run(self, view):
+        """Compute the unfinished points on `view` and store their results.
+
+        Parameters
+        ----------
+        view : ipyparallel.client.view.LoadBalancedView
+            E.g. the `lview` returned by `hpc05.connect_ipcluster`.
+
+        Raises
+        ------
+        Exception
+            When no task finished in `stall_timeout` seconds or when tasks
+            failed, the other results are stored, so call `run` again.
+        """
+        chunks = self._chunks()
+        running = {}  # AsyncResult -> indices
+        done_queue = queue.SimpleQueue()  # the AsyncResults that finished
+        failed, error = [], None
+        purger = Purger(view)
+        with self._open() as f:
+            try:
+                while True:
+                    for indices in islice(chunks, self.max_in_flight - len(running)):
+                        items = [(self.points[i],) for i in indices]
+                        ar = view.apply_async(_run_chunk, self.f, items)
+                        running[ar] = indices
+                        ar.add_done_callback(done_queue.put)
+                    if not running:
+                        break
+                    done = _get_done(done_queue, self.stall_timeout)
+                    if not done:
+                        raise Exception(
+                            f"No task finished in {self.stall_timeout} seconds, the"
+                            " hub or the tunnel is probably gone. The finished"
+                            " results are stored, reconnect and call `run` again."
+                        )
+                    for ar in done:
+                        indices = running.pop(ar)
+                        try:
+                            results, _ = ar.get()
+                        except Exception as e:
+                            failed.extend(indices)
+                            error = e
+                            purger.add(ar)
+                            continue
+                        for index, result in zip(indices, results):
+                            payload = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+                            f.write(_FRAME.pack(index, len(payload)) + payload)
+                            self.finished[index] = 1
+                        self.n_finished += len(indices)
+                        purger.add(ar)
+                    f.flush()
+            finally:
+                # Only complete frames are written, keep them for the next run.
+                f.flush()
+                self._offset = f.tell()
+                if running:
+                    with suppress(Exception):
+                        view.abort(list(running))
+                with suppress(Exception):
+                    # When tasks are still running, the hub might be gone.
+                    purger.purge(hub=not running)
+        if failed:
+            raise Exception(
+                f"{len(failed)} points failed, call `run` again to retry them."
+            ) from error
@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Timeline:
+    """Machine readable timeline of the startup of a cluster.
+
+    Records spans (with a start and an end) and instant events, such as
+    the ssh connection, the log-file appearing, copying the connection
+    file, the tunnel being ready and every engine registration.
+
+    Attributes
+    ----------
+    events : list of dicts
+        The recorded events, with the keys ``name``, ``start``, ``end``
+        (None for instant events), ``thread``, and ``args``.
+    """
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def add(self, name, start, end=None, **args):
+        """Add an event that started at `start` and ended at `end` (epoch seconds)."""
+        event = dict(
+            name=name, start=start, end=end, thread=threading.get_ident(), args=args
+        )
+        with self._lock:
+            self.events.append(event)
+
+    def event(self, name, **args):
+        """Record an instant event that happens now."""
+        self.add(name, time.time(), **args)
+
+    @contextmanager
+    def span(self, name, **args):
+        """Record the time spent in the ``with`` block.
+
+        The yielded dict can be updated with extra arguments.
+        """
+        start = time.time()
+        try:
+            yield args
+        finally:
+            self.add(name, start, time.time(), **args)
+
+    def clear(self):
+        with self._lock:
+            self.events = []
+
+    def to_json(self, fname=None):
+        """Export the timeline as JSON, times relative to the first event.
+
+        Returns the JSON string when `fname` is None, otherwise writes to `fname`.
+        """
+        with self._lock:
+            events = sorted(self.events, key=lambda e: e["start"])
+        t0 = events[0]["start"] if events else 0
+        data = {
+            "t_start": t0,
+            "events": [
+                {
+                    "name": e["name"],
+                    "start": e["start"] - t0,
+                    "end": None if e["end"] is None else e["end"] - t0,
+                    "duration": None if e["end"] is None else e["end"] - e["start"],
+                    **e["args"],
+                }
+                for e in events
+            ],
+        }
+        return _dump(data, fname)
+
+    def to_chrome_trace(self, fname=None):
+        """Export the timeline in the Chrome trace format.
+
+        Open the result in ``chrome://tracing`` or https://ui.perfetto.dev.
+        Returns the JSON string when `fname` is None, otherwise writes to `fname`.
+        """
+        with self._lock:
+            events = list(self.events)
+        pid = os.getpid()
+        trace_events = []
+        for e in events:
+            trace_event = {
+                "name": e["name"],
+                "ts": 1e6 * e["start"],
+                "pid": pid,
+                "tid": e["thread"],
+                "args": e["args"],
+            }
+            if e["end"] is None:
+                trace_event.update(ph="i", s="p")
+            else:
+                trace_event.update(ph="X", dur=1e6 * (e["end"] - e["start"]))
+            trace_events.append(trace_event)
+        return _dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, fname)
+
+
+def _dump(data, fname):
+    if fname is None:
+        return json.dumps(data, default=str)
+    with open(fname, "w") as f:
+        json.dump(data, f, default=str)
+
+
+TIMELINE = Timeline()
@@ -0,0 +1,148 @@
+import select
+import socket
+import threading
+from contextlib import suppress
+
+import paramiko
+
+BUFFER_SIZE = 65536
+
+
+class Tunnel:
+    """Forward local ports to remote ports over a paramiko transport.
+
+    All ports are multiplexed over a single, already authenticated, ssh
+    connection, so no ``ssh -N -L`` subprocess is needed.
+
+    Parameters
+    ----------
+    get_transport : callable
+        Function without arguments that returns an active `paramiko.Transport`.
+        It is called again to reconnect when the transport dropped.
+    forwards : dict
+        Maps a name to ``(local_port, remote_host, remote_port)``. Use
+        ``local_port=0`` to let the OS pick a free port.
+
+    Attributes
+    ----------
+    local_ports : dict
+        Maps a name to the local port that is forwarded.
+    counters : dict
+        Maps a name to the number of bytes that are ``"sent"`` and
+        ``"received"`` through the forwarded port.
+    n_reconnects : int
+        Number of times the transport was reconnected.
+    ready : threading.Event
+        Set when all ports listen and the remote ports are reachable.
+    """
+
+    def __init__(self, get_transport, forwards):
+        self.get_transport = get_transport
+        self.forwards = forwards
+        self.local_ports = {}
+        self.counters = {name: {"sent": 0, "received": 0} for name in forwards}
+        self.n_reconnects = 0
+        self.ready = threading.Event()
+        self._transport = None
+        self._servers = []
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def start(self, check=True):
+        """Start listening on the local ports.
+
+        Parameters
+        ----------
+        check : bool
+            Open (and close) a channel to every remote port before
+            reporting that the tunnel is ready.
+
+        Returns
+        -------
+        self : Tunnel
+        """
+        for name, (local_port, host, port) in self.forwards.items():
+            if check:
+                self._open_channel(host, port, ("127.0.0.1", 0)).close()
+            server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind(("127.0.0.1", local_port))
+            server.listen(16)
+            self._servers.append(server)
+            self.local_ports[name] = server.getsockname()[1]
+            thread = threading.Thread(
+                target=self._accept, args=(server, name, host, port), daemon=True
+            )
+            thread.start()
+        self.ready.set()
+        return self
+
+    def close(self):
+        """Stop forwarding, the ssh connection itself is left open."""
+        self._closed = True
+        self.ready.clear()
+        for server in self._servers:
+            with suppress(OSError):
+                server.shutdown(socket.SHUT_RDWR)
+            server.close()
+
+    def _get_transport(self):
+        with self._lock:
+            if self._transport is None or not self._transport.is_active():
+                if self._transport is not None:
+                    self.n_reconnects += 1
+                self._transport = self.get_transport()
+            return self._transport
+
+    def _open_channel(self, host, port, origin):
+        for attempt in range(2):
+            transport = self._get_transport()
+            try:
+                return transport.open_channel("direct-tcpip", (host, port), origin)
+            except paramiko.ChannelException:
+                # The remote side refused, reconnecting won't help.
+                raise
+            except (paramiko.SSHException, EOFError, OSError):
+                if attempt or transport.is_active():
+                    raise
+
+    def _accept(self, server, name, host, port):
+        while not self._closed:
+            try:
+                sock, origin = server.accept()
+            except OSError:
+                return  # the tunnel is closed
+            thread = threading.Thread(
+                target=self._forward, args=(sock, origin, name, host, port), daemon=True
+            )
+            thread.start()
+
+    def _forward(self, sock, origin, name, host, port):
+        try:
+            channel = self._open_channel(host, port, origin)
+        except Exception:
+            sock.close()
+            return
+        counter = self.counters[name]
+        try:
+            while not self._closed:
+                readable, _, _ = select.select([sock, channel], [], [], 1)
+                if sock in readable:
+                    data = sock.recv(BUFFER_SIZE)
+                    if not data:
+                        break
+                    channel.sendall(data)
+                    with self._lock:
+                        counter["sent"] += len(data)
+                if channel in readable:
+                    data = channel.recv(BUFFER_SIZE)
+                    if not data:
+                        break
+                    sock.sendall(data)
+                    with self._lock:
+                        counter["received"] += len(data)
+        except (OSError, EOFError, paramiko.SSHException):
+            pass  # the other end will reconnect
+        finally:
+            channel.close()
+            sock.close()
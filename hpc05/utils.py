@@ -2,7 +2,7 @@ import socket
 import subprocess
 import sys
 
-from hpc05.ssh_utils import setup_ssh
+from hpc05.ssh_utils import pooled_ssh
 
 
 MAX_LINE_LENGTH = 100
@@ -41,7 +41,7 @@ def get_local_env(env=None):
 
 def get_remote_env(env=None):
     # XXX: improve this function and pass all argmuments!
-    with setup_ssh() as ssh:
+    with pooled_ssh() as ssh:
         cmd = "conda list --export"
         if env:
             cmd += f" -n {env}"
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+
+"""
+Script that grows and shrinks the number of IPython parallel engines.
+
+Every interval the pending tasks of the hub and the rate at which tasks
+are completed are used to estimate how long the backlog will take. When
+this is longer than the target, more engines are started with the
+profile's engine launcher (e.g. PBS or SLURM), idle engines are culled
+by a `hpc05_culler.EngineCuller` in the per-engine mode.
+
+Use this script instead of the `hpc05_culler`, e.g. on the headnode run
+``python -m hpc05_autoscaler --profile=pbs --max_engines=200``.
+"""
+
+from collections import deque
+from contextlib import suppress
+from itertools import islice
+import math
+import shlex
+import subprocess
+import time
+
+from tornado import ioloop, options
+from tornado.log import app_log
+from ipyparallel import Client
+
+from hpc05_culler import EngineCuller, kill_running_cullers
+
+ENGINES_CMD = "ipcluster engines --profile={profile} --n={n} --daemonize"
+
+
+class Autoscaler:
+    """An object that starts more engines when the backlog is too large.
+
+    Parameters
+    ----------
+    client : ipyparallel.Client
+        A connected client.
+    profile : str
+        Profile name of IPython profile.
+    min_engines : int, default: 0
+        Minimal number of engines.
+    max_engines : int, default: 100
+        Maximal number of engines.
+    target : float, default: 300
+        Start more engines when the backlog would take longer than
+        `target` seconds with the current engines.
+    cooldown : float, default: 120
+        Time (in seconds) to wait after starting engines before starting
+        more, such that the new engines have a chance to register.
+    startup_timeout : float, default: 900
+        Time (in seconds) after which engines that were requested but
+        didn't register are no longer expected (e.g. the job is still
+        in the queue or failed).
+    window : float, default: 300
+        Time (in seconds) over which the task throughput is measured.
+    engines_cmd : str
+        Command that starts ``{n}`` engines for ``{profile}``, by default
+        ``ipcluster engines``, which uses the engine launcher of the profile.
+    loop : tornado.ioloop.IOLoop, optional
+        The loop that runs the autoscaler, by default the current loop.
+
+    Attributes
+    ----------
+    requests : collections.deque
+        ``[time, n_unregistered]`` for every time engines were requested.
+    """
+
+    def __init__(
+        self,
+        client,
+        profile,
+        min_engines=0,
+        max_engines=100,
+        target=300,
+        cooldown=120,
+        startup_timeout=900,
+        window=300,
+        engines_cmd=ENGINES_CMD,
+        loop=None,
+    ):
+        self.client = client
+        self.profile = profile
+        self.min_engines = min_engines
+        self.max_engines = max_engines
+        self.target = target
+        self.cooldown = cooldown
+        self.startup_timeout = startup_timeout
+        self.window = window
+        self.engines_cmd = engines_cmd
+        self.loop = loop or ioloop.IOLoop.current()
+        self.requests = deque()
+        self.last_request = -math.inf
+        self._completed = None  # per engine, at the previous check
+        # (time, number of tasks completed since the previous sample)
+        self._history = deque()
+        self.started_at = time.time()
+        handlers = client._notification_handlers
+        self._register_engine = handlers["registration_notification"]
+        handlers["registration_notification"] = self._on_registration
+
+    def _on_registration(self, msg):
+        # With ipyparallel>=7 this runs in the client's IO thread.
+        self._register_engine(msg)
+        self.loop.add_callback(self._count_registration)
+
+    def _count_registration(self):
+        for request in self.requests:
+            if request[1] > 0:
+                request[1] -= 1
+                break
+
+    @property
+    def n_starting(self):
+        """Number of requested engines that didn't register yet."""
+        return sum(n for _, n in self.requests)
+
+    def throughput(self, now):
+        """Number of completed tasks per second in the last `window` seconds."""
+        # The oldest sample is the baseline, keep one that is `window` old.
+        while len(self._history) > 1 and now - self._history[1][0] >= self.window:
+            self._history.popleft()
+        if not self._history:
+            return 0
+        n_completed = sum(n for _, n in islice(self._history, 1, None))
+        duration = now - self._history[0][0]
+        return n_completed / duration if duration > 0 else 0
+
+    def needed_engines(self, pending, throughput, n_engines):
+        """Number of engines that finish `pending` tasks within `target` seconds."""
+        if pending == 0:
+            return 0
+        if throughput == 0 or n_engines == 0:
+            # Nothing finished yet, so assume one engine per task.
+            return pending
+        per_engine = throughput / n_engines
+        return math.ceil(pending / (per_engine * self.target))
+
+    def update_state(self):
+        """Check the queue of the hub and start engines when needed.
+
+        Call this method periodically.
+        """
+        now = time.time()
+        while self.requests and now - self.requests[0][0] > self.startup_timeout:
+            app_log.info("%s requested engines didn't start", self.requests[0][1])
+            self.requests.popleft()
+
+        status = self.client.queue_status()
+        pending = status.pop("unassigned", 0)
+        completed = 0
+        for eid, state in status.items():
+            pending += state["queue"] + state["tasks"]
+            if self._completed is not None:
+                previous = self._completed.get(eid, 0)
+                completed += max(state["completed"] - previous, 0)
+        first_sample = self._completed is None
+        self._completed = {eid: state["completed"] for eid, state in status.items()}
+        self._history.append((now, completed))
+        if first_sample:
+            # The hub counts all tasks since it started, so this is only
+            # the baseline for the throughput.
+            return
+
+        # The hub still reports engines that just unregistered.
+        n_engines = len(self.client.ids)
+        throughput = self.throughput(now)
+        n_needed = self.needed_engines(pending, throughput, n_engines)
+        n_wanted = min(max(n_needed, self.min_engines), self.max_engines)
+        n_new = n_wanted - n_engines - self.n_starting
+        app_log.debug(
+            "%s engines, %s starting, %s pending tasks, %.3g tasks/s, %s wanted",
+            n_engines,
+            self.n_starting,
+            pending,
+            throughput,
+            n_wanted,
+        )
+        if n_new > 0 and now - self.last_request >= self.cooldown:
+            self.start_engines(n_new)
+
+    def start_engines(self, n):
+        """Start `n` engines with `engines_cmd`.
+
+        The command runs in the background, such that the loop (and the
+        culler that runs on it) doesn't block, and is checked with
+        `_check_launch`. The engines count as requested right away.
+        """
+        cmd = self.engines_cmd.format(profile=self.profile, n=n)
+        app_log.info("Starting %s engines with '%s'", n, cmd)
+        now = time.time()
+        try:
+            process = subprocess.Popen(
+                shlex.split(cmd),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError as e:
+            app_log.warning("Could not start engines: %s", e)
+            return
+        request = [now, n]
+        self.requests.append(request)
+        self.last_request = now
+        self._check_launch(process, request, cmd)
+
+    def _check_launch(self, process, request, cmd, timeout=120, interval=1):
+        """Forget the `request` when `cmd` failed or runs longer than `timeout`."""
+        returncode = process.poll()
+        if returncode is None and time.time() - request[0] < timeout:
+            self.loop.call_later(interval, self._check_launch, process, request, cmd)
+            return
+        if returncode is None:
+            process.kill()
+            process.wait()
+            app_log.warning("Could not start engines: '%s' timed out", cmd)
+        elif returncode != 0:
+            app_log.warning(
+                "Could not start engines: '%s' exited with %s", cmd, returncode
+            )
+        else:
+            return
+        with suppress(ValueError):
+            self.requests.remove(request)
+        self.last_request = -math.inf  # try again at the next check
+
+
+def main():
+    """Start IO loop that checks every `interval` seconds whether engines
+    should be started, and culls the engines that are idle for `timeout` seconds."""
+    options.define("profile", default="pbs", help="""Profile name.""")
+    options.define(
+        "interval",
+        default=30,
+        help="""Interval (in seconds) at which the queue is checked.""",
+    )
+    options.define("min_engines", default=0, help="""Minimal number of engines.""")
+    options.define("max_engines", default=100, help="""Maximal number of engines.""")
+    options.define(
+        "target",
+        default=300,
+        help="""Start engines when the backlog would take longer than
+                   this (in seconds).""",
+    )
+    options.define(
+        "cooldown",
+        default=120,
+        help="""Time (in seconds) to wait after starting engines.""",
+    )
+    options.define(
+        "startup_timeout",
+        default=900,
+        help="""Time (in seconds) after which requested engines that
+                   didn't register are no longer expected.""",
+    )
+    options.define(
+        "timeout",
+        default=900,
+        help="""Time (in seconds) after which to consider an engine
+                   idle that should be shutdown.""",
+    )
+    options.define(
+        "batch_size",
+        default=1,
+        help="""The minimal number of engines to cull at once.""",
+    )
+    options.define(
+        "engines_cmd",
+        default=ENGINES_CMD,
+        help="""Command that starts {n} engines for {profile}.""",
+    )
+    options.parse_command_line()
+    opts = options.options
+    kill_running_cullers(profile=opts.profile, script="hpc05_autoscaler")
+    loop = ioloop.IOLoop.current()
+    client = Client(profile=opts.profile)
+    EngineCuller(
+        client,
+        opts.timeout,
+        opts.interval,
+        loop,
+        mode="engine",
+        batch_size=opts.batch_size,
+        min_engines=opts.min_engines,
+    )
+    autoscaler = Autoscaler(
+        client,
+        opts.profile,
+        min_engines=opts.min_engines,
+        max_engines=opts.max_engines,
+        target=opts.target,
+        cooldown=opts.cooldown,
+        startup_timeout=opts.startup_timeout,
+        engines_cmd=opts.engines_cmd,
+        loop=loop,
+    )
+    loop.add_callback(autoscaler.update_state)
+    ioloop.PeriodicCallback(autoscaler.update_state, opts.interval * 1000).start()
+    loop.start()
+
+
+if __name__ == "__main__":
+    print("Running")
+    main()
@@ -5,62 +5,326 @@ Script to cull idle IPython parallel engines.
 
 Any engines that have not run any tasks for the specified period will be
 shutdown.
+
+The culler follows the busy/idle status that the engines publish on the
+iopub channel and the (un)registrations on the hub's notification channel,
+so it doesn't need to ask the hub for the ``queue_status`` of all engines.
 """
+
 # Copyright (c) Min RK and modified by Bas Nijholt
 # Distributed under the terms of the Modified BSD License
 
+from array import array
 from collections import defaultdict
 from contextlib import suppress
 from datetime import datetime
+from functools import partial
 import psutil
 import os
+import subprocess
 import sys
+import time
 
 from tornado import ioloop, options
 from tornado.log import app_log
 from ipyparallel import Client
+from zmq.eventloop.zmqstream import ZMQStream
 
 start_time = datetime.utcnow()
 
 
+class ActivityTable:
+    """Activity of the engines, stored in arrays indexed by the engine id.
+
+    Attributes
+    ----------
+    last_active : array.array
+        Time (in seconds since the epoch) of the last status change.
+    busy : array.array
+        1 if the engine is running a task.
+    alive : array.array
+        1 if the engine is registered, -1 if it is gone (the hub
+        never reuses engine ids).
+    n_busy : int
+        Number of engines that are running a task.
+    last_activity : float
+        Time of the last status change of any engine.
+    """
+
+    def __init__(self):
+        self.last_active = array("d")
+        self.busy = array("b")
+        self.alive = array("b")
+        self.n_alive = 0
+        self.n_busy = 0
+        self.last_activity = time.time()
+        self._early_status = {}  # engine id -> (busy, time) before registration
+
+    def __len__(self):
+        return self.n_alive
+
+    def add(self, eid, now):
+        n_new = eid + 1 - len(self.alive)
+        if n_new > 0:
+            self.last_active.extend([0.0] * n_new)
+            self.busy.extend([0] * n_new)
+            self.alive.extend([0] * n_new)
+        if self.alive[eid] == -1:
+            return  # the engine is gone
+        if not self.alive[eid]:
+            self.alive[eid] = 1
+            self.n_alive += 1
+        self.last_active[eid] = now
+        self.last_activity = max(self.last_activity, now)
+        if eid in self._early_status:
+            busy, _ = self._early_status.pop(eid)
+            self.set_busy(eid, busy, now)
+
+    def remove(self, eid):
+        self.add(eid, 0.0)
+        if self.alive[eid] == 1:
+            self.n_alive -= 1
+            if self.busy[eid]:
+                self.busy[eid] = 0
+                self.n_busy -= 1
+        self.alive[eid] = -1
+        self._early_status.pop(eid, None)
+
+    def set_busy(self, eid, busy, now):
+        """Update the status of an engine.
+
+        A new engine can publish its status before the client knows about
+        it, this status is applied when it is added. A culled engine
+        publishes its status while shutting down, this is ignored.
+        """
+        if eid >= len(self.alive) or self.alive[eid] == 0:
+            self._early_status[eid] = (busy, now)
+            return
+        if self.alive[eid] == -1:
+            return
+        self.last_active[eid] = now
+        self.last_activity = max(self.last_activity, now)
+        if self.busy[eid] != busy:
+            self.busy[eid] = busy
+            self.n_busy += 1 if busy else -1
+
+    def ids(self):
+        return [eid for eid, alive in enumerate(self.alive) if alive == 1]
+
+    def idle_ids(self, now, timeout):
+        """Ids of the engines that are idle for `timeout` seconds, longest idle first."""
+        idle_ids = [
+            eid
+            for eid in self.ids()
+            if not self.busy[eid] and self.last_active[eid] + timeout <= now
+        ]
+        return sorted(idle_ids, key=self.last_active.__getitem__)
+
+    def next_deadline(self, now, timeout):
+        """First time after `now` at which an idle engine reaches `timeout`."""
+        deadlines = [
+            self.last_active[eid] + timeout
+            for eid in self.ids()
+            if not self.busy[eid] and self.last_active[eid] + timeout > now
+        ]
+        return min(deadlines, default=None)
+
+    def n_active(self, now, interval):
+        """Number of engines that were active in the last `interval` seconds."""
+        return sum(
+            1
+            for eid in self.ids()
+            if self.busy[eid] or now - self.last_active[eid] <= interval
+        )
+
+
 class EngineCuller:
-    """An object for culling idle IPython parallel engines."""
+    """An object for culling idle IPython parallel engines.
 
-    def __init__(self, client, timeout, interval):
+    Parameters
+    ----------
+    client : ipyparallel.Client
+        A connected client.
+    timeout : float
+        Time (in seconds) after which an idle engine can be culled.
+    interval : float
+        Interval (in seconds) at which `update_state` is called.
+    loop : tornado.ioloop.IOLoop, optional
+        The loop that runs the culler, by default the current loop.
+    mode : str, default: "all"
+        With ``"all"`` the engines are only culled when all of them are
+        idle, with ``"engine"`` the idle engines are culled individually.
+    batch_size : int, default: 1
+        In the ``"engine"`` mode, wait until this many engines can be
+        culled, unless all remaining engines are idle.
+    min_engines : int, default: 0
+        Number of engines that are kept running (the warm floor).
+    cancel_jobs : bool, default: True
+        Cancel the PBS or SLURM job of the culled engines when no other
+        engine runs in that job.
+    """
+
+    def __init__(
+        self,
+        client,
+        timeout,
+        interval,
+        loop=None,
+        mode="all",
+        batch_size=1,
+        min_engines=0,
+        cancel_jobs=True,
+    ):
         """Initialize culler, with current time."""
+        if mode not in ("all", "engine"):
+            raise ValueError(f"mode should be 'all' or 'engine', not {mode!r}.")
         self.client = client
         self.timeout = timeout
         self.interval = interval
-        self.activity = defaultdict(
-            lambda: {"last_active": datetime.utcnow(), "completed": 0}
-        )
+        self.loop = loop or ioloop.IOLoop.current()
+        self.mode = mode
+        self.batch_size = batch_size
+        self.min_engines = min_engines
+        self.cancel_jobs = cancel_jobs
+        self.job_ids = {}  # engine id -> (cancel command, job id)
+        self.activity = ActivityTable()
+        now = time.time()
+        for eid in client.ids:
+            self.activity.add(eid, now)
+        if client.ids:
+            self._lookup_job_ids(client.ids)
         self.max_active = 0
         self.active_now = 0
         self.num_times_zero = 0
         self.started_at = datetime.utcnow()
+        self._cull_handle = None
+        self._subscribe()
+        self.loop.add_callback(self._schedule_cull)
+
+    def _subscribe(self):
+        """Follow the engines' status and (un)registrations."""
+        client = self.client
+        iopub = getattr(client, "_iopub_stream", None)
+        if iopub is None:
+            # ipyparallel<7 only reads its sockets when asked, so read them here.
+            iopub = ZMQStream(client._iopub_socket, self.loop)
+            notification = ZMQStream(client._notification_socket, self.loop)
+            notification.on_recv(self._dispatch_notification)
+        iopub.on_recv(self._on_iopub)
+        handlers = client._notification_handlers
+        for msg_type, callback in [
+            ("registration_notification", self._on_registration),
+            ("unregistration_notification", self._on_unregistration),
+        ]:
+            handlers[msg_type] = partial(
+                self._on_notification, handlers[msg_type], callback
+            )
+
+    def _dispatch_notification(self, msg_frames):
+        session = self.client.session
+        idents, msg = session.feed_identities(msg_frames)
+        msg = session.deserialize(msg)
+        handler = self.client._notification_handlers.get(msg["header"]["msg_type"])
+        if handler is not None:
+            handler(msg)
+
+    def _on_notification(self, handler, callback, msg):
+        # With ipyparallel>=7 this runs in the client's IO thread, so
+        # hand the work over to our own loop.
+        handler(msg)
+        self.loop.add_callback(callback, msg["content"]["id"], time.time())
+
+    def _on_iopub(self, msg_frames):
+        idents, msg = self.client.session.feed_identities(msg_frames)
+        # The topic is "engine.{id}.status", skip all other messages
+        # without deserializing them.
+        topic = idents[0].split(b".") if idents else []
+        if len(topic) != 3 or topic[0] != b"engine" or topic[2] != b"status":
+            return
+        try:
+            msg = self.client.session.deserialize(msg, content=True)
+        except Exception as e:
+            app_log.warning("Could not deserialize message: %s", e)
+            return
+        busy = msg["content"].get("execution_state") == "busy"
+        self.loop.add_callback(self._on_status, int(topic[1]), busy, time.time())
+
+    def _on_registration(self, eid, now):
+        app_log.debug("Engine %s registered", eid)
+        self.activity.add(eid, now)
+        self._lookup_job_ids([eid])
+        # An engine that never runs a task sends no idle status.
+        self._schedule_cull()
+
+    def _on_unregistration(self, eid, now):
+        app_log.debug("Engine %s unregistered", eid)
+        self.activity.remove(eid)
+        self.job_ids.pop(eid, None)
+
+    def _on_status(self, eid, busy, now):
+        self.activity.set_busy(eid, busy, now)
+        if not busy:
+            self._schedule_cull()
+
+    def _lookup_job_ids(self, eids):
+        """Ask the engines in which PBS or SLURM job they run."""
+        if not self.cancel_jobs:
+            return
+        eids = list(eids)
+        view = self.client[eids]
+        for cancel_cmd, variable in [
+            ("qdel", "PBS_JOBID"),
+            ("scancel", "SLURM_JOB_ID"),
+        ]:
+            result = view.apply_async(os.getenv, variable)
+            result.add_done_callback(partial(self._store_job_ids, eids, cancel_cmd))
+
+    def _store_job_ids(self, eids, cancel_cmd, result):
+        try:
+            job_ids = result.get()
+        except Exception as e:
+            app_log.warning("Could not get the job ids of engines %s: %s", eids, e)
+            return
+        for eid, job_id in zip(eids, job_ids):
+            if job_id:
+                self.job_ids[eid] = (cancel_cmd, job_id)
+
+    def _schedule_cull(self):
+        """Call `cull_idle` at the first moment an engine could be culled."""
+        if self._cull_handle is not None or len(self.activity) == 0:
+            return
+        now = time.time()
+        if self.mode == "all":
+            if self.activity.n_busy:
+                return  # the next idle status reschedules the check
+            deadline = self.activity.last_activity + self.timeout
+            if deadline <= now and len(self.activity) <= self.min_engines:
+                return  # all idle engines are kept, see `min_engines`
+        else:
+            deadline = self.activity.next_deadline(now, self.timeout)
+            if deadline is None:
+                return  # the next idle status reschedules the check
+        # The loop's clock isn't `time.time`, so the timer can fire a bit
+        # early, then `cull_idle` did nothing and the check is repeated.
+        self._cull_handle = self.loop.call_later(
+            max(deadline - now, 0), self._on_cull_timer
+        )
+
+    def _on_cull_timer(self):
+        self._cull_handle = None
+        self.cull_idle()
+        self._schedule_cull()
 
     def update_state(self):
-        """Check engine status and cull any engines that have become idle.
+        """Keep track of the active engines and shut down the hub when unused.
 
-        Call this method periodically to cull engines.
+        Call this method periodically, it only reads the local activity
+        table, the culling itself happens as soon as the engines are idle.
         """
         app_log.debug("Updating state")
-        status = self.client.queue_status()
-        for eid in self.client.ids:
-            state = status[eid]
-            engine_activity = self.activity[eid]
-            if (
-                state["queue"]
-                or state["tasks"]
-                or state["completed"] != engine_activity["completed"]
-            ):
-                # tasks pending or history changed, update timestamp
-                engine_activity["last_active"] = datetime.utcnow()
-            engine_activity["completed"] = state["completed"]
-
         # remember how many engines were active last check and now
         last_active = self.active_now
-        self.cull_idle()
+        self.active_now = self.activity.n_active(time.time(), self.interval)
         running_time = (datetime.utcnow() - start_time).total_seconds()
 
         # save how many times zero engines have been active
@@ -99,32 +363,61 @@ class EngineCuller:
             sys.exit(1)
 
     def cull_idle(self):
-        """Cull any engines that have become idle for too long."""
-        idle_ids = []
-        self.active_now = len(self.activity)
-        for eid, state in self.activity.items():
-            idle = (datetime.utcnow() - state["last_active"]).total_seconds()
-            app_log.debug("%s idle since %s", eid, state["last_active"])
-            if idle > self.timeout:
-                idle_ids.append(eid)
-            if idle > self.interval:
-                self.active_now -= 1
-
-        if len(idle_ids) == len(self.activity):
-            app_log.info("Culling engines %s", idle_ids)
-            self.client.shutdown([eid for eid in idle_ids if eid in self.client.ids])
-            for eid in idle_ids:
-                self.activity.pop(eid)
-
-
-def kill_running_cullers(profile):
-    """Kills previous running hpc05_cullers that use the same profile."""
+        """Cull the engines that have become idle for too long.
+
+        See the ``mode``, ``batch_size``, and ``min_engines`` parameters.
+        """
+        idle_ids = self.activity.idle_ids(time.time(), self.timeout)
+        for eid in idle_ids:
+            app_log.debug(
+                "%s idle since %s",
+                eid,
+                datetime.utcfromtimestamp(self.activity.last_active[eid]),
+            )
+
+        n_cullable = len(self.activity) - self.min_engines
+        if self.mode == "all" and len(idle_ids) < len(self.activity):
+            return
+        if len(idle_ids) < min(self.batch_size, n_cullable):
+            return
+        # Keep the engines that were active most recently.
+        self.release(idle_ids[: max(n_cullable, 0)])
+
+    def release(self, eids):
+        """Shutdown the engines and cancel the jobs that no engine uses anymore."""
+        if not eids:
+            return
+        app_log.info("Culling engines %s", eids)
+        self.client.shutdown([eid for eid in eids if eid in self.client.ids])
+        for eid in eids:
+            self.activity.remove(eid)
+        jobs = [self.job_ids.pop(eid) for eid in eids if eid in self.job_ids]
+        in_use = {self.job_ids.get(eid) for eid in self.activity.ids()}
+        to_cancel = defaultdict(list)
+        for cancel_cmd, job_id in jobs:
+            if (cancel_cmd, job_id) not in in_use and job_id not in to_cancel[
+                cancel_cmd
+            ]:
+                to_cancel[cancel_cmd].append(job_id)
+        for cancel_cmd, job_ids in to_cancel.items():
+            app_log.info("Cancelling jobs %s", job_ids)
+            with suppress(OSError, subprocess.TimeoutExpired):
+                subprocess.run(
+                    [cancel_cmd, *job_ids],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    timeout=60,
+                )
+
+
+def kill_running_cullers(profile, script="hpc05_culler"):
+    """Kills previous running hpc05_cullers (or another `script`) that use the same profile."""
     username = os.environ.get("USER", "username")
     culler_procs = []
     for proc in psutil.process_iter():
         with suppress(Exception):
             cmd = " ".join(proc.cmdline())
-            is_culler = "hpc05_culler" in cmd and profile in cmd
+            is_culler = script in cmd and profile in cmd
             if is_culler and proc.username() == username:
                 # make sure to append only the procs of the user!
                 culler_procs.append(proc)
@@ -139,8 +432,9 @@ def kill_running_cullers(profile):
 
 
 def main():
-    """Start IO loop that checks every 60 seconds whether the engines are
-    running, if inactive for two hours they are culled."""
+    """Start IO loop that culls the engines as soon as they are inactive
+    for `timeout` seconds and checks every `interval` seconds whether
+    the cluster is still used."""
     options.define(
         "timeout",
         default=900,
@@ -151,9 +445,30 @@ def main():
         "interval",
         default=60,
         help="""Interval (in seconds) at which state should be checked
-                   and culling performed.""",
+                   and the hub is shutdown when unused.""",
     )
     options.define("profile", default="pbs", help="""Profile name.""")
+    options.define(
+        "mode",
+        default="all",
+        help="""Cull the engines when 'all' are idle, or every idle 'engine'.""",
+    )
+    options.define(
+        "batch_size",
+        default=1,
+        help="""In the 'engine' mode, the minimal number of engines to
+                   cull at once, unless all engines are idle.""",
+    )
+    options.define(
+        "min_engines",
+        default=0,
+        help="""Number of engines that are never culled.""",
+    )
+    options.define(
+        "cancel_jobs",
+        default=True,
+        help="""Cancel the PBS or SLURM jobs of the culled engines.""",
+    )
     options.parse_command_line()
     kill_running_cullers(profile=options.options.profile)
     loop = ioloop.IOLoop.current()
@@ -161,6 +476,11 @@ def main():
         Client(profile=options.options.profile),
         options.options.timeout,
         options.options.interval,
+        loop,
+        mode=options.options.mode,
+        batch_size=options.options.batch_size,
+        min_engines=options.options.min_engines,
+        cancel_jobs=options.options.cancel_jobs,
     )
 
     ioloop.PeriodicCallback(
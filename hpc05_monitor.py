@@ -1,11 +1,17 @@
 #!/usr/bin/env python
 
 import asyncio
+import heapq
 import operator
 import os
 import socket
+import struct
+import threading
+import time
 from collections import defaultdict
+from contextlib import suppress
 from datetime import datetime
+from functools import partial
 
 import psutil
 
@@ -15,66 +21,718 @@ LATEST_DATA = {}
 
 START_TIME = None
 
+# The `UsageHistory` of the records, created by `start`.
+HISTORY = None
 
-def get_usage():
-    """return a dict of usage info for this process"""
-    from IPython import get_ipython
+# Layout of the binary records that the engines publish, see `publish_usage`.
+RECORD_FIELDS = [
+    ("engine_id", "i"),
+    ("pid", "i"),
+    ("date", "d"),
+    ("cpu", "f"),
+    ("mem", "f"),
+    # The fields below are of the engine's process, NaN when not available.
+    ("rss", "d"),
+    ("uss", "d"),
+    ("cpu_user", "d"),
+    ("cpu_system", "d"),
+    ("threads", "d"),
+    ("io_read", "d"),
+    ("io_write", "d"),
+    ("fds", "d"),
+    ("cgroup_mem", "d"),
+    ("cgroup_mem_limit", "d"),
+    ("overhead", "d"),
+]
+RECORD = struct.Struct("<" + "".join(fmt for _, fmt in RECORD_FIELDS))
+
+# Topic of the records on the iopub channel.
+TOPIC = b"hpc05_monitor"
+
+# Hostnames per engine id, these are only sent with the heartbeats, so
+# `start` looks them up for the engines that published before it ran.
+HOSTNAMES = {}
+
+# Wait this long (in seconds) for more records before decoding them.
+BATCH_DELAY = 0.1
+
+_PENDING = []
+_PENDING_LOCK = threading.Lock()
+
+# Ids of the engines in `LATEST_DATA` that changed since the last `DASHBOARD` update.
+_UPDATED = set()
+
+# The `Dashboard` of the latest data, created by `start`.
+DASHBOARD = None
+
+_COLLECTOR = None
+
+# The `ZMQStream` that receives the records, created by `start`.
+_STREAM = None
 
-    hn = socket.gethostname()
-    mem = psutil.virtual_memory().percent
-    cpu = psutil.cpu_percent()
-    return {
-        "engine_id": getattr(get_ipython().kernel, "engine_id", None),
-        "date": datetime.utcnow(),
-        "cpu": cpu,
-        "mem": mem,
-        "hostname": hn,
-        "pid": os.getpid(),
-    }
+NAN = float("nan")
 
 
-def publish_data_forever(interval):
-    """Forever, call get_usage and publish the data via datapub
+def _cgroup_memory_files():
+    """The memory usage and limit files of the cgroup of this process."""
+    candidates = []
+    with suppress(OSError):
+        with open("/proc/self/cgroup") as f:
+            lines = f.read().splitlines()
+        for line in lines:
+            _, controllers, path = line.split(":", 2)
+            if controllers == "":  # cgroup v2
+                base = "/sys/fs/cgroup"
+                names = ("memory.current", "memory.max")
+            elif "memory" in controllers.split(","):  # cgroup v1
+                base = "/sys/fs/cgroup/memory"
+                names = ("memory.usage_in_bytes", "memory.limit_in_bytes")
+            else:
+                continue
+            # In a container the cgroup of the process is mounted at the root.
+            for folder in [os.path.join(base, path.lstrip("/")), base]:
+                candidates.append([os.path.join(folder, name) for name in names])
+    for files in candidates:
+        if all(os.path.exists(fname) for fname in files):
+            return files
+    return None
 
-    This will be available on all AsyncResults as `ar.data`.
+
+def _read_bytes(fname):
+    with open(fname) as f:
+        value = f.read().strip()
+    # "max" in cgroup v2 and a number close to 2**63 in v1 mean no limit.
+    return float("inf") if value == "max" or int(value) >= 2**62 else float(value)
+
+
+class UsageCollector:
+    """Collect the resource usage of this process using cached handles.
+
+    Parameters
+    ----------
+    budget : float, optional
+        Time (in seconds) a collection may take. The USS, which requires
+        reading all memory maps of the process, is skipped when this
+        alone takes longer.
+
+    Attributes
+    ----------
+    overhead : float
+        The time (in seconds) the last `collect` took.
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.overhead = 0.0
+        self.process = psutil.Process()
+        self.hostname = socket.gethostname()
+        self._collect_uss = True
+        self._cgroup_files = _cgroup_memory_files()
+
+    def _uss(self):
+        if not self._collect_uss:
+            return NAN
+        t_start = time.perf_counter()
+        try:
+            uss = self.process.memory_full_info().uss
+        except (psutil.Error, AttributeError):
+            self._collect_uss = False
+            return NAN
+        if self.budget is not None and time.perf_counter() - t_start > self.budget:
+            self._collect_uss = False
+        return float(uss)
+
+    def _cgroup_memory(self):
+        if self._cgroup_files is None:
+            return NAN, NAN
+        try:
+            return tuple(_read_bytes(fname) for fname in self._cgroup_files)
+        except (OSError, ValueError):
+            self._cgroup_files = None
+            return NAN, NAN
+
+    def collect(self):
+        """Return a dict with the usage, see `RECORD_FIELDS`."""
+        from IPython import get_ipython
+
+        t_start = time.perf_counter()
+        process = self.process
+        usage = dict.fromkeys(["io_read", "io_write", "fds"], NAN)
+        with process.oneshot():
+            memory = process.memory_info()
+            cpu_times = process.cpu_times()
+            usage["threads"] = process.num_threads()
+            with suppress(psutil.Error, AttributeError):
+                io = process.io_counters()
+                usage["io_read"], usage["io_write"] = io.read_bytes, io.write_bytes
+            with suppress(psutil.Error, AttributeError):
+                usage["fds"] = process.num_fds()
+        usage["cgroup_mem"], usage["cgroup_mem_limit"] = self._cgroup_memory()
+        usage.update(
+            engine_id=getattr(get_ipython().kernel, "engine_id", None),
+            date=datetime.utcnow(),
+            cpu=psutil.cpu_percent(),
+            mem=psutil.virtual_memory().percent,
+            hostname=self.hostname,
+            pid=process.pid,
+            rss=memory.rss,
+            uss=self._uss(),
+            cpu_user=cpu_times.user,
+            cpu_system=cpu_times.system,
+            overhead=self.overhead,
+        )
+        self.overhead = time.perf_counter() - t_start
+        return usage
+
+
+def get_usage(collector=None):
+    """return a dict of usage info for this process
+
+    The node's ``cpu`` and ``mem`` percentages and the usage of
+    the process, see `RECORD_FIELDS`.
+    """
+    global _COLLECTOR
+    if collector is None:
+        if _COLLECTOR is None:
+            _COLLECTOR = UsageCollector()
+        collector = _COLLECTOR
+    return collector.collect()
+
+
+def publish_usage(kernel, usage, heartbeat=False):
+    """Publish `usage` as a binary record on the iopub channel.
+
+    The hostname is only sent along when `heartbeat` is True.
+    """
+    engine_id = -1 if usage["engine_id"] is None else usage["engine_id"]
+    values = dict(usage, engine_id=engine_id, date=time.time())
+    record = RECORD.pack(*[values[name] for name, _ in RECORD_FIELDS])
+    content = {"hostname": usage["hostname"]} if heartbeat else {}
+    kernel.session.send(
+        kernel.iopub_socket,
+        "data_message",
+        content=content,
+        buffers=[record],
+        ident=TOPIC,
+    )
+
+
+def publish_data_forever(interval, threshold=1, heartbeat=60, max_overhead=0.01):
+    """Forever, call get_usage and publish the data as a binary record
+
+    A record is only published when the node's CPU or memory usage or
+    the RSS of the process changed by at least `threshold` percent, or
+    when the last heartbeat was more than `heartbeat` seconds ago.
+
+    Collecting the data takes at most a fraction `max_overhead` of the
+    time, if it is slower the interval is increased.
     """
     from threading import Thread
-    import time
     import __main__ as user_ns  # the interactive namespace
 
-    from ipyparallel.datapub import publish_data
+    from IPython import get_ipython
+
+    kernel = get_ipython().kernel
+    collector = UsageCollector(budget=max_overhead * interval)
 
     def main():
+        last = None
+        last_heartbeat = -heartbeat
         while not getattr(user_ns, "stop_publishing", False):
-            publish_data(get_usage())
-            time.sleep(interval)
+            usage = get_usage(collector)
+            now = time.time()
+            is_heartbeat = now - last_heartbeat >= heartbeat
+            changed = (
+                last is None
+                or any(abs(usage[k] - last[k]) >= threshold for k in ("cpu", "mem"))
+                or abs(usage["rss"] - last["rss"]) >= threshold / 100 * last["rss"]
+            )
+            if is_heartbeat or changed:
+                publish_usage(kernel, usage, is_heartbeat)
+                last = usage
+            if is_heartbeat:
+                last_heartbeat = now
+            time.sleep(max(interval, collector.overhead / max_overhead))
 
     Thread(target=main, daemon=True).start()
 
 
+def record_dtype():
+    """The `numpy.dtype` of the records, see `RECORD_FIELDS`."""
+    import numpy as np
+
+    return np.dtype([(name, "<" + fmt) for name, fmt in RECORD_FIELDS])
+
+
 def collect_data(session, msg_frames):
-    """Collect and deserialize messages"""
-    from ipyparallel import serialize
-
-    global LATEST_DATA
-    idents, msg = session.feed_identities(msg_frames)
-    try:
-        msg = session.deserialize(msg, content=True)
-    except Exception as e:
-        print(e)
-        return
-    if msg["header"]["msg_type"] != "data_message":
-        return
-    # show the contents of data messages:
-    data, remainder = serialize.deserialize_object(msg["buffers"])
-    LATEST_DATA[data["engine_id"]] = data
-
-
-def start(client, interval=5):
-    global START_TIME
-    from functools import partial
-
-    client._iopub_stream.on_recv(partial(collect_data, client.session))
+    """Collect the records, they are decoded in batches by `decode_records`.
+
+    Returns
+    -------
+    bool
+        Whether the message was a record of `hpc05_monitor`.
+    """
+    idents, msg = session.feed_identities(msg_frames, copy=False)
+    if not idents or _bytes(idents[0]) != TOPIC:
+        return False
+    # msg is [signature, header, parent, metadata, content, record]
+    record = msg[5].buffer if hasattr(msg[5], "buffer") else msg[5]
+    content = session.unpack(_bytes(msg[4]))
+    if "hostname" in content:  # a heartbeat
+        engine_id = RECORD.unpack_from(record)[0]
+        HOSTNAMES[engine_id] = content["hostname"]
+    with _PENDING_LOCK:
+        _PENDING.append(record)
+    return True
+
+
+def _bytes(frame):
+    return frame.bytes if hasattr(frame, "bytes") else frame
+
+
+def _set_hostnames(engine_ids, result):
+    """Store the hostnames that `lookup_hostnames` got from the engines."""
+    with suppress(Exception):  # e.g. an engine died, its heartbeat will tell
+        hostnames = result.get()
+        for engine_id, hostname in zip(engine_ids, hostnames):
+            HOSTNAMES[engine_id] = hostname
+            if engine_id in LATEST_DATA:
+                LATEST_DATA[engine_id]["hostname"] = hostname
+        with _PENDING_LOCK:
+            _UPDATED.update(engine_ids)
+
+
+def lookup_hostnames(client, engine_ids):
+    """Ask the engines for their hostname, instead of waiting for a heartbeat."""
+    engine_ids = [i for i in engine_ids if i in client.ids]
+    if engine_ids:
+        result = client[engine_ids].apply_async(socket.gethostname)
+        result.add_done_callback(partial(_set_hostnames, engine_ids))
+
+
+def decode_records():
+    """Decode the collected records in one go and update `LATEST_DATA` and `HISTORY`.
+
+    Returns
+    -------
+    records : numpy.ndarray
+        The decoded records, see `record_dtype`.
+    """
+    import numpy as np
+
+    with _PENDING_LOCK:
+        pending = _PENDING[:]
+        _PENDING.clear()
+    records = np.frombuffer(b"".join(pending), dtype=record_dtype())
+    # The last record of every engine.
+    engine_ids = records["engine_id"][::-1]
+    _, index = np.unique(engine_ids, return_index=True)
+    names = [name for name, _ in RECORD_FIELDS]
+    for record in records[len(records) - 1 - index].tolist():
+        data = dict(zip(names, record))
+        data["date"] = datetime.utcfromtimestamp(data["date"])
+        data["hostname"] = HOSTNAMES.get(data["engine_id"], "")
+        LATEST_DATA[data["engine_id"]] = data
+    with _PENDING_LOCK:
+        _UPDATED.update(engine_ids.tolist())
+    if HISTORY is not None:
+        HISTORY.append(records)
+    return records
+
+
+class UsageHistory:
+    """The last `size` records of every engine, stored in ring buffers.
+
+    The memory use is fixed per engine, appending is O(1) per record, and
+    the rollups are computed for all engines at once.
+
+    Parameters
+    ----------
+    size : int
+        Number of records that is kept per engine.
+
+    Attributes
+    ----------
+    engine_ids : list
+        The engine ids, in the order of the rows of the buffers.
+    """
+
+    def __init__(self, size=1000):
+        import numpy as np
+
+        self.size = size
+        self.engine_ids = []
+        self._rows = {}  # engine id -> row
+        self._data = np.zeros((0, size), dtype=record_dtype())
+        self._position = np.zeros(0, dtype=int)  # next column to write
+        self._count = np.zeros(0, dtype=int)
+        self._lock = threading.Lock()
+
+    def _get_rows(self, engine_ids):
+        import numpy as np
+
+        unique, inverse = np.unique(engine_ids, return_inverse=True)
+        for engine_id in unique.tolist():
+            if engine_id not in self._rows:
+                self._rows[engine_id] = len(self.engine_ids)
+                self.engine_ids.append(engine_id)
+        n_rows = len(self.engine_ids)
+        if n_rows > len(self._data):
+            # Grow the buffers by (at least) doubling them.
+            n_new = max(n_rows, 2 * len(self._data)) - len(self._data)
+            self._data = np.concatenate(
+                [self._data, np.zeros((n_new, self.size), dtype=self._data.dtype)]
+            )
+            self._position = np.concatenate([self._position, np.zeros(n_new, int)])
+            self._count = np.concatenate([self._count, np.zeros(n_new, int)])
+        rows = np.array([self._rows[e] for e in unique.tolist()], dtype=int)
+        return rows[inverse]
+
+    def append(self, records):
+        """Append the `records` (see `record_dtype`) to the buffers."""
+        import numpy as np
+
+        if len(records) == 0:
+            return
+        with self._lock:
+            rows = self._get_rows(records["engine_id"])
+            # The n-th record of an engine in this batch is written n
+            # columns after the current position of that engine.
+            order = np.argsort(rows, kind="stable")
+            sorted_rows = rows[order]
+            is_first = np.r_[True, sorted_rows[1:] != sorted_rows[:-1]]
+            first_index = np.maximum.accumulate(
+                np.where(is_first, np.arange(len(rows)), 0)
+            )
+            nth = np.empty_like(rows)
+            nth[order] = np.arange(len(rows)) - first_index
+            columns = (self._position[rows] + nth) % self.size
+            self._data[rows, columns] = records
+            counts = np.bincount(rows, minlength=len(self._count))
+            self._position = (self._position + counts) % self.size
+            self._count = np.minimum(self._count + counts, self.size)
+
+    def _values(self, field, window=None, now=None):
+        """The values of `field` with NaN for the missing and too old ones."""
+        import numpy as np
+
+        n_rows = len(self.engine_ids)
+        data = self._data[:n_rows]
+        valid = np.arange(self.size) < self._count[:n_rows, None]
+        if window is not None:
+            now = time.time() if now is None else now
+            valid &= data["date"] >= now - window
+        return np.where(valid, data[field], np.nan)
+
+    def rollup(self, field="mem", window=None, percentiles=(50, 90, 99), now=None):
+        """Statistics of `field` per engine in the last `window` seconds.
+
+        Parameters
+        ----------
+        field : str
+            One of the fields in `RECORD_FIELDS`, e.g. "cpu" or "mem".
+        window : float, optional
+            Only use the records of the last `window` seconds, by default all.
+        percentiles : sequence of floats
+            The percentiles to compute, e.g. 90 results in a "p90" key.
+        now : float, optional
+            The end of the window, by default the current time.
+
+        Returns
+        -------
+        dict
+            Arrays with the ``engine_id``, the ``count``, ``min``, ``mean``,
+            and ``max``, and the percentiles. Engines without records in
+            the window have NaN values.
+        """
+        import warnings
+
+        import numpy as np
+
+        with self._lock:
+            values = self._values(field, window, now)
+            engine_ids = np.array(self.engine_ids, dtype=int)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN rows
+            stats = {
+                "engine_id": engine_ids,
+                "count": np.sum(~np.isnan(values), axis=1),
+                "min": np.nanmin(values, axis=1),
+                "mean": np.nanmean(values, axis=1),
+                "max": np.nanmax(values, axis=1),
+            }
+            if percentiles and len(values):
+                qs = np.nanpercentile(values, percentiles, axis=1)
+                for p, q in zip(percentiles, qs):
+                    stats[f"p{p:g}"] = q
+        return stats
+
+    def records(self, engine_id):
+        """The records of `engine_id` in chronological order."""
+        import numpy as np
+
+        with self._lock:
+            row = self._rows[engine_id]
+            count, position = self._count[row], self._position[row]
+            columns = (position - count + np.arange(count)) % self.size
+            return self._data[row, columns].copy()
+
+    def to_dataframe(self):
+        """All records as a `pandas.DataFrame`, sorted by engine and date."""
+        import numpy as np
+        import pandas as pd
+
+        records = [self.records(e) for e in sorted(self.engine_ids)]
+        df = pd.DataFrame(np.concatenate([np.zeros(0, record_dtype())] + records))
+        df["date"] = pd.to_datetime(df["date"], unit="s")
+        return df
+
+    def to_parquet(self, fname):
+        """Save all records to a Parquet file, see `to_dataframe`."""
+        self.to_dataframe().to_parquet(fname)
+
+
+def memory_usage(data):
+    """The memory usage (in %) of an engine, the node's or its cgroup's, whichever is higher."""
+    mem = data["mem"]
+    limit = data.get("cgroup_mem_limit", NAN)
+    if 0 < limit < float("inf"):
+        mem = max(mem, 100 * data["cgroup_mem"] / limit)
+    return mem
+
+
+class Dashboard:
+    """An aggregated view of `LATEST_DATA` that is updated incrementally.
+
+    Only the engines that sent new data are processed in `update`, so
+    this stays cheap with hundreds of engines.
+
+    Parameters
+    ----------
+    near_oom : float, default: 90
+        Engines with a `memory_usage` (in %) of at least this are near OOM.
+    bins : int, default: 10
+        Number of bins of the CPU and memory histograms (from 0 to 100%).
+
+    Attributes
+    ----------
+    engines : dict
+        Maps the engine id to a dict with its ``hostname``, ``cpu``,
+        ``mem`` (see `memory_usage`), ``rss``, and ``date``.
+    hosts : dict
+        Maps the hostname to a dict with the number of ``engines``, the
+        ``cpu`` and ``mem`` (the maximum of its engines, both are of the
+        whole node), and the ``rss`` (the sum of its engines).
+    histograms : dict
+        Maps "cpu" and "mem" to the number of engines per bin.
+    near_oom_ids : set
+        Ids of the engines that are near OOM.
+    alerts : list
+        ``[callback, threshold, fired]`` for every alert, see `add_alert`.
+    """
+
+    def __init__(self, near_oom=90, bins=10):
+        self.near_oom = near_oom
+        self.bins = bins
+        self.engines = {}
+        self.hosts = {}
+        self.histograms = {k: [0] * bins for k in ("cpu", "mem")}
+        self.near_oom_ids = set()
+        self.alerts = []
+        self._host_engines = defaultdict(set)
+
+    def _bin(self, value):
+        if value != value:  # NaN
+            return None
+        return min(max(int(value * self.bins / 100), 0), self.bins - 1)
+
+    def _count(self, engine, n):
+        for k, histogram in self.histograms.items():
+            i = self._bin(engine[k])
+            if i is not None:
+                histogram[i] += n
+
+    def add_alert(self, callback, threshold=None):
+        """Call ``callback(engine_ids)`` when engines cross `threshold` (in %).
+
+        The callback gets the ids of the engines whose `memory_usage`
+        became at least `threshold` (by default `near_oom`) and fires
+        again for an engine only after it dropped below the threshold.
+        A coroutine function is scheduled as a task.
+        """
+        if threshold is None:
+            threshold = self.near_oom
+        self.alerts.append([callback, threshold, set()])
+
+    def update(self, engine_ids, data=None):
+        """Process the new data of `engine_ids` and fire the alerts.
+
+        Returns
+        -------
+        crossed : list
+            The ids of the engines that crossed the threshold, per alert.
+        """
+        if data is None:
+            data = LATEST_DATA
+        changed_hosts = set()
+        crossed = [[] for _ in self.alerts]
+        for eid in engine_ids:
+            info = data.get(eid)
+            if info is None:
+                continue
+            old = self.engines.get(eid)
+            if old is not None:
+                self._count(old, -1)
+                self._host_engines[old["hostname"]].discard(eid)
+                changed_hosts.add(old["hostname"])
+            engine = {
+                "hostname": info["hostname"],
+                "cpu": info["cpu"],
+                "mem": memory_usage(info),
+                "rss": info.get("rss", NAN),
+                "date": info["date"],
+            }
+            self.engines[eid] = engine
+            self._count(engine, 1)
+            self._host_engines[engine["hostname"]].add(eid)
+            changed_hosts.add(engine["hostname"])
+            if engine["mem"] >= self.near_oom:
+                self.near_oom_ids.add(eid)
+            else:
+                self.near_oom_ids.discard(eid)
+            for (_, threshold, fired), ids in zip(self.alerts, crossed):
+                if engine["mem"] >= threshold:
+                    if eid not in fired:
+                        fired.add(eid)
+                        ids.append(eid)
+                else:
+                    fired.discard(eid)
+
+        for host in changed_hosts:
+            engines = [self.engines[eid] for eid in self._host_engines[host]]
+            if not engines:
+                self.hosts.pop(host, None)
+                del self._host_engines[host]
+                continue
+            rss = [e["rss"] for e in engines if e["rss"] == e["rss"]]
+            self.hosts[host] = {
+                "engines": len(engines),
+                "cpu": max(e["cpu"] for e in engines),
+                "mem": max(e["mem"] for e in engines),
+                "rss": sum(rss) if rss else NAN,
+            }
+
+        for (callback, _, _), ids in zip(self.alerts, crossed):
+            if ids:
+                self._fire(callback, sorted(ids))
+        return crossed
+
+    def _fire(self, callback, engine_ids):
+        try:
+            result = callback(engine_ids)
+            if asyncio.iscoroutine(result):
+                asyncio.ensure_future(result)
+        except Exception as e:
+            print(f"The alert {callback} failed: {e}")
+
+    def top(self, k=5, key="cpu"):
+        """The `k` engines with the highest `key`, as ``(engine_id, value)``."""
+        values = ((eid, e[key]) for eid, e in self.engines.items() if e[key] == e[key])
+        return heapq.nlargest(k, values, key=operator.itemgetter(1))
+
+    def summary(self, k=5):
+        """The aggregated view as a dict.
+
+        Returns
+        -------
+        dict
+            With the ``hosts``, ``histograms``, the top `k` engines by
+            ``cpu`` and ``mem``, and the ``near_oom`` engines (sorted by
+            memory usage) as ``(engine_id, value)``.
+        """
+        near_oom = [(eid, self.engines[eid]["mem"]) for eid in self.near_oom_ids]
+        return {
+            "hosts": {host: dict(info) for host, info in self.hosts.items()},
+            "histograms": {k: list(v) for k, v in self.histograms.items()},
+            "top_cpu": self.top(k, "cpu"),
+            "top_mem": self.top(k, "mem"),
+            "near_oom": sorted(near_oom, key=operator.itemgetter(1), reverse=True),
+        }
+
+
+def add_alert(callback, threshold=None):
+    """Add an alert to the `DASHBOARD`, see `Dashboard.add_alert`."""
+    if DASHBOARD is None:
+        raise Exception(
+            "Start the hpc05_monitor first by using" '"hpc05_monitor.start(client)".'
+        )
+    DASHBOARD.add_alert(callback, threshold)
+
+
+def _subscribe(client):
+    """Subscribe to the records on a socket of our own.
+
+    The socket connects to the same iopub channel as `client`, but only
+    receives the `TOPIC` messages, so the client's own handler is untouched.
+    A previous subscription (of an earlier `start`) is closed.
+    """
+    global _STREAM
+    from concurrent.futures import Future
+
+    import zmq
+    from zmq.eventloop.zmqstream import ZMQStream
+
+    if _STREAM is not None:
+        _STREAM.close()
+    url = client._iopub_socket.getsockopt(zmq.LAST_ENDPOINT)
+    socket = zmq.Context.instance().socket(zmq.SUB)
+    socket.setsockopt(zmq.SUBSCRIBE, TOPIC)
+    socket.connect(url.decode())
+    # The client's IO loop may run in its own thread, so create the stream there.
+    io_loop = client._iopub_stream.io_loop
+    stream = Future()
+    io_loop.add_callback(lambda: stream.set_result(ZMQStream(socket, io_loop)))
+    _STREAM = stream.result()
+    return _STREAM
+
+
+def start(client, interval=5, history_size=1000, near_oom=90):
+    """Collect the data of the engines and keep track of the maximal usage.
+
+    The records are collected and decoded in batches on the client's
+    IO loop, `MAX_USAGE` and the `DASHBOARD` (which fires the alerts)
+    are updated on the current asyncio event loop.
+    The last `history_size` records per engine are kept in `HISTORY`.
+    The engines whose hostname is unknown are asked for it right away.
+    """
+    global START_TIME, HISTORY, DASHBOARD
+
+    if HISTORY is None or HISTORY.size != history_size:
+        HISTORY = UsageHistory(history_size)
+    if DASHBOARD is None:
+        DASHBOARD = Dashboard(near_oom)
+    else:
+        DASHBOARD.near_oom = near_oom
+    stream = _subscribe(client)
+    scheduled = False
+
+    requested = set()  # the engines that were asked for their hostname
+
+    def decode():
+        nonlocal scheduled
+        scheduled = False
+        records = decode_records()
+        unknown = set(records["engine_id"].tolist()) - set(HOSTNAMES) - requested
+        requested.update(unknown)
+        lookup_hostnames(client, unknown)
+
+    def on_recv(msg_frames):
+        nonlocal scheduled
+        if collect_data(client.session, msg_frames) and not scheduled:
+            scheduled = True
+            stream.io_loop.call_later(BATCH_DELAY, decode)
+
+    stream.on_recv(on_recv, copy=False)
     ioloop = asyncio.get_event_loop()
     START_TIME = datetime.utcnow()
     return ioloop.create_task(_update_max_usage(interval))
@@ -82,13 +740,19 @@ def start(client, interval=5):
 
 async def _update_max_usage(interval):
     while True:
-        for i, info in LATEST_DATA.items():
+        with _PENDING_LOCK:
+            updated = list(_UPDATED)
+            _UPDATED.clear()
+        for i in updated:
+            info = LATEST_DATA[i]
             for k in ["cpu", "mem"]:
                 MAX_USAGE[i][k] = max(
                     (info[k], info["date"]),
                     MAX_USAGE[i].get(k, (0, None)),
                     key=operator.itemgetter(0),
                 )
+        if DASHBOARD is not None:
+            DASHBOARD.update(updated)
         await asyncio.sleep(interval)
 
 
@@ -128,5 +792,40 @@ def print_max_usage():
         )
 
 
+def print_summary(summary=None, k=5):
+    """Nicely print the aggregated `Dashboard.summary`, one line per host."""
+    if summary is None:
+        if DASHBOARD is None:
+            raise Exception(
+                "Start the hpc05_monitor first by using"
+                '"hpc05_monitor.start(client)".'
+            )
+        summary = DASHBOARD.summary(k)
+    print(
+        "{:20s} {:>7s} {:>6s} {:>6s} {:>9s}".format(
+            "hostname", "engines", "CPU%", "MEM%", "RSS GB"
+        )
+    )
+    for host, info in sorted(summary["hosts"].items()):
+        print(
+            "{:20s} {:7d} {:6.0f} {:6.0f} {:9.2f}".format(
+                host, info["engines"], info["cpu"], info["mem"], info["rss"] / 1e9
+            )
+        )
+    for k, histogram in summary["histograms"].items():
+        width = 100 / len(histogram)
+        counts = " ".join(
+            f"{i * width:.0f}-{(i + 1) * width:.0f}%: {n}"
+            for i, n in enumerate(histogram)
+            if n
+        )
+        print(f"{k.upper()} histogram: {counts}")
+    for k in ["cpu", "mem"]:
+        top = ", ".join(f"{eid} ({value:.0f}%)" for eid, value in summary[f"top_{k}"])
+        print(f"Top {k.upper()}: {top}")
+    near_oom = ", ".join(f"{eid} ({value:.0f}%)" for eid, value in summary["near_oom"])
+    print(f"Near OOM: {near_oom or '-'}")
+
+
 if __name__ == "__main__":
     publish_data_forever(interval=5)
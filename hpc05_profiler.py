@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+
+"""
+Profile the individual tasks that the IPython parallel engines run.
+
+On the engines, `install` wraps the kernel's ``do_apply`` and records the
+wall time, CPU time, peak RSS, and optionally a sampled stack profile of
+every task. Enable it for all engines of a profile with
+``hpc05.create_local_pbs_profile(..., profiler=True)``, or on running
+engines with ``dview.apply_sync(hpc05_profiler.install)``.
+
+On the client, `collect` gets the records from the engines and
+`report` aggregates them per function.
+"""
+
+import inspect
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import psutil
+
+PROFILER = None
+
+
+def _function_name(f):
+    f = getattr(f, "func", f)  # functools.partial
+    module = getattr(f, "__module__", None)
+    name = getattr(f, "__qualname__", None) or getattr(f, "__name__", None)
+    if name is None:
+        return repr(f)
+    return f"{module}.{name}" if module else name
+
+
+def _collapsed_stack(frame, max_depth=50):
+    """The stack as "file:function;file:function", outermost first.
+
+    The frames of the kernel, up to the code that calls the task, are dropped.
+    """
+    frames = []
+    while frame is not None and len(frames) < max_depth:
+        if frame.f_code.co_filename == "<string>":
+            break  # the code that ``do_apply`` executes
+        code = frame.f_code
+        frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+class TaskProfiler:
+    """Record the resource usage of every task that the engine runs.
+
+    Parameters
+    ----------
+    kernel : ipyparallel.engine.kernel.IPythonParallelKernel
+        The kernel of the engine.
+    sample_interval : float
+        Interval (in seconds) at which the RSS (and stack) is sampled
+        while a task runs.
+    stacks : bool
+        Sample the stack of the running task.
+    max_records : int
+        Maximal number of records that is kept, the oldest are dropped.
+
+    Attributes
+    ----------
+    records : collections.OrderedDict
+        Maps the ``msg_id`` to a dict with the ``function``, ``engine_id``,
+        ``start`` and ``end`` time, ``wall`` and ``cpu`` time, ``rss_start``,
+        ``rss_end``, and ``peak_rss``, the ``n_items`` for a chunk of a
+        ``map``, and the sampled ``stacks``.
+    """
+
+    def __init__(self, kernel, sample_interval=0.01, stacks=False, max_records=10000):
+        self.kernel = kernel
+        self.sample_interval = sample_interval
+        self.stacks = stacks
+        self.max_records = max_records
+        self.records = OrderedDict()
+        self.process = psutil.Process()
+        self._current = None
+        self._running = threading.Event()
+        self._lock = threading.Lock()
+
+    def install(self):
+        """Wrap the kernel's ``do_apply`` and start the sampler thread."""
+        kernel = self.kernel
+        # ``do_apply`` unpacks the function in its own module.
+        self._module = inspect.getmodule(type(kernel).do_apply)
+        self._unpack_apply_message = self._module.unpack_apply_message
+        self._module.unpack_apply_message = self._unpack
+        self._do_apply = kernel.do_apply
+        kernel.do_apply = self._profiled_do_apply
+        threading.Thread(target=self._sample, daemon=True).start()
+
+    def uninstall(self):
+        self._module.unpack_apply_message = self._unpack_apply_message
+        self.kernel.do_apply = self._do_apply
+
+    def _unpack(self, *args, **kwargs):
+        f, f_args, f_kwargs = self._unpack_apply_message(*args, **kwargs)
+        task = self._current
+        if task is not None:
+            if getattr(f, "__name__", None) == "_map" and f_args:
+                # A chunk of ``view.map``, the function is the first argument.
+                task["function"] = _function_name(f_args[0])
+                task["n_items"] = min((len(seq) for seq in f_args[1:]), default=0)
+            else:
+                task["function"] = _function_name(f)
+        return f, f_args, f_kwargs
+
+    def _profiled_do_apply(self, content, bufs, msg_id, *args, **kwargs):
+        rss = self.process.memory_info().rss
+        task = {
+            "msg_id": msg_id,
+            "function": None,
+            "engine_id": getattr(self.kernel, "engine_id", None),
+            "start": time.time(),
+            "rss_start": rss,
+            "peak_rss": rss,
+            "n_items": None,
+            "stacks": Counter() if self.stacks else None,
+        }
+        self._thread = threading.get_ident()
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        self._current = task
+        self._running.set()
+        try:
+            return self._do_apply(content, bufs, msg_id, *args, **kwargs)
+        finally:
+            self._running.clear()
+            self._current = None
+            rss = self.process.memory_info().rss
+            task.update(
+                end=time.time(),
+                wall=time.perf_counter() - wall_start,
+                cpu=time.process_time() - cpu_start,
+                rss_end=rss,
+                peak_rss=max(task["peak_rss"], rss),
+            )
+            if not (task["function"] or "").startswith(__name__ + "."):
+                self._store(task)
+
+    def _store(self, task):
+        with self._lock:
+            self.records[task["msg_id"]] = task
+            while len(self.records) > self.max_records:
+                self.records.popitem(last=False)
+
+    def _sample(self):
+        while True:
+            self._running.wait()
+            time.sleep(self.sample_interval)
+            task = self._current
+            if task is None:
+                continue
+            try:
+                rss = self.process.memory_info().rss
+            except psutil.Error:
+                continue
+            task["peak_rss"] = max(task["peak_rss"], rss)
+            if self.stacks:
+                frame = sys._current_frames().get(self._thread)
+                if frame is not None:
+                    task["stacks"][_collapsed_stack(frame)] += 1
+
+    def pop_records(self, clear=True):
+        with self._lock:
+            records = list(self.records.values())
+            if clear:
+                self.records.clear()
+        return records
+
+
+def install(sample_interval=0.01, stacks=False, max_records=10000):
+    """Start profiling the tasks of this engine, see `TaskProfiler`."""
+    global PROFILER
+    from IPython import get_ipython
+
+    if PROFILER is None:
+        PROFILER = TaskProfiler(
+            get_ipython().kernel, sample_interval, stacks, max_records
+        )
+        PROFILER.install()
+    else:
+        PROFILER.sample_interval = sample_interval
+        PROFILER.stacks = stacks
+        PROFILER.max_records = max_records
+
+
+def uninstall():
+    """Stop profiling the tasks of this engine."""
+    global PROFILER
+    if PROFILER is not None:
+        PROFILER.uninstall()
+        PROFILER = None
+
+
+def _get_records(clear):
+    return [] if PROFILER is None else PROFILER.pop_records(clear)
+
+
+def collect(client, targets="all", clear=True):
+    """Get the task records from the engines.
+
+    Parameters
+    ----------
+    client : ipyparallel.Client
+        A connected client.
+    targets : int, list of ints, or "all"
+        The engines to collect the records from.
+    clear : bool
+        Remove the records from the engines.
+
+    Returns
+    -------
+    records : list of dicts
+        See `TaskProfiler.records`.
+    """
+    per_engine = client.direct_view(targets).apply_sync(_get_records, clear)
+    if isinstance(targets, int):
+        return per_engine
+    return [record for records in per_engine for record in records]
+
+
+def _median(values):
+    values = sorted(values)
+    n = len(values)
+    return (values[(n - 1) // 2] + values[n // 2]) / 2
+
+
+def report(records, n_slowest=5, threshold=3):
+    """Aggregate the task records per function.
+
+    Parameters
+    ----------
+    records : list of dicts
+        The records from `collect`.
+    n_slowest : int
+        Number of slowest tasks to return per function.
+    threshold : float
+        A task is an outlier when its wall time is more than `threshold`
+        scaled median absolute deviations above the median.
+
+    Returns
+    -------
+    dict
+        Maps the function name to a dict with the number of tasks ``n``,
+        the ``wall`` and ``cpu`` time in seconds (``total``, ``mean``,
+        ``median``, and ``max``), the maximal ``peak_rss`` and the
+        maximal ``rss_growth`` in bytes, the ``slowest`` and ``outliers``
+        records, and the most sampled ``stacks``.
+    """
+    per_function = {}
+    for record in records:
+        per_function.setdefault(record["function"], []).append(record)
+
+    summary = {}
+    for function, tasks in per_function.items():
+        walls = [task["wall"] for task in tasks]
+        median = _median(walls)
+        mad = 1.4826 * _median([abs(wall - median) for wall in walls])
+        stacks = Counter()
+        for task in tasks:
+            stacks.update(task.get("stacks") or {})
+        summary[function] = {
+            "n": len(tasks),
+            "wall": {
+                "total": sum(walls),
+                "mean": sum(walls) / len(walls),
+                "median": median,
+                "max": max(walls),
+            },
+            "cpu": {
+                "total": sum(task["cpu"] for task in tasks),
+                "mean": sum(task["cpu"] for task in tasks) / len(tasks),
+                "median": _median([task["cpu"] for task in tasks]),
+                "max": max(task["cpu"] for task in tasks),
+            },
+            "peak_rss": max(task["peak_rss"] for task in tasks),
+            "rss_growth": max(task["rss_end"] - task["rss_start"] for task in tasks),
+            "slowest": sorted(tasks, key=lambda t: t["wall"], reverse=True)[:n_slowest],
+            "outliers": [
+                task
+                for task in tasks
+                if mad > 0 and task["wall"] > median + threshold * mad
+            ],
+            "stacks": stacks.most_common(10),
+        }
+    return summary
+
+
+def print_report(summary):
+    """Nicely print the `report`, the slowest functions (in total) first."""
+    print(
+        "{:40s} {:>6s} {:>10s} {:>10s} {:>10s} {:>10s} {:>8s}".format(
+            "function", "n", "wall", "median", "max", "cpu", "peak MB"
+        )
+    )
+    for function, info in sorted(
+        summary.items(), key=lambda x: x[1]["wall"]["total"], reverse=True
+    ):
+        print(
+            "{:40s} {:6d} {:10.3f} {:10.3f} {:10.3f} {:10.3f} {:8.0f}".format(
+                str(function)[-40:],
+                info["n"],
+                info["wall"]["total"],
+                info["wall"]["median"],
+                info["wall"]["max"],
+                info["cpu"]["total"],
+                info["peak_rss"] / 1e6,
+            )
+        )
+        for task in info["outliers"]:
+            print(
+                f"    outlier {task['msg_id']} on engine {task['engine_id']}:"
+                f" {task['wall']:.3f} s"
+            )
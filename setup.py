@@ -32,10 +32,10 @@ extras_require = dict(
         "m2r",  # markdown support
         "sphinxcontrib.apidoc",  # run sphinx-apidoc when building docs
     ],
-    dev=["pre-commit"],
+    dev=["pre-commit", "pytest"],
 )
 
-install_requires = ["ipyparallel", "pexpect", "pyzmq", "paramiko", "tornado", "psutil"]
+install_requires = ["ipyparallel", "numpy", "pyzmq", "paramiko", "tornado", "psutil"]
 
 
 setup(
@@ -57,7 +57,7 @@ setup(
     author_email="basnijholt@gmail.com",
     license="MIT",
     packages=find_packages("."),
-    py_modules=["hpc05_culler", "hpc05_monitor"],
+    py_modules=["hpc05_autoscaler", "hpc05_culler", "hpc05_monitor", "hpc05_profiler"],
     install_requires=install_requires,
     extras_require=extras_require,
     zip_safe=False,
@@ -0,0 +1,143 @@
+import asyncio
+import math
+import time
+
+import pytest
+
+import hpc05_autoscaler
+from hpc05_autoscaler import Autoscaler
+
+
+class FakeClient:
+    """Reports `pending` unassigned tasks and `rate` completed tasks per check."""
+
+    def __init__(self, n_engines, pending=0, rate=0):
+        self.ids = list(range(n_engines))
+        self.pending = pending
+        self.rate = rate
+        self.completed = 10**6  # the hub counts all tasks since it started
+        self._notification_handlers = {"registration_notification": lambda msg: None}
+
+    def queue_status(self):
+        self.completed += self.rate
+        status = {"unassigned": self.pending}
+        for eid in self.ids:
+            n = self.completed // len(self.ids)
+            status[eid] = {"queue": 0, "tasks": 0, "completed": n}
+        return status
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(hpc05_autoscaler, "time", clock)
+    return clock
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def wait_for(condition, timeout=10):
+    t_start = time.monotonic()
+    while not condition():
+        assert time.monotonic() - t_start < timeout
+        await asyncio.sleep(0.05)
+
+
+def checks(autoscaler, clock, n, interval=30):
+    for _ in range(n):
+        autoscaler.update_state()
+        clock.now += interval
+
+
+def test_first_sample_is_a_baseline(stubs, clock):
+    ipcluster = stubs("ipcluster")
+
+    async def main():
+        # The hub already completed 10**6 tasks, that isn't the throughput.
+        autoscaler = Autoscaler(FakeClient(2, pending=100, rate=60), "pbs")
+        autoscaler.update_state()
+        assert autoscaler.throughput(clock.now) == 0
+        clock.now += 30
+        autoscaler.update_state()
+        assert autoscaler.throughput(clock.now) == pytest.approx(60 / 30)
+        await asyncio.sleep(0.2)
+
+    run(main())
+    assert ipcluster() == []
+
+
+def test_starts_engines_for_the_backlog(stubs, clock):
+    ipcluster = stubs("ipcluster")
+
+    async def main():
+        # 2 engines finish 1 task/s each, so 6000 tasks take 3000 s.
+        client = FakeClient(2, pending=6000, rate=60)
+        autoscaler = Autoscaler(client, "pbs", target=300, max_engines=100)
+        checks(autoscaler, clock, 2)
+        assert autoscaler.n_starting == 18
+        await wait_for(lambda: ipcluster())
+
+    run(main())
+    assert ipcluster() == ["engines --profile=pbs --n=18 --daemonize"]
+
+
+def test_max_engines_and_cooldown(stubs, clock):
+    ipcluster = stubs("ipcluster")
+
+    async def main():
+        client = FakeClient(2, pending=10**6, rate=60)
+        autoscaler = Autoscaler(client, "pbs", max_engines=10, cooldown=120)
+        checks(autoscaler, clock, 2)
+        await wait_for(lambda: len(ipcluster()) == 1)
+        # The requested engines didn't register yet.
+        checks(autoscaler, clock, 5)
+        assert autoscaler.n_starting == 8
+        # Two registered, but within the cooldown nothing is started.
+        client.ids += [2, 3]
+        autoscaler._count_registration()
+        autoscaler._count_registration()
+        clock.now = autoscaler.last_request + 60
+        checks(autoscaler, clock, 1)
+        assert autoscaler.n_starting == 6
+
+    run(main())
+    assert ipcluster() == ["engines --profile=pbs --n=8 --daemonize"]
+
+
+def test_forgets_failed_launch(stubs, clock):
+    ipcluster = stubs("ipcluster", exit_code=1)
+
+    async def main():
+        autoscaler = Autoscaler(FakeClient(1, pending=10**6, rate=30), "pbs")
+        checks(autoscaler, clock, 2)
+        assert autoscaler.n_starting > 0
+        await wait_for(lambda: autoscaler.n_starting == 0)
+        assert autoscaler.last_request == -math.inf
+
+    run(main())
+    assert len(ipcluster()) == 1
+
+
+def test_launch_does_not_block_the_loop(stubs):
+    stubs("ipcluster", sleep=2)
+
+    async def main():
+        autoscaler = Autoscaler(FakeClient(1), "pbs")
+        t_start = time.monotonic()
+        autoscaler.start_engines(4)
+        assert time.monotonic() - t_start < 0.5
+        assert autoscaler.n_starting == 4
+        await asyncio.sleep(2.5)
+        assert autoscaler.n_starting == 4  # the command succeeded
+
+    run(main())
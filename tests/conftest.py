@@ -0,0 +1,34 @@
+import os
+import stat
+
+import pytest
+
+
+@pytest.fixture
+def stubs(tmp_path, monkeypatch):
+    """Put fake scheduler commands on the ``PATH``.
+
+    ``stubs("qdel")`` creates a ``qdel`` that appends its arguments to
+    ``calls["qdel"]`` (a file) and exits with `exit_code` after `sleep` seconds.
+    """
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+    def make(name, exit_code=0, sleep=0):
+        log = tmp_path / f"{name}.calls"
+        script = bin_dir / name
+        script.write_text(
+            "#!/bin/sh\n"
+            f'echo "$@" >> "{log}"\n'
+            f"sleep {sleep}\n"
+            f"exit {exit_code}\n"
+        )
+        script.chmod(script.stat().st_mode | stat.S_IEXEC)
+
+        def calls():
+            return log.read_text().splitlines() if log.exists() else []
+
+        return calls
+
+    return make
@@ -0,0 +1,85 @@
+import time
+
+import pytest
+
+from hpc05_culler import EngineCuller
+
+
+class FakeStream:
+    def on_recv(self, callback):
+        self.callback = callback
+
+
+class FakeClient:
+    def __init__(self, ids=()):
+        self.ids = list(ids)
+        self.shut_down = []
+        self._iopub_stream = FakeStream()
+        self._notification_handlers = {
+            "registration_notification": lambda msg: None,
+            "unregistration_notification": lambda msg: None,
+        }
+
+    def shutdown(self, targets):
+        self.shut_down.extend(targets)
+        self.ids = [eid for eid in self.ids if eid not in targets]
+
+
+@pytest.fixture
+def culler():
+    client = FakeClient()
+    culler = EngineCuller(client, timeout=10, interval=1, mode="engine")
+    now = time.time()
+    for eid in range(4):
+        client.ids.append(eid)
+        culler.activity.add(eid, now)
+    return culler
+
+
+def test_release_cancels_unused_jobs(culler, stubs):
+    qdel = stubs("qdel")
+    scancel = stubs("scancel")
+    culler.job_ids = {
+        0: ("qdel", "1.hpc05"),
+        1: ("qdel", "1.hpc05"),  # two engines in one job
+        2: ("qdel", "2.hpc05"),
+        3: ("scancel", "3"),
+    }
+    culler.release([0, 2, 3])
+    assert culler.client.shut_down == [0, 2, 3]
+    assert culler.activity.ids() == [1]
+    # Job 1 still runs engine 1.
+    assert qdel() == ["2.hpc05"]
+    assert scancel() == ["3"]
+    assert culler.job_ids == {1: ("qdel", "1.hpc05")}
+
+    culler.release([1])
+    assert qdel() == ["2.hpc05", "1.hpc05"]
+
+
+def test_release_batches_job_ids(culler, stubs):
+    scancel = stubs("scancel")
+    culler.job_ids = {eid: ("scancel", str(100 + eid)) for eid in range(4)}
+    culler.release([0, 1, 2, 3])
+    assert scancel() == ["100 101 102 103"]
+
+
+def test_release_survives_failing_cancel(culler, stubs):
+    qdel = stubs("qdel", exit_code=1)
+    culler.job_ids = {0: ("qdel", "1.hpc05")}
+    culler.release([0])
+    assert qdel() == ["1.hpc05"]
+    assert culler.activity.ids() == [1, 2, 3]
+
+
+def test_cull_idle_keeps_min_engines(culler, stubs):
+    qdel = stubs("qdel")
+    culler.min_engines = 2
+    culler.job_ids = {eid: ("qdel", f"{eid}.hpc05") for eid in range(4)}
+    culler.activity.set_busy(3, True, time.time())
+    for eid in range(3):
+        culler.activity.last_active[eid] = time.time() - 20 + eid
+    culler.cull_idle()
+    # The busy engine 3 and the most recently active idle engine 2 are kept.
+    assert sorted(culler.client.shut_down) == [0, 1]
+    assert qdel() == ["0.hpc05 1.hpc05"]